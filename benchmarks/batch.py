@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from item_scrapers import batch
+
+from sizematch.protobuf.items.items_pb2 import Item, Lang
+from pika import frame, spec
+import pika
+import argparse
+import random
+import json
+import time
+
+FRAME_MAX = 131072
+
+
+def make_items(count):
+    rand = random.Random(count)
+    return [
+        Item(
+            source='example',
+            lang=Lang.Value('EN'),
+            brand='example',
+            urls=['https://www.example.com/en/p/{}-{}/'.format(
+                '-'.join(rand.choice(['chair', 'oak', 'table', 'white',
+                                      'lamp', 'large', 'storage'])
+                         for _ in range(4)),
+                rand.randrange(10 ** 8)
+            )]
+        )
+        for _ in range(count)
+    ]
+
+
+def marshal(body, properties):
+    # Bytes sent for one message: method, content header and body frames
+    frames = [
+        frame.Method(1, spec.Basic.Publish(
+            exchange='sizematch-items', routing_key='items.parse.example',
+            mandatory=True)),
+        frame.Header(1, len(body), properties)
+    ]
+    for offset in range(0, len(body), FRAME_MAX - 8):
+        frames.append(frame.Body(1, body[offset:offset + FRAME_MAX - 8]))
+    return sum(len(f.marshal()) for f in frames)
+
+
+def single(items):
+    messages = []
+    for item in items:
+        properties = pika.BasicProperties(
+            app_id='item-scrapers',
+            content_type='application/protobuf',
+            delivery_mode=1)
+        messages.append(marshal(item.SerializeToString(), properties))
+    return messages
+
+
+def batched(items, batch_size, compression):
+    messages = []
+    for start in range(0, len(items), batch_size):
+        records = [
+            batch.encode_record(item.SerializeToString())
+            for item in items[start:start + batch_size]
+        ]
+        properties = pika.BasicProperties(
+            app_id='item-scrapers',
+            content_type=batch.CONTENT_TYPE,
+            content_encoding=compression,
+            delivery_mode=1)
+        messages.append(marshal(
+            batch.encode_batch(records, compression), properties
+        ))
+    return messages
+
+
+def measure(name, func, items, *args):
+    start = time.perf_counter()
+    messages = func(items, *args)
+    elapsed = time.perf_counter() - start
+    return {
+        'mode': name,
+        'messages': len(messages),
+        'wire_bytes': sum(messages),
+        'bytes_per_item': round(sum(messages) / len(items), 1),
+        'items_per_second': round(len(items) / elapsed)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Single item messages against batches')
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    items = make_items(args.count)
+    results = [measure('single', single, items)]
+    for compression in [None] + sorted(batch.CODECS):
+        results.append(measure(
+            'batch-{}'.format(compression or 'raw'), batched, items,
+            args.batch_size, compression
+        ))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from pika import frame, spec
+
+from collections import deque
+import selectors
+import random
+import socket
+import struct
+import heapq
+import time
+
+PROTOCOL_HEADER = b'AMQP\x00\x00\x09\x01'
+FRAME_HEADER = struct.Struct('>BHI')
+FRAME_END_SIZE = 1
+METHOD_ID = struct.Struct('>I')
+BODY_SIZE = struct.Struct('>Q')
+
+
+class _Channel:
+    def __init__(self):
+        self.confirming = False
+        self.delivery_tag = 0
+        self.body_left = None  # Of the message being received
+        self.confirms = deque()  # Due time, delivery tag and whether acked
+
+
+class _Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.started = False
+        self.closing = False
+        self.channels = {}
+
+
+class FakeBroker:
+    # Just enough of an AMQP 0-9-1 broker for a publisher: connection and
+    # channels, declarations, publisher confirms and connection blocking.
+    # Published messages are dropped once confirmed, after confirm_latency
+    # seconds, nack_rate of them being nacked. Every block_every seconds
+    # the connections are blocked for block_duration seconds.
+    def __init__(self, host='127.0.0.1', port=0, confirm_latency=0.,
+                 nack_rate=0., block_every=0., block_duration=1.,
+                 frame_max=131072, seed=0):
+        self.confirm_latency = confirm_latency
+        self.nack_rate = nack_rate
+        self.block_every = block_every
+        self.block_duration = block_duration
+        self.frame_max = frame_max
+        self.stats = {'connections': 0, 'messages': 0, 'bytes': 0,
+                      'acks': 0, 'nacks': 0, 'blocks': 0}
+
+        self._rand = random.Random(seed)
+        self._connections = set()
+        self._timers = []
+        self._selector = selectors.DefaultSelector()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen()
+        self.port = self._server.getsockname()[1]
+
+    def serve_forever(self):
+        self._selector.register(self._server, selectors.EVENT_READ)
+        if self.block_every:
+            self._add_timer(self.block_every, self._block)
+
+        while True:
+            for key, _ in self._selector.select(self._get_timeout()):
+                if key.fileobj is self._server:
+                    self._accept()
+                else:
+                    self._read(key.data)
+            self._run_timers()
+            self._send_confirms()
+
+    def _get_timeout(self):
+        due = [when for when, _, _ in self._timers[:1]]
+        due.extend(
+            channel.confirms[0][0]
+            for connection in self._connections
+            for channel in connection.channels.values()
+            if channel.confirms
+        )
+        if not due:
+            return None
+        return max(min(due) - time.monotonic(), 0)
+
+    def _add_timer(self, delay, callback):
+        heapq.heappush(
+            self._timers, (time.monotonic() + delay, id(callback), callback)
+        )
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, callback = heapq.heappop(self._timers)
+            callback()
+
+    def _block(self):
+        self.stats['blocks'] += 1
+        self._broadcast(spec.Connection.Blocked(reason='low on memory'))
+        self._add_timer(self.block_duration, self._unblock)
+
+    def _unblock(self):
+        self._broadcast(spec.Connection.Unblocked())
+        self._add_timer(self.block_every, self._block)
+
+    def _broadcast(self, method):
+        for connection in list(self._connections):
+            self._send(connection, 0, method)
+
+    def _accept(self):
+        sock, _ = self._server.accept()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = _Connection(sock)
+        self._connections.add(connection)
+        self._selector.register(sock, selectors.EVENT_READ, connection)
+        self.stats['connections'] += 1
+
+    def _close(self, connection):
+        if connection not in self._connections:
+            return
+        self._connections.discard(connection)
+        self._selector.unregister(connection.sock)
+        connection.sock.close()
+
+    def _send(self, connection, channel, method):
+        try:
+            connection.sock.sendall(frame.Method(channel, method).marshal())
+        except OSError:
+            self._close(connection)
+
+    def _read(self, connection):
+        try:
+            data = connection.sock.recv(1 << 20)
+        except OSError:
+            data = b''
+        if not data:
+            self._close(connection)
+            return
+
+        buffer = connection.buffer
+        buffer += data
+        if not connection.started:
+            if len(buffer) < len(PROTOCOL_HEADER):
+                return
+            del buffer[:len(PROTOCOL_HEADER)]
+            connection.started = True
+            self._send(connection, 0, spec.Connection.Start(
+                server_properties={
+                    'product': 'fake-broker',
+                    'capabilities': {
+                        'publisher_confirms': True,
+                        'basic.nack': True,
+                        'connection.blocked': True
+                    }
+                }
+            ))
+
+        # Only method frames are decoded, content frames are just counted
+        offset = 0
+        while len(buffer) - offset >= FRAME_HEADER.size:
+            frame_type, channel, size = FRAME_HEADER.unpack_from(
+                buffer, offset
+            )
+            start = offset + FRAME_HEADER.size
+            end = start + size
+            if end + FRAME_END_SIZE > len(buffer):
+                break
+
+            if frame_type == spec.FRAME_METHOD:
+                self._on_method(connection, channel, buffer, start, end)
+            elif frame_type == spec.FRAME_HEADER:
+                body_size, = BODY_SIZE.unpack_from(buffer, start + 4)
+                self._on_content(connection, channel, body_size)
+            elif frame_type == spec.FRAME_BODY:
+                self._on_content(connection, channel, None, size)
+            offset = end + FRAME_END_SIZE
+        del buffer[:offset]
+
+        if connection.closing:
+            self._close(connection)
+
+    def _on_method(self, connection, channel, buffer, start, end):
+        index, = METHOD_ID.unpack_from(buffer, start)
+        if index == spec.Basic.Publish.INDEX:
+            connection.channels[channel].body_left = -1
+            return
+
+        method = spec.methods[index]()
+        method.decode(bytes(buffer[start:end]), METHOD_ID.size)
+        reply = None
+        if isinstance(method, spec.Connection.StartOk):
+            reply = spec.Connection.Tune(
+                channel_max=2047, frame_max=self.frame_max, heartbeat=0
+            )
+        elif isinstance(method, spec.Connection.Open):
+            reply = spec.Connection.OpenOk()
+        elif isinstance(method, spec.Connection.Close):
+            reply = spec.Connection.CloseOk()
+            connection.closing = True
+        elif isinstance(method, spec.Connection.CloseOk):
+            connection.closing = True
+        elif isinstance(method, spec.Channel.Open):
+            connection.channels[channel] = _Channel()
+            reply = spec.Channel.OpenOk()
+        elif isinstance(method, spec.Channel.Close):
+            connection.channels.pop(channel, None)
+            reply = spec.Channel.CloseOk()
+        elif isinstance(method, spec.Exchange.Declare):
+            reply = None if method.nowait else spec.Exchange.DeclareOk()
+        elif isinstance(method, spec.Queue.Declare):
+            reply = None if method.nowait else spec.Queue.DeclareOk(
+                queue=method.queue, message_count=0, consumer_count=0
+            )
+        elif isinstance(method, spec.Queue.Bind):
+            reply = None if method.nowait else spec.Queue.BindOk()
+        elif isinstance(method, spec.Confirm.Select):
+            connection.channels[channel].confirming = True
+            reply = None if method.nowait else spec.Confirm.SelectOk()
+
+        if reply is not None:
+            self._send(connection, channel, reply)
+
+    def _on_content(self, connection, channel, body_size, size=0):
+        state = connection.channels.get(channel)
+        if state is None or state.body_left is None:
+            return
+
+        if body_size is not None:
+            state.body_left = body_size
+        else:
+            state.body_left -= size
+        self.stats['bytes'] += size
+        if state.body_left:
+            return
+
+        state.body_left = None
+        self.stats['messages'] += 1
+        if state.confirming:
+            state.delivery_tag += 1
+            state.confirms.append((
+                time.monotonic() + self.confirm_latency,
+                state.delivery_tag,
+                self._rand.random() >= self.nack_rate
+            ))
+
+    def _send_confirms(self):
+        # Consecutive acks due at once are sent as a single multiple ack,
+        # as RabbitMQ does
+        now = time.monotonic()
+        for connection in list(self._connections):
+            for number, channel in list(connection.channels.items()):
+                acked = None
+                while channel.confirms and channel.confirms[0][0] <= now:
+                    _, tag, ack = channel.confirms.popleft()
+                    if ack:
+                        self.stats['acks'] += 1
+                        acked = tag
+                        continue
+
+                    if acked is not None:
+                        self._send(connection, number, spec.Basic.Ack(
+                            delivery_tag=acked, multiple=True
+                        ))
+                        acked = None
+                    self.stats['nacks'] += 1
+                    self._send(connection, number, spec.Basic.Nack(
+                        delivery_tag=tag, multiple=False, requeue=False
+                    ))
+
+                if acked is not None:
+                    self._send(connection, number, spec.Basic.Ack(
+                        delivery_tag=acked, multiple=True
+                    ))
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from item_scrapers import Scraper, Source, __version__
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import multiprocessing
+import platform
+import resource
+import argparse
+import random
+import yaml
+import json
+import time
+import re
+
+PADDING = '<div class="item"><span>lorem ipsum</span></div>\n'
+CATEGORY_PATH = re.compile('^/cat/category-([0-9]+)/?$')
+
+
+class Catalog:
+    # Category tree of a given depth and fan-out, every category listing
+    # its subcategories and products over several pages
+    def __init__(self, depth, fan_out, pages, products_per_page, page_size):
+        self.pages = pages
+        self.products_per_page = products_per_page
+        self.page_size = page_size
+
+        # Categories are numbered breadth first, 0 being the base category
+        self.children = {0: []}
+        level = [0]
+        for _ in range(depth):
+            next_level = []
+            for parent in level:
+                for _ in range(fan_out):
+                    category = len(self.children)
+                    self.children[category] = []
+                    self.children[parent].append(category)
+                    next_level.append(category)
+            level = next_level
+
+    def get_product_count(self):
+        # The base category only lists the top-level ones
+        return (len(self.children) - 1) * self.pages * self.products_per_page
+
+    def render(self, category, page):
+        if page > self.pages:
+            return '<html></html>'
+
+        parts = ['<html><nav data-pages="{}"></nav>'.format(self.pages)]
+        parts.extend(
+            '<a href="/cat/category-{}/">c</a>\n'.format(child)
+            for child in self.children[category]
+        )
+        if category:
+            first = ((category - 1) * self.pages + page - 1) * \
+                self.products_per_page
+            parts.extend(
+                '<a href="/p/product-{}/">p</a>\n'.format(product)
+                for product in range(first, first + self.products_per_page)
+            )
+
+        length = sum(len(part) for part in parts)
+        if length < self.page_size:
+            parts.append(PADDING * ((self.page_size - length) //
+                                    len(PADDING)))
+        parts.append('</html>')
+        return ''.join(parts)
+
+
+def serve(catalog, latency, error_rate, seed, counters, ready):
+    rand = random.Random(seed)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            page = int(parse_qs(url.query).get('page', ['1'])[0])
+            match = CATEGORY_PATH.match(url.path)
+            if url.path in ('', '/'):
+                category = 0
+            elif match and int(match.group(1)) in catalog.children:
+                category = int(match.group(1))
+            else:
+                category = None
+
+            if latency:
+                time.sleep(latency)
+
+            with counters.get_lock():
+                counters[0] += 1
+                failed = rand.random() < error_rate
+                if failed:
+                    counters[1] += 1
+
+            if category is None or failed:
+                self.send_response(404 if category is None else 503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            body = catalog.render(category, page).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    ready.send(server.server_address[1])
+    server.serve_forever()
+
+
+def make_source_yaml(port, args, engine):
+    # Source configured as in the sources directory
+    pagination = {'mode': 'queryParam', 'key': 'page', 'end': 1000}
+    if args.page_count:
+        pagination['pageCountRegex'] = 'data-pages="([0-9]+)"'
+
+    return yaml.safe_dump({
+        'langs': ['en'],
+        'baseUrl': 'http://127.0.0.1:{}'.format(port),
+        'parallelism': 1,
+        'engine': engine,
+        'http': {'poolSize': args.concurrency, 'retries': 0},
+        'concurrency': {'global': args.concurrency,
+                        'perHost': args.concurrency},
+        'extraction': {'mode': args.extraction_mode},
+        'categories': {
+            'urlRegex': '/cat/category-(?P<id>[0-9]+)',
+            'pagination': pagination
+        },
+        'products': {'urlRegex': '/p/product-(?P<id>[0-9]+)'}
+    }, default_flow_style=False)
+
+
+def crawl(source_yaml, counters, results):
+    # Run in its own process, so that its peak RSS and CPU time are only
+    # those of this crawl
+    source = Source('benchmark', yaml.safe_load(source_yaml))
+    requests_before, errors_before = counters[:]
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_start = usage.ru_utime + usage.ru_stime
+    start = time.perf_counter()
+    items = sum(1 for _ in Scraper().scrape(source))
+    elapsed = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    extraction = source.get_extractor().get_stats()
+
+    pages = counters[0] - requests_before
+    results.send({
+        'engine': source.get_engine(),
+        'pages': pages,
+        'errors': counters[1] - errors_before,
+        'items': items,
+        'seconds': round(elapsed, 3),
+        'pages_per_second': round(pages / elapsed, 1),
+        'items_per_second': round(items / elapsed, 1),
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime - cpu_start, 3),
+        'extraction_seconds': extraction['seconds'],
+        'extraction_mb_per_second': extraction['throughput'],
+        # Kilobytes on Linux
+        'peak_rss_mb': round(usage.ru_maxrss / 1024, 1)
+    })
+
+
+def run(port, counters, args, engine):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=crawl,
+        args=(make_source_yaml(port, args, engine), counters, sender)
+    )
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+
+def compare(runs, baseline):
+    # Relative change of every metric against the run of the same engine
+    # in a previous result file
+    previous = {run['engine']: run for run in baseline['runs']}
+    changes = {}
+    for run in runs:
+        base = previous.get(run['engine'])
+        if base is None:
+            continue
+        changes[run['engine']] = {
+            key: round(run[key] / base[key] - 1, 3)
+            for key in ('pages_per_second', 'items_per_second',
+                        'cpu_seconds', 'peak_rss_mb')
+            if base.get(key)
+        }
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Crawl throughput against a local synthetic catalog')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fan-out', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=3,
+                        help='pages per category')
+    parser.add_argument('--products-per-page', type=int, default=24)
+    parser.add_argument('--page-size', type=int, default=100000,
+                        help='page size in characters')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='response delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--engine', nargs='+', default=['sync', 'async'],
+                        choices=['sync', 'async'])
+    parser.add_argument('--extraction-mode', default='text',
+                        choices=['text', 'chunked'])
+    parser.add_argument('--page-count', action='store_true',
+                        help='read the page count from the first page')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to write results to')
+    parser.add_argument('--baseline', help='JSON file to compare against')
+    args = parser.parse_args()
+
+    catalog = Catalog(args.depth, args.fan_out, args.pages,
+                      args.products_per_page, args.page_size)
+    counters = multiprocessing.Array('l', 2)  # Requests and errors
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    server = multiprocessing.Process(
+        target=serve,
+        args=(catalog, args.latency, args.error_rate, args.seed, counters,
+              sender),
+        daemon=True
+    )
+    server.start()
+    port = receiver.recv()
+
+    try:
+        runs = [run(port, counters, args, engine) for engine in args.engine]
+    finally:
+        server.terminate()
+
+    results = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'parameters': dict(vars(args), categories=len(catalog.children) - 1,
+                           products=catalog.get_product_count()),
+        'runs': runs
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['changes'] = compare(runs, json.load(f))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from item_scrapers.extractor import URL_REGEX, Extractor, compile_url_regex
+from item_scrapers.utils import urljoin
+
+import argparse
+import random
+import json
+import time
+import re
+
+CATEGORIES_REGEX = '/cat/(?P<slug>[a-z-]+)-(?P<id>[0-9]+)'
+PRODUCTS_REGEX = '/p/(?P<slug>[a-z-]+)-(?P<id>[0-9]+)'
+BASE_URL = 'https://www.example.com/en'
+
+
+def generate_page(size, links_ratio=0.02):
+    # Listing page of about size characters, mostly markup with a few links
+    rand = random.Random(size)
+    parts = []
+    length = 0
+    while length < size:
+        draw = rand.random()
+        if draw < links_ratio / 2:
+            part = '<a href="/cat/category-{}/">c</a>'.format(
+                rand.randrange(1000))
+        elif draw < links_ratio:
+            part = '<a href="/p/product-name-{}/?x=1">p</a>'.format(
+                rand.randrange(100000))
+        else:
+            part = '<div class="item"><span>lorem ipsum</span></div>'
+        parts.append(part)
+        length += len(part)
+    return '\n'.join(parts)
+
+
+def two_pass(html):
+    # Extraction as done before the single-pass extractor
+    categories_regex = compile_url_regex(CATEGORIES_REGEX)
+    products_regex = compile_url_regex(PRODUCTS_REGEX)
+    categories = {
+        (m.group('id'), urljoin(BASE_URL, m.group('url')),
+         m.groupdict().get('slug'))
+        for m in categories_regex.finditer(html)
+    }
+    products = {
+        (m.group('id'), urljoin(BASE_URL, m.group('url')),
+         m.groupdict().get('slug'))
+        for m in products_regex.finditer(html)
+    }
+    return categories, products
+
+
+def alternation(html):
+    # Both patterns in a single scan, slower as the regex engine can no
+    # longer search for a literal prefix
+    regex = re.compile('{}|{}'.format(
+        URL_REGEX.format(CATEGORIES_REGEX).replace('?P<', '?P<c_'),
+        URL_REGEX.format(PRODUCTS_REGEX).replace('?P<', '?P<p_')
+    ))
+    categories = set()
+    products = set()
+    for m in regex.finditer(html):
+        if m.start('c_url') != -1:
+            categories.add((m.group('c_id'),
+                            urljoin(BASE_URL, m.group('c_url'))))
+        else:
+            products.add((m.group('p_id'),
+                          urljoin(BASE_URL, m.group('p_url'))))
+    return categories, products
+
+
+def measure(func, html, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(html)
+    elapsed = time.perf_counter() - start
+    return round(len(html) * repeat / elapsed / 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extraction throughput')
+    parser.add_argument('--size', type=int, default=2000000,
+                        help='page size in characters')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    html = generate_page(args.size)
+    extractor = Extractor(CATEGORIES_REGEX, PRODUCTS_REGEX)
+    prefix = BASE_URL + '/'
+
+    print(json.dumps({
+        'size': len(html),
+        'two_pass_mb_per_s': measure(two_pass, html, args.repeat),
+        'alternation_mb_per_s': measure(alternation, html, args.repeat),
+        'extractor_mb_per_s': measure(
+            lambda page: extractor.extract(page, prefix), html, args.repeat
+        )
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from item_scrapers.models import Product
+from item_scrapers.store import FingerprintSet, BloomFilter, ProductStore
+
+import tracemalloc
+import argparse
+import json
+
+
+def make_products(count):
+    return (
+        Product(
+            id=str(1000000 + i),
+            urls=['https://www.example.com/en/p/product-name-{}'.format(i)],
+            slug='product-name'
+        )
+        for i in range(count)
+    )
+
+
+def measure(build, count):
+    # Bytes allocated per product by the structure built
+    tracemalloc.start()
+    structure = build(count)  # noqa: F841
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return round(size / count, 1)
+
+
+def build_product_set(count):
+    return set(make_products(count))
+
+
+def build_product_store(count):
+    store = ProductStore()
+    store.extend(make_products(count))
+    return store
+
+
+def build_id_set(count):
+    return {product.id for product in make_products(count)}
+
+
+def build_fingerprint_set(count):
+    ids = FingerprintSet()
+    ids.update(product.id for product in make_products(count))
+    return ids
+
+
+def build_bloom_filter(count):
+    ids = BloomFilter(capacity=count, error_rate=0.001)
+    ids.update(product.id for product in make_products(count))
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes per product')
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+
+    print(json.dumps({
+        'count': args.count,
+        'products': {
+            'set_of_product': measure(build_product_set, args.count),
+            'product_store': measure(build_product_store, args.count)
+        },
+        'dedupe': {
+            'set_of_id': measure(build_id_set, args.count),
+            'fingerprint_set': measure(build_fingerprint_set, args.count),
+            'bloom_filter': measure(build_bloom_filter, args.count)
+        }
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,10 @@
 
 __version__ = "0.0.1"
 
-from .publisher import Publisher  # noqa: F401
+from .models import Tombstone  # noqa: F401
+from .outbox import Outbox  # noqa: F401
+from .publisher import Publisher, PublisherPool  # noqa: F401
+from .registry import SourceRegistry  # noqa: F401
 from .scraper import Scraper  # noqa: F401
 from .source import Source  # noqa: F401
+from .stats import ScrapeStats  # noqa: F401
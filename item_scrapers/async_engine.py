@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from .metrics import CATEGORY_PAGES
+from .models import CategoryState
+from .stats import PhaseTimings
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from urllib.parse import urlsplit
+import itertools
+import asyncio
+
+
+class AsyncEngine:
+    # Categories are crawled concurrently. The pages of a category are
+    # fetched concurrently too once its page count is known from the first
+    # one, otherwise in order, as its end is only known once a page brings
+    # nothing new. Blocking requests run in a thread pool to reuse pooled
+    # sessions.
+
+    def __init__(self, scraper):
+        self._scraper = scraper
+
+    def crawl(self, source, lang, brand, max_categories,
+              max_products_per_category, on_products, checkpoint=None,
+              unit=None, timings=None):
+        return asyncio.run(self._crawl(
+            source, lang, brand,
+            max_categories, max_products_per_category, on_products,
+            checkpoint, unit, timings or PhaseTimings()
+        ))
+
+    async def _crawl(self, source, lang, brand, max_categories,
+                     max_products_per_category, on_products, checkpoint,
+                     unit, timings):
+        crawl = _Crawl(self._scraper, source, lang, brand,
+                       max_categories, max_products_per_category,
+                       on_products, checkpoint, unit, timings)
+
+        with ThreadPoolExecutor(
+            max_workers=source.get_max_concurrency()
+        ) as executor:
+            crawl.executor = executor
+            await crawl.run()
+
+        self._scraper._count_dropped(crawl.frontier, timings)
+
+        return crawl.categories, crawl.products
+
+
+class _Crawl:
+    def __init__(self, scraper, source, lang, brand, max_categories,
+                 max_products_per_category, on_products, checkpoint, unit,
+                 timings):
+        self.scraper = scraper
+        self.source = source
+        self.lang = lang
+        self.brand = brand
+        self.max_products_per_category = max_products_per_category
+        self.checkpoint = checkpoint
+        self.timings = timings
+        self.executor = None
+
+        self.categories, self.products, self.frontier, self.on_products = \
+            scraper._init_crawl(
+                source, lang, brand, max_categories, on_products, checkpoint,
+                unit
+            )
+        self.in_flight = {}
+
+        self._global_semaphore = asyncio.Semaphore(
+            source.get_max_concurrency()
+        )
+        self._host_semaphores = defaultdict(
+            lambda: asyncio.Semaphore(source.get_max_concurrency_per_host())
+        )
+
+    async def run(self):
+        # Keep as many categories in flight as fetches are allowed, the
+        # frontier decides which one comes next
+        pending = set()
+        try:
+            while self.frontier or pending:
+                while self.frontier and \
+                      len(pending) < self.source.get_max_concurrency():
+                    category, depth = self.frontier.pop()
+                    task = asyncio.ensure_future(
+                        self.scrape_category(category, depth)
+                    )
+                    self.in_flight[task] = (category, depth, 0)
+                    pending.add(task)
+
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    del self.in_flight[task]
+                    category, depth, state = task.result()
+                    CATEGORY_PAGES.labels(self.source.name).observe(
+                        state.pages
+                    )
+                    if depth:
+                        self.categories.add(category.id)
+
+                    for cat in state.categories:
+                        self.frontier.push(cat, depth + 1, state.get_yield())
+
+                    if self.checkpoint is not None:
+                        if depth:
+                            self.checkpoint.add_category(category.id)
+                        self.checkpoint.add_products(state.new_products)
+
+                if self.checkpoint is not None:
+                    with self.timings.measure('checkpoint'):
+                        self.checkpoint.maybe_save(
+                            self.frontier, self.in_flight.values()
+                        )
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def scrape_category(self, category, depth):
+        state = CategoryState(self.products, self.max_products_per_category,
+                              self.on_products, self.checkpoint is not None)
+
+        pages = self.source.paginate_category(
+            category, self.lang, self.brand
+        )
+        url, params = next(pages)
+        new_categories, new_products, page_count = await self.scrape_page(
+            url, dict(params), self.source.has_page_count()
+        )
+        if not self.update(state, new_categories, new_products,
+                           page_count is None):
+            return category, depth, state
+
+        if page_count is None:
+            for url, params in pages:
+                new_categories, new_products, _ = await self.scrape_page(
+                    url, dict(params)
+                )
+                if not self.update(state, new_categories, new_products):
+                    break
+            return category, depth, state
+
+        # Bounded by the semaphores, the remaining pages are all scheduled
+        # and merged in order
+        tasks = [
+            asyncio.ensure_future(self.scrape_page(url, dict(params)))
+            for url, params in itertools.islice(pages, max(page_count - 1, 0))
+        ]
+        try:
+            for task in tasks:
+                new_categories, new_products, _ = await task
+                if not self.update(state, new_categories, new_products,
+                                   False):
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return category, depth, state
+
+    def update(self, state, new_categories, new_products, probe=True):
+        # Not measured across awaits, as other tasks run meanwhile
+        with self.timings.measure('dedupe'):
+            return state.update(new_categories, new_products, probe)
+
+    async def scrape_page(self, url, params, count_pages=False):
+        # Wait for our turn outside of the semaphores, so that rate limited
+        # requests do not hold in-flight slots
+        delay = self.scraper._get_rate_limit_delay(url, self.source)
+        if delay:
+            await asyncio.sleep(delay)
+            self.timings.add('rate_limit', delay)
+
+        host = urlsplit(url).netloc
+        async with self._global_semaphore, self._host_semaphores[host]:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                self.scraper._scrape_page,
+                url, params, self.source, self.lang, self.brand, count_pages,
+                self.timings
+            )
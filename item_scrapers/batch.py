@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import struct
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Several serialized items in one message, each one prefixed with its flags
+# and length. The message content encoding tells its compression, if any.
+CONTENT_TYPE = 'application/x-protobuf-batch'
+
+RECORD_HEADER = struct.Struct('>BI')
+TOMBSTONE = 0x01
+
+
+def _get_codecs():
+    codecs = {
+        'zlib': (zlib.compress, zlib.decompress)
+    }
+    if lz4 is not None:
+        codecs['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+    return codecs
+
+
+CODECS = _get_codecs()
+
+
+def check_compression(compression):
+    if compression is not None and compression not in CODECS:
+        raise ValueError('Unsupported compression: {}'.format(compression))
+
+
+def encode_record(body, message_type=None):
+    flags = TOMBSTONE if message_type == 'tombstone' else 0
+    return RECORD_HEADER.pack(flags, len(body)) + body
+
+
+def encode_batch(records, compression=None):
+    body = b''.join(records)
+    if compression is not None:
+        compress, _ = CODECS[compression]
+        body = compress(body)
+    return body
+
+
+def decode_batch(body, content_encoding=None):
+    # Yields the message type and serialized item of each record, the type
+    # being None or 'tombstone' as for single item messages
+    if content_encoding is not None:
+        check_compression(content_encoding)
+        _, decompress = CODECS[content_encoding]
+        body = decompress(body)
+
+    view = memoryview(body)
+    offset = 0
+    while offset < len(view):
+        flags, length = RECORD_HEADER.unpack_from(view, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(view):
+            raise ValueError('Truncated batch record')
+        message_type = 'tombstone' if flags & TOMBSTONE else None
+        yield message_type, bytes(view[offset:offset + length])
+        offset += length
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from .models import Product, Category
+
+import threading
+import sqlite3
+import fcntl
+import json
+import time
+import os
+
+
+class CheckpointStore:
+    # Crawl progress of a source, saved to a local SQLite database: the
+    # frontier, visited categories and seen products of every lang/brand
+    # combination, and which combinations are complete. Products are only
+    # seen, they are emitted again on resume as they may not have been
+    # delivered.
+    def __init__(self, path, lock_fd=None):
+        self.path = path
+        self._lock_fd = lock_fd
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS combinations (
+                combination TEXT PRIMARY KEY,
+                done INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS frontier (
+                combination TEXT NOT NULL,
+                id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                slug TEXT,
+                depth INTEGER NOT NULL,
+                score REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS categories (
+                combination TEXT NOT NULL,
+                id TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS products (
+                combination TEXT NOT NULL,
+                id TEXT NOT NULL,
+                urls TEXT NOT NULL,
+                slug TEXT
+            );
+            CREATE INDEX IF NOT EXISTS frontier_combination
+                ON frontier (combination);
+            CREATE INDEX IF NOT EXISTS categories_combination
+                ON categories (combination);
+            CREATE INDEX IF NOT EXISTS products_combination
+                ON products (combination);
+        ''')
+
+    @staticmethod
+    def create(directory, source):
+        # The checkpoint of a source belongs to one scrape at a time, held
+        # with flock until closed. Returns None while another one holds it.
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{}.sqlite'.format(source.name))
+        fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+
+        return CheckpointStore(path, fd)
+
+    @staticmethod
+    def _get_key(lang, brand):
+        return json.dumps([lang, brand])
+
+    def is_done(self, lang, brand):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT done FROM combinations WHERE combination = ?',
+                (self._get_key(lang, brand),)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def load(self, lang, brand):
+        # Returns the frontier entries, visited category IDs and seen
+        # products of a combination, None if nothing was saved
+        key = self._get_key(lang, brand)
+        with self._lock:
+            if self._db.execute(
+                'SELECT 1 FROM combinations WHERE combination = ?', (key,)
+            ).fetchone() is None:
+                return None
+
+            frontier = [
+                (Category(id=row[0], url=row[1], slug=row[2]), row[3], row[4])
+                for row in self._db.execute(
+                    'SELECT id, url, slug, depth, score FROM frontier \
+WHERE combination = ?', (key,))
+            ]
+            categories = {
+                row[0] for row in self._db.execute(
+                    'SELECT id FROM categories WHERE combination = ?', (key,))
+            }
+            products = [
+                Product(id=row[0], urls=json.loads(row[1]), slug=row[2])
+                for row in self._db.execute(
+                    'SELECT id, urls, slug FROM products \
+WHERE combination = ?', (key,))
+            ]
+
+        return frontier, categories, products
+
+    def save(self, lang, brand, frontier, new_categories, new_products):
+        # The frontier is replaced while categories and products are
+        # appended, only those found since the previous save are given
+        key = self._get_key(lang, brand)
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR IGNORE INTO combinations (combination) VALUES (?)',
+                (key,)
+            )
+            self._db.execute(
+                'DELETE FROM frontier WHERE combination = ?', (key,)
+            )
+            self._db.executemany(
+                'INSERT INTO frontier VALUES (?, ?, ?, ?, ?, ?)',
+                ((key, str(category.id), category.url, category.slug,
+                  depth, score) for category, depth, score in frontier)
+            )
+            self._db.executemany(
+                'INSERT INTO categories VALUES (?, ?)',
+                ((key, str(id)) for id in new_categories)
+            )
+            self._db.executemany(
+                'INSERT INTO products VALUES (?, ?, ?, ?)',
+                ((key, str(product.id), json.dumps(product.urls),
+                  product.slug) for product in new_products)
+            )
+
+    def mark_done(self, lang, brand):
+        # Its products are kept, to be emitted again on resume
+        key = self._get_key(lang, brand)
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO combinations VALUES (?, 1)', (key,)
+            )
+
+    def clear(self):
+        with self._lock, self._db:
+            for table in ('combinations', 'frontier', 'categories',
+                          'products'):
+                self._db.execute('DELETE FROM {}'.format(table))
+
+    def close(self):
+        self._db.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+class CombinationCheckpoint:
+    # Tracks the progress of one lang/brand crawl and saves it to the store
+    # at most every interval seconds, between two categories
+    def __init__(self, store, lang, brand, interval):
+        self.store = store
+        self.lang = lang
+        self.brand = brand
+        self.interval = interval
+        self.restored_products = []
+        self._new_categories = []
+        self._new_products = []
+        self._last_save = time.monotonic()
+
+    def restore(self, frontier, categories, products):
+        saved = self.store.load(self.lang, self.brand)
+        if saved is None:
+            return False
+
+        entries, saved_categories, self.restored_products = saved
+        categories.update(saved_categories)
+        products.update(product.id for product in self.restored_products)
+        frontier.restore(entries, saved_categories)
+
+        return True
+
+    def add_category(self, id):
+        self._new_categories.append(id)
+
+    def add_products(self, products):
+        # Only those of finished categories, so that the pages of those in
+        # flight still bring new products on resume
+        self._new_products.extend(products)
+
+    def maybe_save(self, frontier, in_flight=()):
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save(frontier, in_flight)
+
+    def save(self, frontier, in_flight=()):
+        # Categories in flight are saved back into the frontier, their
+        # pages will be fetched again on resume
+        self.store.save(
+            self.lang, self.brand,
+            list(in_flight) + frontier.snapshot(),
+            self._new_categories,
+            self._new_products
+        )
+        self._new_categories = []
+        self._new_products = []
+        self._last_save = time.monotonic()
+
+    def done(self):
+        self.store.save(
+            self.lang, self.brand, [], self._new_categories,
+            self._new_products
+        )
+        self._new_categories = []
+        self._new_products = []
+        self.store.mark_done(self.lang, self.brand)
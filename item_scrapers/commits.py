@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import logging
+
+
+class PendingCommits:
+    # Changes of a scrape that only hold once its items are delivered, such
+    # as the replacement of an index or the removal of a checkpoint. They
+    # are committed by whoever confirms delivery, otherwise discarded. Like
+    # an exit stack, the last one added runs first.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._closed = False
+
+    def add(self, commit=None, discard=None):
+        with self._lock:
+            if not self._closed:
+                self._callbacks.append((commit, discard))
+                return
+
+        # Too late, delivery was settled already
+        if discard is not None:
+            discard()
+
+    def __len__(self):
+        return len(self._callbacks)
+
+    def commit(self):
+        self._run(0)
+
+    def discard(self):
+        self._run(1)
+
+    def _run(self, i):
+        # Every callback runs even if one fails, the first error is raised
+        with self._lock:
+            callbacks, self._callbacks = self._callbacks, []
+            self._closed = True
+
+        error = None
+        for callback in reversed([c[i] for c in callbacks]):
+            if callback is None:
+                continue
+            try:
+                callback()
+            except Exception as e:
+                logging.exception('Pending commit failed')
+                if error is None:
+                    error = e
+
+        if error is not None:
+            raise error
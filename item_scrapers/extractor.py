@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from .metrics import EXTRACTION_SECONDS
+from .models import Product, Category
+
+import itertools
+import hashlib
+import json
+import threading
+import time
+import re
+
+
+URL_REGEX = '(?P<url>{})(?:\\?|/|#)'
+
+
+def compile_url_regex(regex):
+    return re.compile(URL_REGEX.format(regex))
+
+
+class Extractor:
+    # Finds the category and product URLs of a page with patterns compiled
+    # once per source. Both patterns are scanned separately on purpose: each
+    # starts with a literal that the regex engine searches for quickly, which
+    # a single alternation of both would defeat. The page count of a
+    # category, if it can be found at all, is only looked for on demand.
+    def __init__(self, categories_regex, products_regex,
+                 page_count_regex=None, name=''):
+        self.categories_regex = compile_url_regex(categories_regex)
+        self.products_regex = compile_url_regex(products_regex)
+        self.page_count_regex = None
+        if page_count_regex:
+            self.page_count_regex = re.compile(page_count_regex)
+
+        # Identifies what this extractor would find in a page
+        patterns = [self.categories_regex.pattern, self.products_regex.pattern]
+        if self.page_count_regex is not None:
+            patterns.append(self.page_count_regex.pattern)
+        self.fingerprint = hashlib.sha1(
+            json.dumps(patterns).encode('utf-8')
+        ).hexdigest()
+
+        self._categories_slug = 'slug' in self.categories_regex.groupindex
+        self._products_slug = 'slug' in self.products_regex.groupindex
+
+        self._seconds = EXTRACTION_SECONDS.labels(name)
+        self._lock = threading.Lock()
+        self.scanned = 0
+        self.seconds = 0.
+        self.pages = 0
+
+    def _make_category(self, match, url_prefix):
+        return Category(
+            id=match.group('id'),
+            url=url_prefix + match.group('url').strip('/'),
+            slug=match.group('slug') if self._categories_slug else None
+        )
+
+    def _make_product(self, match, url_prefix):
+        return Product(
+            id=match.group('id'),
+            urls=[url_prefix + match.group('url').strip('/')],
+            slug=match.group('slug') if self._products_slug else None
+        )
+
+    def extract(self, html, url_prefix):
+        start = time.perf_counter()
+        categories = {
+            self._make_category(match, url_prefix)
+            for match in self.categories_regex.finditer(html)
+        }
+        products = {
+            self._make_product(match, url_prefix)
+            for match in self.products_regex.finditer(html)
+        }
+
+        elapsed = time.perf_counter() - start
+        self._record(len(html), elapsed)
+        self._seconds.observe(elapsed)
+
+        return categories, products
+
+    def iter_extract(self, chunks, url_prefix, overlap):
+        # Extracts URLs from a page given as decoded chunks, yielding the
+        # categories and products found in every chunk. Only overlap
+        # characters are kept between chunks: a match starting before the
+        # last overlap characters of the buffer is complete as long as
+        # matches are shorter than overlap, any other one is looked for
+        # again once the next chunk has been appended.
+        scanners = (
+            (self.categories_regex, self._make_category),
+            (self.products_regex, self._make_product)
+        )
+        resume = [0] * len(scanners)
+        buf = ''
+        total = 0.
+
+        for chunk in itertools.chain(chunks, [None]):
+            final = chunk is None
+            if not final:
+                buf += chunk
+
+            start = time.perf_counter()
+            cut = len(buf) if final else len(buf) - overlap
+            if cut <= 0 and not final:
+                continue
+
+            found = (set(), set())
+            for i, (regex, make) in enumerate(scanners):
+                pos = resume[i]
+                for match in regex.finditer(buf, pos):
+                    if match.start() >= cut:
+                        break
+                    found[i].add(make(match, url_prefix))
+                    pos = match.end()
+                resume[i] = max(pos, cut)
+
+            # Drop what every scanner is done with
+            drop = min(resume)
+            buf = buf[drop:]
+            resume = [pos - drop for pos in resume]
+
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            self._record(drop, elapsed, pages=int(final))
+            if final:
+                self._seconds.observe(total)
+            yield found
+
+    def extract_chunks(self, chunks, url_prefix, overlap):
+        # Matches are gathered for the whole page on purpose rather than
+        # handed over as they are found: a page is probed for the end of
+        # its category, deduped and cached as a whole. Chunks bound the
+        # memory of the body, its matches are a few deduped URLs.
+        categories = set()
+        products = set()
+        for new_categories, new_products in self.iter_extract(
+            chunks, url_prefix, overlap
+        ):
+            categories.update(new_categories)
+            products.update(new_products)
+
+        return categories, products
+
+    def extract_page_count(self, html):
+        # Highest page count matched, so that a pattern matching every link
+        # of a pagination block works as well as one matching its total
+        if self.page_count_regex is None:
+            return None
+
+        counts = [
+            int(match.group('count') if 'count' in
+                self.page_count_regex.groupindex else match.group(1))
+            for match in self.page_count_regex.finditer(html)
+        ]
+        return max(counts) if counts else None
+
+    def scan_page_count(self, chunks, overlap, found):
+        # Passes the chunks through, storing the page count found in them
+        # into found[0]. Matches are expected to be shorter than overlap.
+        tail = ''
+        for chunk in chunks:
+            count = self.extract_page_count(tail + chunk)
+            if count is not None:
+                found[0] = max(found[0] or 0, count)
+            tail = (tail + chunk)[-overlap:]
+            yield chunk
+
+    def _record(self, scanned, seconds, pages=1):
+        with self._lock:
+            self.scanned += scanned
+            self.seconds += seconds
+            self.pages += pages
+
+    def get_stats(self):
+        # Throughput is given in millions of characters scanned per second
+        with self._lock:
+            return {
+                'pages': self.pages,
+                'scanned': self.scanned,
+                'seconds': round(self.seconds, 3),
+                'throughput': round(
+                    self.scanned / self.seconds / 1e6, 2
+                ) if self.seconds else 0.
+            }
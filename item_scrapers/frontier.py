@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import deque
+import itertools
+import heapq
+import abc
+
+
+class Frontier(abc.ABC):
+    # Categories waiting to be crawled. Every category is admitted at most
+    # once, which is where max_categories, max_depth and the size cap of the
+    # queue are enforced.
+    def __init__(self, max_categories=None, max_depth=None, max_size=None):
+        self.max_categories = max_categories
+        self.max_depth = max_depth
+        self.max_size = max_size
+        self.seen = set()
+        self.admitted = 0
+        self.dropped = 0
+        self.too_deep = 0
+        # Called with the ID of a category about to be admitted, the ones it
+        # rejects are crawled by another task
+        self.claim = None
+
+    def push(self, category, depth=0, score=0, root=False):
+        if category.id in self.seen:
+            return False
+
+        if not root:
+            if self.max_categories and self.admitted >= self.max_categories:
+                return False
+            if self.max_depth is not None and depth > self.max_depth:
+                self.too_deep += 1
+                return False
+            if self.max_size and len(self) >= self.max_size:
+                # Not marked as seen, it may be admitted again later on
+                self.dropped += 1
+                return False
+            if self.claim is not None and not self.claim(category.id):
+                self.seen.add(category.id)
+                return False
+            self.admitted += 1
+
+        self.seen.add(category.id)
+        self._put(category, depth, score)
+        return True
+
+    def pop(self):
+        return self._get()
+
+    def snapshot(self):
+        # Queued categories, as (category, depth, score) tuples
+        return list(self._entries())
+
+    def restore(self, entries, visited):
+        self.seen.update(visited)
+        self.admitted += len(visited)
+        for category, depth, score in entries:
+            self.push(category, depth, score, root=not depth)
+
+    def __contains__(self, category):
+        return category.id in self.seen
+
+    def __bool__(self):
+        return len(self) > 0
+
+    @abc.abstractmethod
+    def __len__(self):
+        pass
+
+    @abc.abstractmethod
+    def _put(self, category, depth, score):
+        pass
+
+    @abc.abstractmethod
+    def _get(self):
+        pass
+
+    @abc.abstractmethod
+    def _entries(self):
+        pass
+
+
+class LifoFrontier(Frontier):
+    # Depth-first order
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._queue = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _put(self, category, depth, score):
+        self._queue.append((category, depth, score))
+
+    def _get(self):
+        category, depth, _ = self._queue.pop()
+        return category, depth
+
+    def _entries(self):
+        return iter(self._queue)
+
+
+class FifoFrontier(Frontier):
+    # Breadth-first order
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._queue = deque()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _put(self, category, depth, score):
+        self._queue.append((category, depth, score))
+
+    def _get(self):
+        category, depth, _ = self._queue.popleft()
+        return category, depth
+
+    def _entries(self):
+        return iter(self._queue)
+
+
+class PriorityFrontier(Frontier):
+    # Highest score first, ties are broken in insertion order
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._queue = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _put(self, category, depth, score):
+        heapq.heappush(
+            self._queue, (-score, next(self._counter), category, depth)
+        )
+
+    def _get(self):
+        _, _, category, depth = heapq.heappop(self._queue)
+        return category, depth
+
+    def _entries(self):
+        return ((category, depth, -score)
+                for score, _, category, depth in self._queue)
+
+
+FRONTIERS = {
+    'dfs': LifoFrontier,
+    'bfs': FifoFrontier,
+    'priority': PriorityFrontier
+}
+
+
+def create_frontier(order, max_categories=None, max_depth=None,
+                    max_size=None):
+    if order not in FRONTIERS:
+        raise ValueError('Unknown frontier order: {}'.format(order))
+
+    return FRONTIERS[order](max_categories, max_depth, max_size)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from .models import Product, Category
+
+from collections import defaultdict
+import threading
+import hashlib
+import sqlite3
+import json
+import zlib
+import time
+import os
+
+
+class CacheEntry:
+    def __init__(self, key, etag, last_modified, fingerprint, result, body,
+                 size, page_count=None):
+        self.key = key
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fingerprint = fingerprint  # Of the extractor of the result
+        self.result = result
+        self.body = body  # None when the page was extracted in chunks
+        self.size = size  # Of the original body, in bytes
+        self.page_count = page_count  # When looked for and found
+
+    def get_validators(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    # Validators, bodies and extraction results of pages, stored on local
+    # disk: an SQLite index next to one compressed file per page. Least
+    # recently used pages are evicted once max_size bytes are used.
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._stats = defaultdict(
+            lambda: {'hits': 0, 'misses': 0, 'bytes_saved': 0}
+        )
+
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(directory, 'index.sqlite'),
+            timeout=30,
+            check_same_thread=False
+        )
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )
+        ''')
+        self._db.execute('''
+            CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)
+        ''')
+        # Running total of the sizes of the entries, so that puts do not sum
+        # them all. Shared with the other processes using the directory, its
+        # single row is created by whichever of them inserts it first.
+        with self._db:
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    size INTEGER NOT NULL
+                )
+            ''')
+            self._db.execute('''
+                INSERT OR IGNORE INTO totals SELECT 0, COALESCE(SUM(size), 0)
+                FROM entries
+            ''')
+
+    @staticmethod
+    def get_key(url, params, lang):
+        return hashlib.sha1(json.dumps(
+            [url, sorted((params or {}).items()), lang]
+        ).encode('utf-8')).hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        try:
+            with open(self._get_path(key), 'rb') as f:
+                data = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except (OSError, ValueError, zlib.error):
+            return None
+
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE entries SET accessed = ? WHERE key = ?',
+                (time.time(), key)
+            )
+
+        return CacheEntry(
+            key, data['etag'], data['last_modified'], data['fingerprint'],
+            _decode_result(data['result']), data['body'], data['size'],
+            data.get('page_count')
+        )
+
+    def put(self, entry):
+        data = zlib.compress(json.dumps({
+            'etag': entry.etag,
+            'last_modified': entry.last_modified,
+            'fingerprint': entry.fingerprint,
+            'result': _encode_result(entry.result),
+            'body': entry.body,
+            'size': entry.size,
+            'page_count': entry.page_count
+        }).encode('utf-8'))
+
+        path = self._get_path(entry.key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique to the thread across the processes sharing the directory,
+        # forked workers may reuse the same thread idents
+        tmp_path = '{}.{}.{}.tmp'.format(
+            path, os.getpid(), threading.get_ident()
+        )
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT size FROM entries WHERE key = ?', (entry.key,)
+            ).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                (entry.key, len(data), time.time())
+            )
+            total = self._add_to_total(len(data) - (row[0] if row else 0))
+            if total > self.max_size:
+                self._evict(total)
+
+    def _add_to_total(self, size):
+        self._db.execute('UPDATE totals SET size = size + ?', (size,))
+        return self._db.execute('SELECT size FROM totals').fetchone()[0]
+
+    def get_size(self):
+        with self._lock:
+            return self._db.execute('SELECT size FROM totals').fetchone()[0]
+
+    def _evict(self, total):
+        # Least recently used first, a batch at a time
+        while total > self.max_size:
+            rows = self._db.execute(
+                'SELECT key, size FROM entries ORDER BY accessed LIMIT 64'
+            ).fetchall()
+            if not rows:
+                break
+
+            for key, size in rows:
+                if total <= self.max_size:
+                    break
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                try:
+                    os.remove(self._get_path(key))
+                except OSError:
+                    pass
+                total = self._add_to_total(-size)
+
+    def record_hit(self, source, entry):
+        with self._lock:
+            stats = self._stats[source.name]
+            stats['hits'] += 1
+            stats['bytes_saved'] += entry.size
+
+    def record_miss(self, source):
+        with self._lock:
+            self._stats[source.name]['misses'] += 1
+
+    def get_stats(self, source):
+        with self._lock:
+            return dict(self._stats[source.name])
+
+
+def _encode_result(result):
+    categories, products = result
+    return [
+        [[c.id, c.url, c.slug] for c in categories],
+        [[p.id, p.urls, p.slug] for p in products]
+    ]
+
+
+def _decode_result(data):
+    categories, products = data
+    return (
+        {Category(id=id, url=url, slug=slug) for id, url, slug in categories},
+        {Product(id=id, urls=urls, slug=slug) for id, urls, slug in products}
+    )
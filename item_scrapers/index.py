@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from array import array
+import tempfile
+import hashlib
+import heapq
+import struct
+import bisect
+import mmap
+import os
+import re
+
+# Fingerprints sorted at once as Python ints, before runs are merged
+SORT_RUN_SIZE = 1 << 16
+
+
+def fingerprint(product_id):
+    return int.from_bytes(
+        hashlib.blake2b(str(product_id).encode('utf-8'),
+                        digest_size=8).digest(),
+        'little'
+    )
+
+
+class ProductIndex:
+    # Products seen by the previous crawl of a source lang/brand, as a
+    # memory-mapped file: a header, the sorted 64-bit fingerprints of the
+    # product IDs, then offsets into a blob with the URL of each product.
+    # Integers use the native byte order.
+    MAGIC = b'SMPI'
+    HEADER = struct.Struct('<4s4xQ')
+
+    def __init__(self, path=None):
+        self.path = path
+        self._file = None
+        self._mmap = None
+        self.fingerprints = ()
+        self._offsets = ()
+        self._blob = 0
+
+        if path and os.path.exists(path):
+            self._open()
+
+    def _open(self):
+        self._file = open(self.path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count = self.HEADER.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC:
+            raise ValueError('Invalid product index: {}'.format(self.path))
+
+        view = memoryview(self._mmap)
+        start = self.HEADER.size
+        self.fingerprints = view[start:start + 8 * count].cast('Q')
+        start += 8 * count
+        self._offsets = view[start:start + 8 * (count + 1)].cast('Q')
+        self._blob = start + 8 * (count + 1)
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, fp):
+        return self.find(fp) is not None
+
+    def find(self, fp):
+        # Position of a fingerprint, None if missing
+        i = bisect.bisect_left(self.fingerprints, fp)
+        if i < len(self.fingerprints) and self.fingerprints[i] == fp:
+            return i
+        return None
+
+    def get_url(self, i):
+        return bytes(self._mmap[
+            self._blob + self._offsets[i]:self._blob + self._offsets[i + 1]
+        ]).decode('utf-8')
+
+    def close(self):
+        if self._mmap is not None:
+            self.fingerprints.release()
+            self._offsets.release()
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self.fingerprints = ()
+            self._offsets = ()
+
+    @classmethod
+    def write(cls, path, fingerprints, urls, order=None):
+        # Writes fingerprints in order along with their URL, then atomically
+        # replaces the index at path
+        cls.replace(cls.write_pending(path, fingerprints, urls, order), path)
+
+    @classmethod
+    def write_pending(cls, path, fingerprints, urls, order=None):
+        # Writes the index next to path, returns where. URLs are streamed to
+        # the blob at the end of the file, only fingerprints and offsets are
+        # held in memory, as arrays.
+        if order is None:
+            order = sort_fingerprints(fingerprints)
+        count = len(order)
+        sorted_fingerprints = array('Q')
+        offsets = array('Q', [0])
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix='.pending')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.seek(cls.HEADER.size + 8 * (2 * count + 1))
+                size = 0
+                for i in order:
+                    data = urls(i).encode('utf-8')
+                    f.write(data)
+                    size += len(data)
+                    sorted_fingerprints.append(fingerprints[i])
+                    offsets.append(size)
+
+                f.seek(0)
+                f.write(cls.HEADER.pack(cls.MAGIC, count))
+                sorted_fingerprints.tofile(f)
+                offsets.tofile(f)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        return tmp_path
+
+    @staticmethod
+    def replace(pending_path, path):
+        os.replace(pending_path, path)
+
+
+def sort_fingerprints(fingerprints):
+    # Positions of the fingerprints of an array in their sorted order. Runs
+    # are sorted one at a time then merged, so that only a run is held as
+    # Python ints and the result is an array too.
+    runs = array('Q')
+    for start in range(0, len(fingerprints), SORT_RUN_SIZE):
+        runs.extend(sorted(
+            range(start, min(start + SORT_RUN_SIZE, len(fingerprints))),
+            key=fingerprints.__getitem__
+        ))
+
+    view = memoryview(runs)
+    order = array('Q', (i for _, i in heapq.merge(*(
+        ((fingerprints[i], i) for i in view[start:start + SORT_RUN_SIZE])
+        for start in range(0, len(runs), SORT_RUN_SIZE)
+    ))))
+    view.release()
+    return order
+
+
+class IndexDiff:
+    # Compares the products of a crawl with the previous index, then saves
+    # the new one. Fingerprints are kept in an array and URLs in a spooled
+    # temporary file, so a product costs a few bytes of memory. Products
+    # are identified by ID, those whose URL changed are new again.
+    def __init__(self, path):
+        self.path = path
+        self.index = ProductIndex(path)
+        self.added = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.pending_path = None
+        self._order = None
+
+        self._fingerprints = array('Q')
+        self._offsets = array('Q', [0])
+        self._urls = tempfile.SpooledTemporaryFile(max_size=1 << 20)
+
+    @staticmethod
+    def get_path(directory, source, lang, brand):
+        name = re.sub(r'[^A-Za-z0-9.-]', '_', '{}_{}'.format(lang, brand))
+        return os.path.join(directory, source.name, '{}.idx'.format(name))
+
+    def add(self, product):
+        # Returns whether the product is new since the previous crawl
+        fp = fingerprint(product.id)
+        url = product.urls[0]
+        self._fingerprints.append(fp)
+        self._urls.write(url.encode('utf-8'))
+        self._offsets.append(self._urls.tell())
+
+        i = self.index.find(fp)
+        if i is None:
+            self.added += 1
+            return True
+        if self.index.get_url(i) != url:
+            self.changed += 1
+            return True
+
+        self.unchanged += 1
+        return False
+
+    def _get_order(self):
+        if self._order is None:
+            self._order = sort_fingerprints(self._fingerprints)
+        return self._order
+
+    def iter_removed(self):
+        # URLs of the products of the previous index no longer found, both
+        # fingerprint lists are walked in order
+        fingerprints = self._fingerprints
+        order = self._get_order()
+        j = 0
+        for i, fp in enumerate(self.index.fingerprints):
+            while j < len(order) and fingerprints[order[j]] < fp:
+                j += 1
+            if j == len(order) or fingerprints[order[j]] != fp:
+                self.removed += 1
+                yield self.index.get_url(i)
+
+    def _get_url(self, i):
+        self._urls.seek(self._offsets[i])
+        return self._urls.read(
+            self._offsets[i + 1] - self._offsets[i]
+        ).decode('utf-8')
+
+    def save(self):
+        self.prepare()
+        self.commit()
+
+    def prepare(self):
+        # Writes the new index next to the previous one, which stays in
+        # place until commit
+        self.index.close()
+        self.pending_path = ProductIndex.write_pending(
+            self.path, self._fingerprints, self._get_url, self._get_order()
+        )
+        self.close()
+
+    def commit(self):
+        if self.pending_path is not None:
+            ProductIndex.replace(self.pending_path, self.path)
+            self.pending_path = None
+
+    def discard(self):
+        if self.pending_path is not None:
+            os.unlink(self.pending_path)
+            self.pending_path = None
+
+    def close(self):
+        self.index.close()
+        self._urls.close()
+        self._fingerprints = array('Q')
+        self._offsets = array('Q', [0])
+        self._order = None
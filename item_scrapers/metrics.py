@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import socket
+import bisect
+import json
+import math
+import time
+import os
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5.,
+                   10., 30.)
+EXTRACTION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.)
+PAGES_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Registry:
+    # Metrics of this process. Snapshots are plain data that can be written
+    # to disk, merged with those of other processes and rendered.
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return [metric.snapshot() for metric in metrics]
+
+
+class _Value:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0.
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def get(self):
+        return self.value
+
+
+class _Buckets:
+    __slots__ = ('_lock', '_bounds', 'counts', 'sum')
+
+    def __init__(self, lock, bounds):
+        self._lock = lock
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last one is +Inf
+        self.sum = 0.
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def get(self):
+        with self._lock:
+            return [list(self.counts), self.sum]
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def _describe(self):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'help': self.help,
+            'labelnames': list(self.labelnames)
+        }
+
+    def snapshot(self):
+        with self._lock:
+            children = list(self._children.items())
+        return dict(self._describe(), samples=[
+            [list(key), child.get()] for key, child in children
+        ])
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS,
+                 registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _Buckets(self._lock, self.buckets)
+
+    def _describe(self):
+        return dict(super()._describe(), buckets=list(self.buckets))
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+def merge_snapshots(snapshots):
+    # Sums the samples of metrics with the same name and labels
+    merged = {}
+    for snapshot in snapshots:
+        for metric in snapshot:
+            target = merged.get(metric['name'])
+            if target is None:
+                target = merged[metric['name']] = dict(metric, samples={})
+            samples = target['samples']
+            for labels, value in metric['samples']:
+                key = tuple(labels)
+                if key not in samples:
+                    if metric['kind'] == 'histogram':
+                        value = [list(value[0]), value[1]]
+                    samples[key] = value
+                elif metric['kind'] == 'histogram':
+                    counts, total = samples[key]
+                    for i, count in enumerate(value[0]):
+                        counts[i] += count
+                    samples[key] = [counts, total + value[1]]
+                else:
+                    samples[key] += value
+
+    return [
+        dict(metric, samples=[
+            [list(key), value] for key, value in metric['samples'].items()
+        ])
+        for metric in merged.values()
+    ]
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, value.replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(snapshot):
+    # Prometheus text exposition format
+    lines = []
+    for metric in snapshot:
+        name = metric['name']
+        lines.append('# HELP {} {}'.format(name, metric['help']))
+        lines.append('# TYPE {} {}'.format(name, metric['kind']))
+        names = metric['labelnames']
+        for labels, value in sorted(metric['samples']):
+            if metric['kind'] != 'histogram':
+                lines.append('{}{} {}'.format(
+                    name, _format_labels(names, labels), _format_value(value)
+                ))
+                continue
+
+            counts, total = value
+            cumulative = 0
+            bounds = list(metric['buckets']) + [math.inf]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name,
+                    _format_labels(names, labels,
+                                   [('le', _format_value(bound))]),
+                    cumulative
+                ))
+            lines.append('{}_sum{} {}'.format(
+                name, _format_labels(names, labels), _format_value(total)
+            ))
+            lines.append('{}_count{} {}'.format(
+                name, _format_labels(names, labels), cumulative
+            ))
+
+    return '\n'.join(lines) + '\n'
+
+
+class SnapshotWriter:
+    # Writes the metrics of this process to a directory shared with the
+    # other processes of a worker, every interval seconds and on demand
+    def __init__(self, directory, interval=15., registry=None):
+        self.path = os.path.join(directory, _get_snapshot_name())
+        self._registry = registry or REGISTRY
+        self._interval = interval
+        self._stopped = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.write()
+
+    def write(self):
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self._registry.snapshot(), f)
+        os.replace(tmp_path, self.path)
+
+    def stop(self):
+        self._stopped.set()
+        self.write()
+
+
+def _get_snapshot_name(pid=None):
+    # Unique among the processes of every host sharing the directory
+    return '{}-{}.json'.format(socket.gethostname(), pid or os.getpid())
+
+
+def read_snapshots(directory, max_age=None):
+    # Snapshots written by other processes. Gauges of those that have not
+    # written theirs for max_age seconds are dropped, as the processes are
+    # likely gone, while their counters keep counting.
+    snapshots = []
+    now = time.time()
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json') or name == _get_snapshot_name():
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as f:
+                metrics = json.load(f)
+            age = now - os.stat(path).st_mtime
+        except (OSError, ValueError):
+            continue
+
+        if max_age is not None and age > max_age:
+            metrics = [
+                metric for metric in metrics if metric['kind'] != 'gauge'
+            ]
+        snapshots.append(metrics)
+
+    return snapshots
+
+
+def clear_snapshots(directory):
+    # Left by the previous processes of this host
+    os.makedirs(directory, exist_ok=True)
+    prefix = '{}-'.format(socket.gethostname())
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith('.json'):
+            os.unlink(os.path.join(directory, name))
+
+
+def collect(directory=None, max_age=None, registry=None):
+    # Metrics of this process, merged with those written to directory
+    snapshots = [(registry or REGISTRY).snapshot()]
+    if directory and os.path.isdir(directory):
+        snapshots.extend(read_snapshots(directory, max_age))
+    return render(merge_snapshots(snapshots))
+
+
+class Exporter:
+    # Serves the metrics returned by collect over HTTP, for processes that
+    # do not run the Flask app such as Celery workers
+    def __init__(self, port, collect, host=''):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = collect().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  daemon=True)
+        thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+REGISTRY = Registry()
+
+FETCH_SECONDS = Histogram(
+    'item_scrapers_fetch_seconds',
+    'Time until the response headers of a page are received',
+    ['source', 'host'])
+DOWNLOADED_BYTES = Counter(
+    'item_scrapers_downloaded_bytes_total',
+    'Bytes of page bodies downloaded', ['source'])
+RESPONSES = Counter(
+    'item_scrapers_responses_total',
+    'Page responses by HTTP status, error when none was received',
+    ['source', 'status'])
+RETRIES = Counter(
+    'item_scrapers_retries_total',
+    'Requests retried after a connection or read error', ['source'])
+EXTRACTION_SECONDS = Histogram(
+    'item_scrapers_extraction_seconds',
+    'Time spent extracting the URLs of a page', ['source'],
+    buckets=EXTRACTION_BUCKETS)
+CATEGORY_PAGES = Histogram(
+    'item_scrapers_category_pages',
+    'Pages fetched per category', ['source'], buckets=PAGES_BUCKETS)
+ITEMS = Counter(
+    'item_scrapers_items_total',
+    'Items yielded by scrapes', ['source'])
+CONFIRM_SECONDS = Histogram(
+    'item_scrapers_confirm_seconds',
+    'Time from publishing a message to its confirm by the broker')
+UNCONFIRMED = Gauge(
+    'item_scrapers_unconfirmed_messages',
+    'Messages published and not confirmed yet')
+CONNECTION_BLOCKS = Counter(
+    'item_scrapers_connection_blocks_total',
+    'Times the broker blocked the publishing connection')
+CONNECTION_BLOCKED_SECONDS = Counter(
+    'item_scrapers_connection_blocked_seconds_total',
+    'Time the publishing connection spent blocked by the broker, counted \
+once unblocked')
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+class Product:
+    __slots__ = ('id', 'urls', 'slug')
+
+    def __init__(self, id, urls, slug=None):
+        self.id = id
+        self.urls = urls
+        self.slug = slug
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        if not isinstance(other, Product):
+            return NotImplemented
+
+        return self.id == other.id
+
+    def __repr__(self):
+        return "Product id={} urls={} slug={}".format(
+            self.id, self.urls, self.slug
+        )
+
+
+class Category:
+    __slots__ = ('id', 'url', 'slug')
+
+    def __init__(self, id, url, slug=None):
+        self.id = id
+        self.url = url
+        self.slug = slug
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        if not isinstance(other, Category):
+            return NotImplemented
+
+        return self.id == other.id
+
+    def __repr__(self):
+        return "Category id={} url={} slug={}".format(
+            self.id, self.url, self.slug
+        )
+
+
+class Tombstone:
+    # Wraps the item of a product that disappeared from a source
+    __slots__ = ('item',)
+
+    def __init__(self, item):
+        self.item = item
+
+    def __repr__(self):
+        return "Tombstone item={}".format(self.item)
+
+
+class CategoryState:
+    def __init__(self, products, max_products_per_category,
+                 on_products=None, keep_products=False):
+        self.categories = set()
+        self.products = products  # IDs of the products seen so far
+        # Products first seen in this category, if kept
+        self.new_products = [] if keep_products else None
+        self.total_products = 0
+        self.pages = 0
+        self.max_products_per_category = max_products_per_category
+        self.on_products = on_products
+        self._fingerprint = None  # Of the previous page
+
+    def update(self, new_categories, new_products, probe=True):
+        # Merge one page, returns False once the category is exhausted. When
+        # probing for its end, an empty page or one repeating the previous
+        # one ends it before any dedupe work, as does a page bringing nothing
+        # new. Otherwise the page count is known and only the limit applies.
+        self.pages += 1
+        if probe:
+            if not new_categories and not new_products:
+                return False
+            fingerprint = hash(
+                (frozenset(new_categories), frozenset(new_products))
+            )
+            if fingerprint == self._fingerprint:
+                return False
+            self._fingerprint = fingerprint
+
+        new_products = [
+            product for product in new_products
+            if product.id not in self.products
+        ]
+        if probe and not new_products and \
+           new_categories.issubset(self.categories):
+            return False
+
+        self.categories.update(new_categories)
+
+        exhausted = False
+        self.total_products += len(new_products)
+        if self.max_products_per_category and \
+           self.total_products > self.max_products_per_category:
+            del new_products[len(new_products) - (
+                self.total_products - self.max_products_per_category
+            ):]
+            exhausted = True
+
+        self.products.update(product.id for product in new_products)
+        if self.new_products is not None:
+            self.new_products.extend(new_products)
+        if new_products and self.on_products:
+            self.on_products(new_products)
+
+        return not exhausted
+
+    def get_yield(self):
+        # Average number of new products per page
+        return self.total_products / self.pages if self.pages else 0
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from .models import Tombstone
+
+import threading
+import logging
+import struct
+import fcntl
+import zlib
+import time
+import os
+
+LOGGER = logging.getLogger(__name__)
+
+# Records are prefixed with their flags, length and CRC32 so that a torn
+# write at the end of a segment is detected and dropped
+RECORD_HEADER = struct.Struct('>BII')
+TOMBSTONE = 0x01
+
+OPEN_SUFFIX = '.log'
+SEALED_SUFFIX = '.seg'
+
+
+class RawItem:
+    # Item already serialized, published as is
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def SerializeToString(self):
+        return self.data
+
+
+def read_segment(fd):
+    chunks = []
+    while True:
+        chunk = os.read(fd, 1 << 20)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def iter_records(data):
+    # Items of a segment, up to the first incomplete or corrupted record,
+    # along with the offset where valid records end
+    view = memoryview(data)
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(view):
+        flags, length, crc = RECORD_HEADER.unpack_from(view, offset)
+        start = offset + RECORD_HEADER.size
+        body = bytes(view[start:start + length])
+        if len(body) < length or zlib.crc32(body) != crc:
+            break
+
+        item = RawItem(body)
+        offset = start + length
+        yield (Tombstone(item) if flags & TOMBSTONE else item), offset
+
+
+class SegmentWriter:
+    # Append-only segment, locked while open. Writes are buffered and
+    # fsynced at most every sync_interval seconds, sealing renames the
+    # segment so that drainers pick it up.
+    def __init__(self, path, sync_interval):
+        self.path = path
+        self.size = 0
+        self.records = 0
+        self._sync_interval = sync_interval
+        # Locked before getting its name, so that it is never mistaken for
+        # the segment of a dead writer
+        self._fd = os.open(path + '.new', os.O_WRONLY | os.O_CREAT |
+                           os.O_APPEND, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        os.rename(path + '.new', path)
+        self._buffer = []
+        self._synced = self.created = time.monotonic()
+
+    def append(self, item):
+        flags = 0
+        if isinstance(item, Tombstone):
+            item = item.item
+            flags = TOMBSTONE
+
+        body = item.SerializeToString()
+        self._buffer.append(
+            RECORD_HEADER.pack(flags, len(body), zlib.crc32(body))
+        )
+        self._buffer.append(body)
+        self.size += RECORD_HEADER.size + len(body)
+        self.records += 1
+
+        if time.monotonic() - self._synced >= self._sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._buffer:
+            os.write(self._fd, b''.join(self._buffer))
+            self._buffer = []
+        os.fsync(self._fd)
+        self._synced = time.monotonic()
+
+    def seal(self):
+        self.sync()
+        sealed = self.path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX
+        os.rename(self.path, sealed)
+        _sync_directory(os.path.dirname(self.path))
+        os.close(self._fd)
+        return sealed
+
+
+class Outbox:
+    # Items of a source written to local segments before being published,
+    # so that they survive broker outages and worker crashes. Drained
+    # segments are deleted once all their items are confirmed. Segments are
+    # sealed once full or, if set, segment_max_age seconds after they were
+    # opened, so that they are drained while the scrape goes on.
+    def __init__(self, directory, segment_size=16 << 20, sync_interval=1.0,
+                 segment_max_age=None):
+        self.directory = directory
+        self._segment_size = segment_size
+        self._sync_interval = sync_interval
+        self._segment_max_age = segment_max_age
+        self._segment = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.recover()
+
+    @staticmethod
+    def create(directory, source, segment_size=16 << 20, sync_interval=1.0,
+               segment_max_age=None):
+        return Outbox(
+            os.path.join(directory, source.name),
+            segment_size=segment_size,
+            sync_interval=sync_interval,
+            segment_max_age=segment_max_age
+        )
+
+    def _list(self, suffix):
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(suffix)
+        )
+
+    def _new_segment(self):
+        # Named after their creation time, drained in that order
+        name = '{:020d}-{}{}'.format(time.time_ns(), os.getpid(), OPEN_SUFFIX)
+        return SegmentWriter(
+            os.path.join(self.directory, name), self._sync_interval
+        )
+
+    def recover(self):
+        # Segments left open by a dead writer are truncated after their
+        # last valid record and sealed, those of live writers are locked
+        for path in self._list(OPEN_SUFFIX):
+            fd = _lock(path, os.O_RDWR)
+            if fd is None:
+                continue
+
+            try:
+                end = 0
+                for _, end in iter_records(read_segment(fd)):
+                    pass
+                os.ftruncate(fd, end)
+                os.fsync(fd)
+                if end:
+                    os.rename(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+                else:
+                    os.unlink(path)
+                _sync_directory(self.directory)
+                LOGGER.warning('Recovered outbox segment %s', path)
+            finally:
+                os.close(fd)
+
+    def _is_full(self, segment):
+        return segment.size >= self._segment_size or (
+            self._segment_max_age is not None and
+            time.monotonic() - segment.created >= self._segment_max_age
+        )
+
+    def write(self, items):
+        # Appends the items to segments, sealing each one once full and the
+        # last one when the items run out or fail. The open segment is
+        # shared with seal_aged, called by drainers while items are awaited.
+        count = 0
+        try:
+            for item in items:
+                with self._lock:
+                    if self._segment is None:
+                        self._segment = self._new_segment()
+                    self._segment.append(item)
+                    count += 1
+                    if self._is_full(self._segment):
+                        self._seal()
+        finally:
+            with self._lock:
+                if self._segment is not None:
+                    self._seal()
+
+        return count
+
+    def seal_aged(self):
+        # Seals the open segment once older than segment_max_age, which
+        # write only checks when it gets an item
+        with self._lock:
+            if self._segment is not None and \
+                    self._segment_max_age is not None and \
+                    self._is_full(self._segment):
+                self._seal()
+
+    def _seal(self):
+        segment, self._segment = self._segment, None
+        segment.seal()
+
+    def drain(self, publisher, source):
+        # Publishes every sealed segment, oldest first. A segment is deleted
+        # once all its items are confirmed, otherwise draining stops and it
+        # is published again by the next drain.
+        totals = {}
+        for path in self._list(SEALED_SUFFIX):
+            fd = _lock(path, os.O_RDONLY)
+            if fd is None:
+                # Being drained by another worker
+                continue
+
+            try:
+                data = read_segment(fd)
+                stats = publisher.publish(
+                    source, (item for item, _ in iter_records(data))
+                )
+                for key, value in stats.items():
+                    totals[key] = totals.get(key, 0) + value
+
+                if stats['failed']:
+                    LOGGER.error('%i items of %s were not published',
+                                 stats['failed'], path)
+                    break
+
+                os.unlink(path)
+            finally:
+                os.close(fd)
+
+        totals['pending_segments'] = self.get_pending()
+        return totals
+
+    def drain_until(self, publisher, source, written, interval=1.0):
+        # Drains segments as they are sealed by a writer, every interval
+        # seconds until the written event is set, then those left. Stops as
+        # soon as a segment fails, like drain. Segments of a writer left
+        # waiting for items are sealed here once old enough.
+        totals = {}
+        while True:
+            last = written.is_set()
+            self.seal_aged()
+            stats = self.drain(publisher, source)
+            for key, value in stats.items():
+                if key != 'pending_segments':
+                    totals[key] = totals.get(key, 0) + value
+            if last or stats.get('failed'):
+                break
+            written.wait(interval)
+
+        totals['pending_segments'] = stats['pending_segments']
+        return totals
+
+    def get_pending(self):
+        return len(self._list(SEALED_SUFFIX))
+
+
+def _lock(path, flags):
+    # Opens and locks a segment without waiting, None if another process
+    # holds it or if it was renamed or deleted in the meantime
+    try:
+        fd = os.open(path, flags)
+    except FileNotFoundError:
+        return None
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if os.fstat(fd).st_ino == os.stat(path).st_ino:
+            return fd
+    except (BlockingIOError, FileNotFoundError):
+        pass
+
+    os.close(fd)
+    return None
+
+
+def _sync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+import threading
+import sys
+import os
+
+
+class StackSampler:
+    # Samples the stacks of every thread of the process every interval
+    # seconds, cheap enough to leave on during a whole scrape unlike
+    # cProfile which slows down every call. Samples are saved in the folded
+    # format of flame graph tools, one line per distinct stack.
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                self._stacks[self._fold(names.get(ident, ident), frame)] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _fold(thread_name, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append('{} ({}:{})'.format(
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno
+            ))
+            frame = frame.f_back
+        frames.append(str(thread_name))
+        return ';'.join(reversed(frames))
+
+    def get_folded(self):
+        return [
+            '{} {}'.format(stack, count)
+            for stack, count in sorted(self._stacks.items())
+        ]
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            for line in self.get_folded():
+                f.write(line + '\n')
@@ -1,36 +1,102 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from .metrics import (
+    CONFIRM_SECONDS, UNCONFIRMED, CONNECTION_BLOCKS, CONNECTION_BLOCKED_SECONDS
+)
+from .models import Tombstone
+from .stream import ItemStream, StreamEnd
+from . import batch
+
+from collections import OrderedDict, deque
+import threading
+import queue
 import pika
 import logging
+import time
+import os
 
 LOGGER = logging.getLogger(__name__)
 
+MAX_RECONNECT_DELAY = 30
+HANDOFF_POLL_INTERVAL = 0.05
+
 
 class Publisher:
     def __init__(self, amqp_url, app_id, exchange_name, routing_key_prefix,
-                 queue_prefix):
+                 queue_prefix, max_unconfirmed=1000, max_retries=3,
+                 handoff_size=1000, batch_size=0, batch_max_bytes=65536,
+                 batch_max_delay=1.0, compression=None, low_watermark=None,
+                 max_reconnect_attempts=None):
+        batch.check_compression(compression)
+
         self._connection = None
         self._channel = None
         self._deliveries = None
+        self._sent = None
+        self._retries = None
         self._acked = None
         self._nacked = None
+        self._retried = None
+        self._failed = None
         self._message_number = None
+        self._published = None
+        self._messages = None
+        self._bytes = None
+        self._batch = None
+        self._batch_records = None
+        self._batch_bytes = None
+        self._batch_started = None
         self._stopping = False
-        self._items = None
+        self._done = False
+        self._error = None
+        self._scheduled = False
+        self._exhausted = False
+        self._exhausted_at = None
+        self._finished_at = None
+        self._paused = False
+        self._paused_since = None
+        self._paused_seconds = 0
+        self._blocked = False
+        self._blocked_since = None
+        self._blocked_seconds = 0
+        self._blocks = 0
+        self._stream = None
         self._routing_key = None
         self._queue_name = None
+        self._reconnect_delay = 0
+        self._reconnect_attempts = 0
+        # Topology declared on the current channel
+        self._exchange_declared = False
+        self._bindings = set()
+        self._confirming = False
 
         self._url = amqp_url
         self._app_id = app_id
         self._exchange_name = exchange_name
         self._routing_key_prefix = routing_key_prefix
         self._queue_prefix = queue_prefix
+        # Publishing pauses with max_unconfirmed messages in flight and only
+        # resumes once down to the low watermark
+        self._max_unconfirmed = max_unconfirmed
+        self._low_watermark = low_watermark
+        if low_watermark is None:
+            self._low_watermark = max_unconfirmed // 2
+        self._max_retries = max_retries
+        self._handoff_size = handoff_size
+        self._max_reconnect_attempts = max_reconnect_attempts
+        self._batch_size = batch_size
+        self._batch_max_bytes = batch_max_bytes
+        self._batch_max_delay = batch_max_delay
+        self._compression = compression
 
     @staticmethod
     def create(host, port, username, password, vhost, connection_attempts,
                heartbeat, app_id, exchange_name, routing_key_prefix,
-               queue_prefix):
+               queue_prefix, max_unconfirmed=1000, max_retries=3,
+               handoff_size=1000, batch_size=0, batch_max_bytes=65536,
+               batch_max_delay=1.0, compression=None, low_watermark=None,
+               max_reconnect_attempts=None):
         amqp_url = 'amqp://{}:{}@{}:{}/{}?connection_attempts={}&\
 heartbeat={}'.format(
             username,
@@ -43,11 +109,19 @@ heartbeat={}'.format(
 
         return Publisher(
             amqp_url, app_id, exchange_name,
-            routing_key_prefix, queue_prefix
+            routing_key_prefix, queue_prefix,
+            max_unconfirmed=max_unconfirmed,
+            max_retries=max_retries,
+            handoff_size=handoff_size,
+            batch_size=batch_size,
+            batch_max_bytes=batch_max_bytes,
+            batch_max_delay=batch_max_delay,
+            compression=compression,
+            low_watermark=low_watermark,
+            max_reconnect_attempts=max_reconnect_attempts
         )
 
     def publish(self, source, items):
-        self._items = items
         self._routing_key = '{}.{}'.format(
             self._routing_key_prefix, source.name
         )
@@ -55,61 +129,294 @@ heartbeat={}'.format(
             self._queue_prefix, source.name
         )
 
-        self._start()
+        # Items are pulled from their iterator in a separate thread so that
+        # the IO loop never blocks on scraping, a full handoff queue holds
+        # the scraper back
+        self._stream = ItemStream(self._handoff_size)
+        producer = threading.Thread(
+            target=self._stream.produce,
+            args=(self._feed, items, self._stream),
+            daemon=True
+        )
+        producer.start()
+        try:
+            self._start()
+        finally:
+            self._stream.close()
+
+        return self.get_stats()
+
+    @staticmethod
+    def _feed(items, stream):
+        try:
+            for item in items:
+                stream.put(item)
+        finally:
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+
+    def get_stats(self):
+        return {
+            'published': self._published,
+            'messages': self._messages,
+            'bytes': self._bytes,
+            'acked': self._acked,
+            'nacked': self._nacked,
+            'retried': self._retried,
+            'failed': self._failed,
+            'blocks': self._blocks,
+            'blocked_seconds': round(self._get_blocked_seconds(), 3),
+            'paused_seconds': round(self._get_paused_seconds(), 3),
+            'confirm_wait_seconds': round(self._get_confirm_wait_seconds(), 3)
+        }
+
+    def _get_blocked_seconds(self):
+        if self._blocked:
+            return (self._blocked_seconds +
+                    time.monotonic() - self._blocked_since)
+        return self._blocked_seconds
+
+    def _get_paused_seconds(self):
+        # Waiting for confirms with max_unconfirmed messages in flight
+        if self._paused:
+            return (self._paused_seconds +
+                    time.monotonic() - self._paused_since)
+        return self._paused_seconds
+
+    def _get_confirm_wait_seconds(self):
+        # Waiting for the last confirms once every item was published
+        if self._exhausted_at is None:
+            return 0
+        return (self._finished_at or time.monotonic()) - self._exhausted_at
+
+    def close(self):
+        self._stop()
+        if self._connection is not None and not self._connection.is_closed:
+            # Finish closing
+            self._connection.ioloop.start()
+        self._connection = None
 
     def _start(self):
         self._reset()
-        while not self._stopping:
+        # The connection and channel are kept open between publications,
+        # the IO loop only runs while publishing
+        while not self._done and not self._stopping:
             try:
-                self._connection = self._connect()
+                if self._connection is None or self._connection.is_closed:
+                    self._connection = self._connect()
+                else:
+                    self._connection.ioloop.call_later(0, self._resume)
                 self._connection.ioloop.start()
             except KeyboardInterrupt:
-                self._stop()
-                if (self._connection is not None and
-                        not self._connection.is_closed):
-                    # Finish closing
-                    self._connection.ioloop.start()
+                self.close()
+
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
 
     def _reset(self):
-        self._connection = None
-        self._channel = None
         self._stopping = False
-        self._deliveries = []
+        self._done = False
+        self._error = None
+        self._scheduled = False
+        self._exhausted = False
+        self._exhausted_at = None
+        self._finished_at = None
+        self._paused = False
+        self._paused_seconds = 0
+        self._reconnect_attempts = 0
+        self._blocks = 0
+        self._blocked_seconds = 0
+        if self._blocked:
+            # Still blocked, the time so far belongs to the previous publish
+            now = time.monotonic()
+            CONNECTION_BLOCKED_SECONDS.inc(now - self._blocked_since)
+            self._blocked_since = now
+        # Outstanding deliveries by tag, in publishing order, with the item
+        # and its number of attempts so that nacked items can be retried
+        if self._deliveries is None:
+            self._deliveries = OrderedDict()
+            self._message_number = 0
+        UNCONFIRMED.dec(len(self._deliveries))
+        self._deliveries.clear()
+        # Times deliveries were sent at, by tag
+        self._sent = {}
+        self._retries = deque()
         self._acked = 0
         self._nacked = 0
-        self._message_number = 0
+        self._retried = 0
+        self._failed = 0
+        self._published = 0
+        self._messages = 0
+        self._bytes = 0
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self._batch = []
+        self._batch_records = []
+        self._batch_bytes = 0
+        self._batch_started = None
+
+    def _is_batching(self):
+        return self._batch_size > 1
+
+    def _resume(self):
+        # A closed channel is reopened from the close callbacks
+        if self._channel is not None and self._channel.is_open:
+            self._setup_topology()
 
     def _on_started(self):
+        self._publish_next()
+
+    def _finish(self, error=None):
+        self._finished_at = time.monotonic()
+        self._done = True
+        self._error = error
+        self._connection.ioloop.stop()
+
+    def _schedule_publish(self, delay=0):
+        if not self._scheduled and self._connection is not None:
+            self._scheduled = True
+            self._connection.ioloop.call_later(delay, self._publish_next)
+
+    def _next_item(self):
+        if self._retries:
+            return self._retries.popleft()
+        if not self._exhausted:
+            try:
+                return self._stream.get_nowait(), 1
+            except queue.Empty:
+                pass
+            except StreamEnd:
+                self._exhausted = True
+                self._exhausted_at = time.monotonic()
+        return None, 0
+
+    def _publish_next(self):
+        self._scheduled = False
+        if (self._stopping or self._done or self._channel is None or
+                not self._channel.is_open):
+            return
+
+        # Items are left in the handoff queue, and the scraper eventually
+        # waits on it, while the broker is blocked or too many messages
+        # are unconfirmed
+        if self._blocked:
+            return
+        if self._paused:
+            if len(self._deliveries) > self._low_watermark:
+                return
+            self._paused = False
+            self._paused_seconds += time.monotonic() - self._paused_since
+
         try:
-            for item in self._items:
-                self._publish(item)
-        finally:
-            self._stop()
+            # Keep at most max_unconfirmed messages in flight, more are
+            # published as confirmations come back
+            while len(self._deliveries) < self._max_unconfirmed:
+                item, attempts = self._next_item()
+                if item is None:
+                    break
+                if self._is_batching():
+                    self._add_to_batch(item, attempts)
+                else:
+                    self._publish(item, attempts)
+
+            # A partial batch is sent once there is nothing left to add to
+            # it, or once it has waited long enough
+            if (self._batch and
+                    len(self._deliveries) < self._max_unconfirmed and
+                    (self._exhausted and not self._retries or
+                     time.monotonic() - self._batch_started >=
+                     self._batch_max_delay)):
+                self._flush_batch()
+        except Exception as e:
+            self._finish(e)
+            return
+
+        if (self._exhausted and not self._retries and not self._deliveries
+                and not self._batch):
+            self._finish()
+        elif len(self._deliveries) >= self._max_unconfirmed:
+            if not self._paused:
+                self._paused = True
+                self._paused_since = time.monotonic()
+        elif (not self._exhausted and
+                len(self._deliveries) < self._max_unconfirmed):
+            # Waiting on the scraper
+            self._schedule_publish(HANDOFF_POLL_INTERVAL)
 
     def _connect(self):
         LOGGER.debug('Connecting to %s', self._url)
-        return pika.SelectConnection(
+        connection = pika.SelectConnection(
             pika.URLParameters(self._url),
             on_open_callback=self._on_connection_open,
             on_open_error_callback=self._on_connection_open_error,
             on_close_callback=self._on_connection_closed)
+        connection.add_on_connection_blocked_callback(
+            self._on_connection_blocked)
+        connection.add_on_connection_unblocked_callback(
+            self._on_connection_unblocked)
+        return connection
 
     def _on_connection_open(self, _unused_connection):
         LOGGER.debug('Connection opened')
+        self._reconnect_delay = 0
+        self._reconnect_attempts = 0
         self._open_channel()
 
     def _on_connection_open_error(self, _unused_connection, err):
-        LOGGER.error('Connection open failed, reopening in 5 seconds: %s', err)
-        self._connection.ioloop.call_later(5, self._connection.ioloop.stop)
+        LOGGER.error('Connection open failed: %s', err)
+        self._reconnect(err)
+
+    def _on_connection_blocked(self, _unused_connection, method_frame):
+        LOGGER.warning('Connection blocked by the broker: %s',
+                       method_frame.method.reason)
+        if not self._blocked:
+            self._blocked = True
+            self._blocked_since = time.monotonic()
+            self._blocks += 1
+            CONNECTION_BLOCKS.inc()
+
+    def _on_connection_unblocked(self, _unused_connection, _unused_frame):
+        LOGGER.info('Connection unblocked')
+        self._unblock()
+        self._schedule_publish()
+
+    def _unblock(self):
+        if self._blocked:
+            blocked_seconds = time.monotonic() - self._blocked_since
+            self._blocked_seconds += blocked_seconds
+            CONNECTION_BLOCKED_SECONDS.inc(blocked_seconds)
+            self._blocked = False
 
     def _on_connection_closed(self, _unused_connection, reason):
         self._channel = None
-        if self._stopping:
+        self._unblock()
+        if self._stopping or self._done:
             self._connection.ioloop.stop()
         else:
-            LOGGER.warning('Connection closed, reopening in 5 seconds: %s',
-                           reason)
-            self._connection.ioloop.call_later(5, self._connection.ioloop.stop)
+            LOGGER.warning('Connection closed: %s', reason)
+            self._reconnect(reason)
+
+    def _reconnect(self, reason):
+        # Gives up the publication after max_reconnect_attempts in a row
+        self._reconnect_attempts += 1
+        if (self._max_reconnect_attempts is not None and
+                self._reconnect_attempts > self._max_reconnect_attempts):
+            self._finish(pika.exceptions.AMQPConnectionError(reason))
+            return
+
+        delay = self._get_reconnect_delay()
+        LOGGER.warning('Reconnecting in %i seconds', delay)
+        self._connection.ioloop.call_later(delay, self._connection.ioloop.stop)
+
+    def _get_reconnect_delay(self):
+        # Exponential backoff, reset once a connection is opened
+        self._reconnect_delay = min(
+            self._reconnect_delay * 2 or 1, MAX_RECONNECT_DELAY
+        )
+        return self._reconnect_delay
 
     def _open_channel(self):
         LOGGER.debug('Creating a new channel')
@@ -118,8 +425,24 @@ heartbeat={}'.format(
     def _on_channel_open(self, channel):
         LOGGER.debug('Channel opened')
         self._channel = channel
+        self._exchange_declared = False
+        self._bindings = set()
+        self._confirming = False
+
+        # Delivery tags restart on a new channel: items left unconfirmed on
+        # the previous one are published again
+        self._retries.extendleft(reversed([
+            entry
+            for entries in self._deliveries.values()
+            for entry in entries
+        ]))
+        UNCONFIRMED.dec(len(self._deliveries))
+        self._deliveries.clear()
+        self._sent.clear()
+        self._message_number = 0
+
         self._add_on_channel_close_callback()
-        self._setup_exchange()
+        self._setup_topology()
 
     def _add_on_channel_close_callback(self):
         LOGGER.debug('Adding channel close callback')
@@ -128,9 +451,18 @@ heartbeat={}'.format(
     def _on_channel_closed(self, channel, reason):
         LOGGER.warning('Channel %i was closed: %s', channel, reason)
         self._channel = None
-        if not self._stopping:
+        if not self._stopping and not self._connection.is_closing:
             self._connection.close()
 
+    def _setup_topology(self):
+        # Declarations are only sent once per channel and source
+        if not self._exchange_declared:
+            self._setup_exchange()
+        elif (self._queue_name, self._routing_key) not in self._bindings:
+            self._setup_queue()
+        else:
+            self._enable_delivery_confirmations()
+
     def _setup_exchange(self):
         LOGGER.debug('Declaring exchange %s', self._exchange_name)
         self._channel.exchange_declare(
@@ -140,7 +472,8 @@ heartbeat={}'.format(
 
     def _on_exchange_declareok(self, _unused_frame):
         LOGGER.debug('Exchange declared')
-        self._setup_queue()
+        self._exchange_declared = True
+        self._setup_topology()
 
     def _setup_queue(self):
         LOGGER.debug('Declaring queue %s', self._queue_name)
@@ -159,50 +492,124 @@ heartbeat={}'.format(
 
     def _on_bindok(self, _unused_frame):
         LOGGER.debug('Queue bound')
-        self._enable_delivery_confirmations()
+        self._bindings.add((self._queue_name, self._routing_key))
+        self._setup_topology()
 
     def _enable_delivery_confirmations(self):
-        LOGGER.debug('Issuing Confirm.Select RPC command')
-        self._channel.confirm_delivery(self._on_delivery_confirmation)
+        if not self._confirming:
+            LOGGER.debug('Issuing Confirm.Select RPC command')
+            self._channel.confirm_delivery(self._on_delivery_confirmation)
+            self._confirming = True
 
         self._on_started()
 
     def _on_delivery_confirmation(self, method_frame):
-        confirmation_type = method_frame.method.NAME.split('.')[1].lower()
-        LOGGER.debug('Received %s for delivery tag: %i', confirmation_type,
-                     method_frame.method.delivery_tag)
+        method = method_frame.method
+        confirmation_type = method.NAME.split('.')[1].lower()
+        LOGGER.debug('Received %s for delivery tag: %i (multiple: %s)',
+                     confirmation_type, method.delivery_tag, method.multiple)
+
+        if method.multiple:
+            # Confirms every outstanding tag up to this one, a zero tag
+            # confirms all of them
+            while self._deliveries:
+                tag = next(iter(self._deliveries))
+                if method.delivery_tag and tag > method.delivery_tag:
+                    break
+                tag, entries = self._deliveries.popitem(last=False)
+                self._confirm(confirmation_type, tag, entries)
+        elif method.delivery_tag in self._deliveries:
+            entries = self._deliveries.pop(method.delivery_tag)
+            self._confirm(confirmation_type, method.delivery_tag, entries)
 
-        if confirmation_type == 'ack':
-            self._acked += 1
-        elif confirmation_type == 'nack':
-            self._nacked += 1
-
-        self._deliveries.remove(method_frame.method.delivery_tag)
         LOGGER.debug(
             'Published %i messages, %i have yet to be confirmed, '
-            '%i were acked and %i were nacked', self._message_number,
+            '%i items were acked and %i were nacked', self._messages,
             len(self._deliveries), self._acked, self._nacked)
 
-    def _publish(self, item):
-        if self._channel is None or not self._channel.is_open:
+        self._schedule_publish()
+
+    def _confirm(self, confirmation_type, tag, entries):
+        UNCONFIRMED.dec()
+        CONFIRM_SECONDS.observe(time.monotonic() - self._sent.pop(tag))
+        if confirmation_type == 'ack':
+            self._acked += len(entries)
             return
 
+        for item, attempts in entries:
+            self._nacked += 1
+            if attempts < self._max_retries:
+                self._retried += 1
+                self._retries.append((item, attempts + 1))
+            else:
+                LOGGER.error('Item nacked %i times, giving up', attempts)
+                self._failed += 1
+
+    @staticmethod
+    def _get_message(item):
+        # Removed products are published with their item and a distinct
+        # message type
+        if isinstance(item, Tombstone):
+            return item.item, 'tombstone'
+        return item, None
+
+    def _publish(self, item, attempts=1):
+        message, message_type = self._get_message(item)
+
         properties = pika.BasicProperties(
             app_id=self._app_id,
             content_type='application/protobuf',
+            delivery_mode=1,
+            type=message_type)
+
+        self._send(message.SerializeToString(), properties,
+                   [(item, attempts)])
+
+    def _add_to_batch(self, item, attempts):
+        message, message_type = self._get_message(item)
+        record = batch.encode_record(message.SerializeToString(), message_type)
+
+        if not self._batch:
+            self._batch_started = time.monotonic()
+        self._batch.append((item, attempts))
+        self._batch_records.append(record)
+        self._batch_bytes += len(record)
+
+        if (len(self._batch) >= self._batch_size or
+                self._batch_bytes >= self._batch_max_bytes):
+            self._flush_batch()
+
+    def _flush_batch(self):
+        properties = pika.BasicProperties(
+            app_id=self._app_id,
+            content_type=batch.CONTENT_TYPE,
+            content_encoding=self._compression,
             delivery_mode=1)
 
+        body = batch.encode_batch(self._batch_records, self._compression)
+        entries = self._batch
+        self._reset_batch()
+
+        self._send(body, properties, entries)
+
+    def _send(self, body, properties, entries):
         self._channel.basic_publish(
             exchange=self._exchange_name,
             routing_key=self._routing_key,
-            body=item.SerializeToString(),
+            body=body,
             properties=properties,
             mandatory=True)
 
         self._message_number += 1
-        self._deliveries.append(self._message_number)
+        self._published += len(entries)
+        self._messages += 1
+        self._bytes += len(body)
+        self._deliveries[self._message_number] = entries
+        self._sent[self._message_number] = time.monotonic()
+        UNCONFIRMED.inc()
 
-        LOGGER.debug('Published item # %i', self._message_number)
+        LOGGER.debug('Published message # %i with %i items',
+                     self._message_number, len(entries))
 
     def _stop(self):
         LOGGER.debug('Stopping publisher')
@@ -216,6 +623,56 @@ heartbeat={}'.format(
             self._channel.close()
 
     def _close_connection(self):
-        if self._connection is not None:
+        if (self._connection is not None and
+                not self._connection.is_closing and
+                not self._connection.is_closed):
             LOGGER.debug('Closing connection')
             self._connection.close()
+
+
+class PublisherPool:
+    def __init__(self, create_publisher):
+        self._create_publisher = create_publisher
+        self._publishers = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self):
+        # pika connections are not thread safe, each thread gets its own
+        # long-lived publisher
+        key = threading.get_ident()
+
+        self._check_pid()
+        publisher = self._publishers.get(key)
+        if publisher is None:
+            with self._lock:
+                publisher = self._publishers.get(key)
+                if publisher is None:
+                    publisher = self._create_publisher()
+                    self._publishers[key] = publisher
+
+        return publisher
+
+    def publish(self, source, items):
+        return self.get().publish(source, items)
+
+    def _check_pid(self):
+        # Connections inherited through a fork share their sockets with the
+        # parent process, start over with fresh ones
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._publishers = {}
+                self._pid = os.getpid()
+
+    def close(self):
+        with self._lock:
+            publishers, self._publishers = self._publishers, {}
+
+        for publisher in publishers.values():
+            publisher.close()
+
+    def __len__(self):
+        return len(self._publishers)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from urllib.parse import urlsplit
+import threading
+import struct
+import fcntl
+import time
+import os
+import re
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._lock = threading.Lock()
+        self._state = (self.burst, time.monotonic())
+
+    def reserve(self):
+        # Takes a token and returns how long to wait before using it. Tokens
+        # may go negative so that concurrent callers queue up fairly.
+        with self._lock:
+            self._state, delay = self._take(*self._state)
+        return delay
+
+    def _take(self, tokens, timestamp):
+        now = time.monotonic()
+        # A timestamp from the future never takes tokens away
+        tokens = min(self.burst,
+                     tokens + max(0., now - timestamp) * self.rate)
+        tokens -= 1
+        return (tokens, now), max(0., -tokens / self.rate)
+
+
+class FileTokenBucket(TokenBucket):
+    # Bucket state lives in a small file locked with flock, so that it is
+    # shared by every process of the machine using the same path. The
+    # monotonic clock is system-wide, hence comparable between processes.
+    _STATE = struct.Struct('dd')
+
+    def __init__(self, path, rate, burst=1):
+        super().__init__(rate, burst)
+        self.path = path
+        self._open()
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._pid = os.getpid()
+
+    def reserve(self):
+        with self._lock:
+            # A descriptor inherited through a fork shares its lock with the
+            # parent process, reopen the file to get our own
+            if self._pid != os.getpid():
+                self._open()
+
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(self._fd, self._STATE.size, 0)
+                state = None
+                if len(data) == self._STATE.size:
+                    state = self._STATE.unpack(data)
+                    # Written before a reboot, when the monotonic clock was
+                    # ahead of ours, the state is meaningless
+                    if state[1] > time.monotonic():
+                        state = None
+                if state is None:
+                    state = (self.burst, time.monotonic())
+
+                state, delay = self._take(*state)
+                os.pwrite(self._fd, self._STATE.pack(*state), 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        return delay
+
+    def close(self):
+        os.close(self._fd)
+
+
+class RateLimiter:
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _create_bucket(self, host, rate, burst):
+        if not self._directory:
+            return TokenBucket(rate, burst)
+
+        filename = '{}.bucket'.format(re.sub(r'[^A-Za-z0-9.-]', '_', host))
+        return FileTokenBucket(
+            os.path.join(self._directory, filename), rate, burst
+        )
+
+    def get_bucket(self, url, rate, burst=1):
+        host = urlsplit(url).netloc
+        key = (host, rate, burst)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._create_bucket(host, rate, burst)
+                    self._buckets[key] = bucket
+
+        return bucket
+
+    def reserve(self, url, rate, burst=1):
+        return self.get_bucket(url, rate, burst).reserve()
+
+    def acquire(self, url, rate, burst=1):
+        delay = self.reserve(url, rate, burst)
+        if delay:
+            time.sleep(delay)
+        return delay
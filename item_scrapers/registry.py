@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from .source import Source
+
+import threading
+import hashlib
+import logging
+import json
+import time
+import yaml
+import os
+
+SOURCE_EXTENSIONS = ('.yml', '.yaml')
+
+
+class _File:
+    __slots__ = ('path', 'mtime', 'size', 'hash')
+
+    def __init__(self, path, mtime, size, hash):
+        self.path = path
+        self.mtime = mtime  # In nanoseconds
+        self.size = size
+        self.hash = hash
+
+    def is_unchanged(self, path, stat):
+        return (self.path, self.mtime, self.size) == \
+            (path, stat.st_mtime_ns, stat.st_size)
+
+
+class SourceRegistry:
+    # Sources of the YAML files of a directory, each compiled once. Files
+    # are looked at again every reload_interval seconds, if set, and the
+    # sources of those changed since are replaced without restarting. A
+    # file that fails to load leaves its previous source in place.
+    #
+    # Parsed configurations are cached in cache_directory by the mtime and
+    # hash of their file, so that other processes and restarts neither
+    # parse unchanged files nor, when their mtime is the same, read them.
+    def __init__(self, directory, cache_directory=None, reload_interval=None):
+        self.directory = directory
+        self.cache_directory = cache_directory
+        self.reload_interval = reload_interval
+        self._sources = {}
+        self._files = {}
+        self._lock = threading.Lock()
+        self._checked = None
+        self._stats = {'loaded': 0, 'cached': 0, 'failed': 0}
+
+        if cache_directory:
+            os.makedirs(cache_directory, exist_ok=True)
+        self.reload()
+
+    def get(self, name):
+        self.maybe_reload()
+        return self._sources.get(name)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        return len(self._sources)
+
+    def get_names(self):
+        return sorted(self._sources)
+
+    def get_stats(self):
+        return dict(self._stats)
+
+    def maybe_reload(self):
+        if self.reload_interval is None or \
+           time.monotonic() - self._checked < self.reload_interval:
+            return []
+
+        return self.reload()
+
+    def reload(self):
+        # Returns the names of the sources added, replaced or removed
+        with self._lock:
+            self._checked = time.monotonic()
+            changed = []
+            paths = self._find_files()
+            for name, path in paths.items():
+                if self._load(name, path):
+                    changed.append(name)
+
+            for name in set(self._sources) - set(paths):
+                logging.info('Source %s removed', name)
+                del self._sources[name]
+                self._files.pop(name, None)
+                changed.append(name)
+
+            return sorted(changed)
+
+    def _find_files(self):
+        # Sources are named after their file, the last one found wins
+        paths = {}
+        for root, dirs, files in os.walk(self.directory):
+            dirs.sort()
+            for file in sorted(files):
+                name, ext = os.path.splitext(file)
+                if ext.lower() in SOURCE_EXTENSIONS:
+                    paths[name] = os.path.join(root, file)
+        return paths
+
+    def _load(self, name, path):
+        try:
+            stat = os.stat(path)
+            known = self._files.get(name)
+            if known is not None and known.is_unchanged(path, stat):
+                return False
+
+            file, config = self._read(name, path, stat)
+            if known is not None and known.hash == file.hash:
+                # Touched but not modified
+                self._files[name] = file
+                return False
+
+            source = Source(name, config)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            self._stats['failed'] += 1
+            logging.error('Source %s not loaded from %s: %s', name, path, e)
+            return False
+
+        if name in self._sources:
+            logging.info('Source %s reloaded from %s', name, path)
+        self._sources[name] = source
+        self._files[name] = file
+        self._stats['loaded'] += 1
+        return True
+
+    def _read(self, name, path, stat):
+        cached = self._read_cache(name)
+        if cached is not None and cached.get('path') == path and \
+           cached.get('mtime') == stat.st_mtime_ns and \
+           cached.get('size') == stat.st_size:
+            self._stats['cached'] += 1
+            return self._get_file(path, stat, cached['hash']), \
+                cached['config']
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        file = self._get_file(path, stat, hashlib.sha1(data).hexdigest())
+        if cached is not None and cached.get('hash') == file.hash:
+            self._stats['cached'] += 1
+            config = cached['config']
+        else:
+            config = yaml.safe_load(data)
+        self._write_cache(name, file, config)
+
+        return file, config
+
+    @staticmethod
+    def _get_file(path, stat, hash):
+        return _File(path, stat.st_mtime_ns, stat.st_size, hash)
+
+    def _get_cache_path(self, name):
+        return os.path.join(self.cache_directory, '{}.json'.format(name))
+
+    def _read_cache(self, name):
+        if not self.cache_directory:
+            return None
+
+        try:
+            with open(self._get_cache_path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_cache(self, name, file, config):
+        if not self.cache_directory:
+            return
+
+        # Configurations that JSON would alter, such as those with dates
+        # or keys that are not strings, are parsed every time instead
+        try:
+            if json.loads(json.dumps(config)) != config:
+                return
+        except (TypeError, ValueError):
+            return
+
+        # Other processes may write it too, reloads of this one are locked
+        path = self._get_cache_path(name)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    'path': file.path,
+                    'mtime': file.mtime,
+                    'size': file.size,
+                    'hash': file.hash,
+                    'config': config
+                }, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning('Source %s not cached: %s', name, e)
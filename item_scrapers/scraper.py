@@ -2,73 +2,64 @@
 # -*- coding: utf-8 -*-
 
 from sizematch.protobuf.items.items_pb2 import Item, Lang
-from .utils import urljoin
-
-from requests.packages.urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
+from .async_engine import AsyncEngine
+from .checkpoint import CheckpointStore, CombinationCheckpoint
+from .commits import PendingCommits
+from .frontier import create_frontier
+from .http_cache import HttpCache, CacheEntry
+from .index import IndexDiff
+from .metrics import (
+    FETCH_SECONDS, DOWNLOADED_BYTES, RESPONSES, RETRIES, CATEGORY_PAGES, ITEMS
+)
+from .models import Product, Category, CategoryState, Tombstone
+from .ratelimit import RateLimiter
+from .session import SessionPool
+from .shared import CrawlUnit
+from .stats import PhaseTimings
+from .store import ProductStore, create_product_set
+from .stream import ItemStream
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 import requests
 import logging
+import codecs
 import itertools
+import time
 
-
-class Product:
-    def __init__(self, id, urls, slug=None):
-        self.id = id
-        self.urls = urls
-        self.slug = slug
-
-    def __hash__(self):
-        return hash(self.id)
-
-    def __eq__(self, other):
-        if not isinstance(other, Product):
-            return NotImplemented
-
-        return self.id == self.id
-
-    def __repr__(self):
-        return "Product id={} urls={} slug={}".format(
-            self.id, self.urls, self.slug
-        )
-
-
-class Category:
-    def __init__(self, id, url, slug=None):
-        self.id = id
-        self.url = url
-        self.slug = slug
-
-    def __hash__(self):
-        return hash(self.id)
-
-    def __eq__(self, other):
-        if not isinstance(other, Category):
-            return NotImplemented
-
-        return self.id == self.id
-
-    def __repr__(self):
-        return "Category id={} url={} slug={}".format(
-            self.id, self.url, self.slug
-        )
+ITEMS_STREAM_SIZE = 1000
 
 
 class Scraper:
-    def __init__(self):
-        pass
-
-    def _get_session(self, protocol, retries):
-        session = requests.Session()
+    def __init__(self, rate_limit_directory=None, checkpoint_directory=None,
+                 checkpoint_interval=30, http_cache_directory=None,
+                 http_cache_max_size=1 << 30, index_directory=None):
+        self._sessions = SessionPool()
+        self._headers = {}  # By lang
+        self._index_directory = index_directory
+        self._http_cache = None
+        if http_cache_directory:
+            self._http_cache = HttpCache(
+                http_cache_directory, http_cache_max_size
+            )
+        self._rate_limiter = RateLimiter(rate_limit_directory)
+        self._checkpoint_directory = checkpoint_directory
+        self._checkpoint_interval = checkpoint_interval
+
+    def _get_session(self, url, source):
+        return self._sessions.get(
+            url,
+            pool_size=source.get_pool_size(),
+            retries=source.get_retries(),
+            backoff_factor=source.get_backoff_factor()
+        )
 
-        if retries:
-            retry_obj = Retry(total=retries,
-                              read=retries,
-                              connect=retries,
-                              backoff_factor=0.3)
-            session.mount('{}://'.format(protocol),
-                          HTTPAdapter(max_retries=retry_obj))
+    def _get_rate_limit_delay(self, url, source):
+        rate_limit = source.get_rate_limit()
+        if not rate_limit:
+            return 0
 
-        return session
+        return self._rate_limiter.reserve(url, *rate_limit)
 
     def _gen_user_agent(self):
         return 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) \
@@ -81,146 +72,594 @@ AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.149 Safari/537.36'
         }.get(lang.lower())
 
     def _get_headers(self, lang):
-        return {
-            'Accept-Language': self._get_accept_language_header(lang),
-            'User-Agent': self._gen_user_agent()
-        }
+        # Built once per lang, requests add theirs to a copy
+        headers = self._headers.get(lang)
+        if headers is None:
+            headers = self._headers[lang] = {
+                'Accept-Language': self._get_accept_language_header(lang),
+                'User-Agent': self._gen_user_agent()
+            }
+        return headers
 
-    def _do_request(self, method, url, params, lang, timeout=5, retries=1):
-        protocol = url.split(':', 1)[0]
-        session = self._get_session(protocol, retries)
-        headers = self._get_headers(lang)
+    def _do_request(self, method, url, params, source, lang, stream=False,
+                    headers=None):
+        session = self._get_session(url, source)
+        headers = dict(self._get_headers(lang), **(headers or {}))
 
+        start = time.perf_counter()
         try:
             logging.debug('Fetch URL={}, Params={}'.format(url, params))
-            return getattr(session, method.lower())(
+            res = getattr(session, method.lower())(
                 url,
                 params=params,
-                timeout=timeout,
+                timeout=source.get_timeout(),
                 headers=headers,
-                allow_redirects=False
+                allow_redirects=False,
+                stream=stream
             )
         except (requests.exceptions.ReadTimeout,
                 requests.exceptions.ConnectTimeout,
                 requests.exceptions.ConnectionError):
+            RESPONSES.labels(source.name, 'error').inc()
             return None
 
-    def _fetch(self, url, params, lang):
-        res = self._do_request('get', url, params, lang)
+        FETCH_SECONDS.labels(source.name, urlsplit(url).netloc).observe(
+            time.perf_counter() - start
+        )
+        RESPONSES.labels(source.name, res.status_code).inc()
+        # Retries done by the adapter before this response
+        retries = getattr(res.raw, 'retries', None)
+        if retries is not None and retries.history:
+            RETRIES.labels(source.name).inc(len(retries.history))
+
+        return res
+
+    def _iter_chunks(self, res, url, params, source, counter):
+        # Decoded body of the page, chunk by chunk. Bytes are counted before
+        # decoding, as read from the response, into counter[0]. counter[1]
+        # is set when the body could not be read to the end.
+        try:
+            decoder = codecs.getincrementaldecoder(res.encoding or 'utf-8')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder('utf-8')
+        decoder = decoder(errors='replace')
+
+        try:
+            for raw in res.iter_content(
+                chunk_size=source.get_extraction_chunk_size()
+            ):
+                counter[0] += len(raw)
+                chunk = decoder.decode(raw)
+                if chunk:
+                    yield chunk
+            chunk = decoder.decode(b'', final=True)
+            if chunk:
+                yield chunk
+        except requests.exceptions.RequestException as e:
+            logging.warning(
+                'Failed to read page. URL={}, Params={}: {}'.format(
+                    url, params, e)
+            )
+            counter[1] = True
+        finally:
+            res.close()
+
+    def _extract_response(self, res, url, params, source, lang, brand,
+                          count_pages):
+        # Returns the extraction result, the body when it was read as a
+        # whole, its size, the page count when looked for and whether the
+        # body was read to the end
+        extractor = source.get_extractor()
+        url_prefix = source.get_url_prefix(lang, brand)
+
+        if source.get_extraction_mode() == 'chunked':
+            counter = [0, False]
+            page_count = [None]
+            chunks = self._iter_chunks(res, url, params, source, counter)
+            if count_pages:
+                chunks = extractor.scan_page_count(
+                    chunks, source.get_extraction_overlap(), page_count
+                )
+            result = extractor.extract_chunks(
+                chunks, url_prefix, source.get_extraction_overlap()
+            )
+            return result, None, counter[0], page_count[0], not counter[1]
+
+        # Decoded once, requests does not keep the text of a response
+        html = res.text
+        page_count = None
+        if count_pages:
+            page_count = extractor.extract_page_count(html)
+        return extractor.extract(html, url_prefix), html, \
+            len(res.content), page_count, True
+
+    def _scrape_page(self, url, params, source, lang, brand,
+                     count_pages=False, timings=None):
+        # Returns the categories and products of a page, along with the
+        # page count of its category when count_pages is set and it is found
+        if timings is None:
+            timings = PhaseTimings()
+        cache = self._http_cache
+        entry = None
+        headers = {}
+        if cache is not None:
+            key = cache.get_key(url, params, lang)
+            fingerprint = source.get_extraction_fingerprint(lang, brand)
+            with timings.measure('cache'):
+                entry = cache.get(key)
+            # Without a body, a result extracted differently is useless
+            if entry is not None and (entry.fingerprint == fingerprint or
+                                      entry.body is not None):
+                headers = entry.get_validators()
+            else:
+                entry = None
+
+        with timings.measure('fetch'):
+            res = self._do_request(
+                'get', url, params, source, lang,
+                stream=source.get_extraction_mode() == 'chunked',
+                headers=headers
+            )
         if not res:
             logging.warning(
                 'Failed to fetch page. URL={}, Params={}'.format(url, params)
             )
-            return ""
-
-        return res.text
-
-    def _paginate(self, category, products, source, lang, brand):
-        for url, params in source.paginate_category(category, lang, brand):
-            html = self._fetch(url, params, lang)
-
-            new_categories = {
-                Category(
-                    id=match.group('id'),
-                    url=urljoin(
-                        source.get_base_url(lang, brand),
-                        match.group('url')
-                    ),
-                    slug=match.groupdict().get('slug')  # None if undefined
-                )
-                for match in source.get_categories_regex()
-                                   .finditer(html)
-            }
+            timings.count('failed_pages')
+            return set(), set(), None
+
+        if res.status_code == 304 and entry is not None:
+            res.close()
+            cache.record_hit(source, entry)
+            timings.count('cached_pages')
+            if entry.fingerprint != fingerprint:
+                extractor = source.get_extractor()
+                with timings.measure('extract'):
+                    entry.result = extractor.extract(
+                        entry.body, source.get_url_prefix(lang, brand)
+                    )
+                    entry.page_count = extractor.extract_page_count(
+                        entry.body
+                    )
+                entry.fingerprint = fingerprint
+                with timings.measure('cache'):
+                    cache.put(entry)
+            categories, products = entry.result
+            return categories, products, \
+                entry.page_count if count_pages else None
+
+        # When extracting in chunks, this includes reading the body
+        with timings.measure('extract'):
+            result, body, size, page_count, read = self._extract_response(
+                res, url, params, source, lang, brand, count_pages
+            )
 
-            new_products = {
-                Product(
-                    id=match.group('id'),
-                    urls=[urljoin(
-                        source.get_base_url(lang, brand),
-                        match.group('url')
-                    )],
-                    slug=match.groupdict().get('slug')  # None if undefined
-                )
-                for match in source.get_products_regex()
-                                   .finditer(html)
-            }
+        DOWNLOADED_BYTES.labels(source.name).inc(size)
+        timings.count('pages')
+        timings.count('bytes', size)
+        if not read:
+            # What was found is kept, the rest of the page is missing
+            timings.count('failed_pages')
+        elif cache is not None:
+            cache.record_miss(source)
+            etag = res.headers.get('ETag')
+            last_modified = res.headers.get('Last-Modified')
+            if etag or last_modified:
+                with timings.measure('cache'):
+                    cache.put(CacheEntry(
+                        key, etag, last_modified, fingerprint, result, body,
+                        size, page_count
+                    ))
+
+        categories, products = result
+        return categories, products, page_count
+
+    def _fetch_page(self, url, params, source, lang, brand,
+                    count_pages=False, timings=None):
+        delay = self._get_rate_limit_delay(url, source)
+        if delay:
+            time.sleep(delay)
+            if timings is not None:
+                timings.add('rate_limit', delay)
+
+        return self._scrape_page(url, params, source, lang, brand,
+                                 count_pages, timings)
+
+    def _paginate(self, category, products, source, lang, brand,
+                  timings=None):
+        # Yields the categories and products of every page along with
+        # whether the end of the category is still to be found. Once the
+        # page count is known from the first page, the remaining pages are
+        # fetched concurrently, otherwise one at a time until the end.
+        pages = source.paginate_category(category, lang, brand)
+        url, params = next(pages)
+        new_categories, new_products, page_count = self._fetch_page(
+            url, params, source, lang, brand, source.has_page_count(),
+            timings
+        )
+        yield new_categories, new_products, page_count is None
 
-            yield new_categories, new_products
+        if page_count is None:
+            for url, params in pages:
+                new_categories, new_products, _ = self._fetch_page(
+                    url, params, source, lang, brand, timings=timings
+                )
+                yield new_categories, new_products, True
+            return
 
-            # Apply delay if any
-            source.apply_delay()
+        with ThreadPoolExecutor(
+            max_workers=source.get_pagination_concurrency()
+        ) as executor:
+            futures = [
+                executor.submit(self._fetch_page, url, dict(params), source,
+                                lang, brand, False, timings)
+                for url, params in itertools.islice(
+                    pages, max(page_count - 1, 0))
+            ]
+            try:
+                for future in futures:
+                    new_categories, new_products, _ = future.result()
+                    yield new_categories, new_products, False
+            finally:
+                for future in futures:
+                    future.cancel()
 
     def _scrape_category(self, category, products, source, lang, brand,
-                         max_products_per_category):
-        categories = set()
-        total_products = 0
-
-        for new_categories, new_products in self._paginate(
-            category, products, source, lang, brand
+                         max_products_per_category, on_products,
+                         timings=None, keep_products=False):
+        if timings is None:
+            timings = PhaseTimings()
+        state = CategoryState(products, max_products_per_category,
+                              on_products, keep_products)
+
+        for new_categories, new_products, probe in self._paginate(
+            category, products, source, lang, brand, timings
         ):
-            if new_categories.issubset(categories) and \
-               new_products.issubset(products):
-                return categories
-
-            categories.update(new_categories)
-
-            new_products = new_products.difference(products)
-            total_products += len(new_products)
-            if max_products_per_category and \
-               total_products > max_products_per_category:
-                for _ in range(total_products - max_products_per_category):
-                    new_products.pop()
-                products.update(new_products)
-                return categories
+            # Products handed over to on_products are measured apart
+            with timings.measure('dedupe'):
+                exhausted = not state.update(
+                    new_categories, new_products, probe
+                )
+            if exhausted:
+                break
+
+        CATEGORY_PAGES.labels(source.name).observe(state.pages)
+        return state
+
+    def _create_frontier(self, source, max_categories):
+        return create_frontier(
+            source.get_frontier_order(),
+            max_categories=max_categories,
+            max_depth=source.get_frontier_max_depth(),
+            max_size=source.get_frontier_max_size()
+        )
+
+    def _init_crawl(self, source, lang, brand, max_categories,
+                    on_products, checkpoint, unit=None):
+        categories = set()
+        products = create_product_set(
+            source.get_dedupe_mode(),
+            capacity=source.get_dedupe_capacity(),
+            error_rate=source.get_dedupe_error_rate()
+        )
+        frontier = self._create_frontier(source, max_categories)
+
+        if unit is not None:
+            on_products = unit.wrap(on_products)
+            # Categories are limited by the claims of all units together
+            frontier.max_categories = None
+            frontier.claim = unit.claim_category
+            if unit.category is None:
+                # Base category alone, crawled while planning, its subtrees
+                # are other units
+                base_products = unit.get_base_products()
+                products.update(product.id for product in base_products)
+                if base_products:
+                    on_products(base_products)
             else:
-                products.update(new_products)
+                frontier.push(unit.category, depth=1, root=True)
+            return categories, products, frontier, on_products
+
+        if checkpoint is not None:
+            if checkpoint.restore(frontier, categories, products):
+                logging.info("[Lang {}, Brand {}] Resuming, {} categories \
+queued, {} visited".format(lang, brand, len(frontier), len(categories)))
+                return categories, products, frontier, on_products
+
+        frontier.push(self._get_base_category(source, lang, brand), root=True)
+
+        return categories, products, frontier, on_products
+
+    def _crawl(self, source, lang, brand, max_categories,
+               max_products_per_category, on_products, checkpoint=None,
+               unit=None, timings=None):
+        # Crawl the category tree of a lang/brand, new products are passed
+        # to on_products as soon as they are first seen
+        if timings is None:
+            timings = PhaseTimings()
+        if source.get_engine() == 'async':
+            return AsyncEngine(self).crawl(
+                source, lang, brand,
+                max_categories, max_products_per_category, on_products,
+                checkpoint, unit, timings
+            )
 
-    def _walk(self, category, categories, products, source, lang, brand,
-              max_categories, max_products_per_category):
-        if max_categories and len(categories) > max_categories:
-            return
+        categories, products, frontier, on_products = self._init_crawl(
+            source, lang, brand, max_categories, on_products, checkpoint,
+            unit
+        )
 
-        categories.add(category)
-        for cat in self._scrape_category(
-          category, products, source, lang, brand, max_products_per_category
-        ):
-            if cat not in categories:
-                self._walk(cat, categories, products, source, lang, brand,
-                           max_categories, max_products_per_category)
+        while frontier:
+            category, depth = frontier.pop()
+            state = self._scrape_category(
+                category, products, source, lang, brand,
+                max_products_per_category, on_products, timings,
+                checkpoint is not None
+            )
+            if depth:
+                categories.add(category.id)
+
+            for cat in state.categories:
+                frontier.push(cat, depth + 1, state.get_yield())
+
+            if checkpoint is not None:
+                if depth:
+                    checkpoint.add_category(category.id)
+                checkpoint.add_products(state.new_products)
+                with timings.measure('checkpoint'):
+                    checkpoint.maybe_save(frontier)
+
+        self._count_dropped(frontier, timings)
+        return categories, products
+
+    @staticmethod
+    def _count_dropped(frontier, timings):
+        # Categories found but not crawled, max_categories aside
+        dropped = frontier.dropped + frontier.too_deep
+        if dropped:
+            timings.count('dropped_categories', dropped)
+
+    def _is_complete(self, max_categories, max_products_per_category,
+                     timings):
+        # Whether every category of the source was crawled to its end, so
+        # that products missing from the crawl can be told removed. Failed
+        # pages end their category early.
+        counts = timings.get_counts()
+        return not max_categories and not max_products_per_category and \
+            not counts.get('failed_pages') and \
+            not counts.get('dropped_categories')
 
     def _get_all(self, source, lang, brand, max_categories,
-                 max_products_per_category):
-        categories = set()
-        products = set()
-        base_category = Category(
+                 max_products_per_category, checkpoint=None, unit=None,
+                 timings=None):
+        products = ProductStore()
+        categories, _ = self._crawl(
+            source, lang, brand,
+            max_categories, max_products_per_category, products.extend,
+            checkpoint, unit, timings
+        )
+        if checkpoint is not None:
+            products.extend(checkpoint.restored_products)
+
+        return categories, products
+
+    def _get_base_category(self, source, lang, brand):
+        return Category(
             id=0,
             url=source.get_base_url(lang, brand),
             slug='base-category'
         )
 
-        self._walk(base_category, categories, products, source, lang, brand,
-                   max_categories, max_products_per_category)
-        categories.discard(base_category)
+    def _make_item(self, source, lang, brand, product):
+        return Item(
+            source=source.name,
+            lang=Lang.Value(lang.upper()),
+            brand=brand,
+            urls=product.urls
+        )
 
-        return categories, products
+    def _get_index_diff(self, source, lang, brand, incremental):
+        if not incremental:
+            return None
 
-    def scrape(self, source, max_categories=None,
-               max_products_per_category=None):
+        return IndexDiff(IndexDiff.get_path(
+            self._index_directory, source, lang, brand
+        ))
+
+    def _scrape_combination(self, source, lang, brand, max_categories,
+                            max_products_per_category, stats, stream,
+                            checkpoint_store, incremental, tombstones,
+                            pending, unit=None):
+        # Products of a combination already done are emitted again, as
+        # they may not have been delivered
+        if checkpoint_store is not None and \
+           checkpoint_store.is_done(lang, brand):
+            logging.info("[Lang {}, Brand {}] Already done, emitting its \
+products again".format(lang, brand))
+
+        checkpoint = None
+        if checkpoint_store is not None:
+            checkpoint = CombinationCheckpoint(
+                checkpoint_store, lang, brand, self._checkpoint_interval
+            )
+
+        start = time.monotonic()
+        timings = PhaseTimings()
+        diff = self._get_index_diff(source, lang, brand, incremental)
+
+        def emit(new_products):
+            # When incremental, only products new since the previous crawl
+            # are emitted. Includes the time waiting for room in the stream.
+            with timings.measure('emit'):
+                for product in new_products:
+                    if diff is not None and not diff.add(product):
+                        continue
+                    stream.put(self._make_item(source, lang, brand, product))
+
+        try:
+            if source.is_streaming():
+                categories, products = self._crawl(
+                    source, lang, brand,
+                    max_categories, max_products_per_category, emit,
+                    checkpoint, unit, timings
+                )
+                if checkpoint is not None:
+                    emit(checkpoint.restored_products)
+            else:
+                categories, products = self._get_all(
+                    source, lang, brand,
+                    max_categories, max_products_per_category, checkpoint,
+                    unit, timings
+                )
+                emit(products)
+
+            # A partial crawl would report every product it missed as
+            # removed, only a complete one replaces the index, once its
+            # items are delivered
+            if diff is not None and self._is_complete(
+                max_categories, max_products_per_category, timings
+            ):
+                # False positives of a Bloom filter skip live products, they
+                # are only emitted again by the next crawl
+                tombstones = tombstones and \
+                    source.get_dedupe_mode() != 'bloom'
+                with timings.measure('index'):
+                    for url in diff.iter_removed():
+                        if tombstones:
+                            stream.put(Tombstone(self._make_item(
+                                source, lang, brand,
+                                Product(id=None, urls=[url])
+                            )))
+                    diff.prepare()
+                    pending.add(diff.commit, diff.discard)
+            elif diff is not None:
+                logging.info("[Lang {}, Brand {}] Partial crawl, index and \
+removed products left as is".format(lang, brand))
+                diff.discard()
+        finally:
+            if diff is not None:
+                diff.close()
+
+        if checkpoint is not None:
+            checkpoint.done()
+
+        elapsed = time.monotonic() - start
+        # Products seen by a unit may have been emitted by another one
+        product_count = len(products) if unit is None else unit.emitted
+
+        logging.info("[Lang {}, Brand {}] {} categories, {} products, {:.1f}s"
+                     .format(lang, brand, len(categories), product_count,
+                             elapsed))
+        if diff is not None:
+            logging.info("[Lang {}, Brand {}] {} added, {} changed, {} \
+removed, {} unchanged".format(lang, brand, diff.added, diff.changed,
+                              diff.removed, diff.unchanged))
+
+        if stats is not None:
+            stats.add_combination(
+                lang, brand, len(categories), product_count, elapsed, diff,
+                timings
+            )
+
+    def plan(self, source, store, max_categories=None,
+             max_products_per_category=None):
+        # Splits the crawl of a source into units: the subtree of every
+        # top-level category of each lang/brand, plus their base categories
+        # alone. Top-level categories are claimed upfront so that no unit
+        # wanders into the subtree of another one. Base categories are
+        # crawled here, their products are saved for their unit to emit.
+        units = []
         for lang, brand in itertools.product(
-          source.get_langs(),
-          source.get_brands()
+            source.get_langs(),
+            source.get_brands()
         ):
-            categories, products = self._get_all(
-                source, lang, brand,
-                max_categories, max_products_per_category
+            base = self._get_base_category(source, lang, brand)
+            state = self._scrape_category(
+                base, set(), source, lang, brand, max_products_per_category,
+                None, keep_products=True
             )
-            logging.info("[Lang {}, Brand {}] {} categories, {} products"
-                         .format(lang, brand, len(categories), len(products)))
-
-            for product in products:
-                yield Item(
-                    source=source.name,
-                    lang=Lang.Value(lang.upper()),
-                    brand=brand,
-                    urls=product.urls
-                )
+            store.save_base_products(lang, brand, state.new_products)
+
+            units.append(CrawlUnit(store, lang, brand, None, max_categories))
+            for category in sorted(state.categories, key=lambda c: c.url):
+                if store.claim_category(lang, brand, category.id,
+                                        max_categories):
+                    units.append(CrawlUnit(
+                        store, lang, brand, category, max_categories
+                    ))
+
+        return units
+
+    def get_http_cache_stats(self, source):
+        if self._http_cache is None:
+            return None
+
+        return self._http_cache.get_stats(source)
+
+    def _get_checkpoint_store(self, source, resume):
+        if not self._checkpoint_directory:
+            return None
+
+        store = CheckpointStore.create(self._checkpoint_directory, source)
+        if store is None:
+            logging.warning("Checkpoint of {} held by another scrape, \
+crawling without".format(source.name))
+            return None
+        if not resume:
+            store.clear()
+
+        return store
+
+    def scrape(self, source, max_categories=None,
+               max_products_per_category=None, stats=None, resume=False,
+               incremental=False, tombstones=False, unit=None, pending=None):
+        # Lang/brand combinations are crawled in parallel and push their
+        # items to a bounded stream, either as soon as they are found when
+        # streaming or once the combination is complete. Given a unit, only
+        # that part of a distributed crawl is scraped.
+        #
+        # Index replacements and the removal of the checkpoint are added to
+        # pending, for the caller to commit once the items are delivered.
+        # Without pending, they are committed once every item is consumed.
+        if incremental and not self._index_directory:
+            raise ValueError('Incremental scrapes require an index directory')
+        if unit is not None and (incremental or resume):
+            raise ValueError('Crawl units cannot be incremental or resumed')
+
+        own_pending = pending is None
+        if own_pending:
+            pending = PendingCommits()
+        combinations = [(unit.lang, unit.brand)] if unit is not None else \
+            list(itertools.product(source.get_langs(), source.get_brands()))
+        checkpoint_store = None
+        if unit is None:
+            checkpoint_store = self._get_checkpoint_store(source, resume)
+        if checkpoint_store is not None:
+            pending.add(checkpoint_store.close, checkpoint_store.close)
+        stream = ItemStream(ITEMS_STREAM_SIZE)
+        executor = ThreadPoolExecutor(max_workers=source.get_parallelism())
+        futures = [
+            executor.submit(
+                stream.produce, self._scrape_combination, source, lang, brand,
+                max_categories, max_products_per_category, stats, stream,
+                checkpoint_store, incremental, tombstones, pending, unit
+            )
+            for lang, brand in combinations
+        ]
+
+        items = ITEMS.labels(source.name)
+        try:
+            for item in stream.iter(len(futures)):
+                items.inc()
+                yield item
+            # Crawl complete, the next one starts from scratch
+            if checkpoint_store is not None:
+                pending.add(checkpoint_store.clear)
+            if own_pending:
+                pending.commit()
+        finally:
+            stream.close()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+            if own_pending:
+                pending.discard()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from requests.packages.urllib3.util.retry import Retry
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from http.cookiejar import DefaultCookiePolicy
+import requests
+import threading
+import os
+
+
+class SessionPool:
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self, url, pool_size=10, retries=1, backoff_factor=0.3):
+        # Sources sharing a host only share a session if they configure it
+        # the same way
+        url = urlsplit(url)
+        key = (url.scheme, url.netloc, pool_size, retries, backoff_factor)
+
+        self._check_pid()
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = self._create_session(
+                        url.scheme, pool_size, retries, backoff_factor
+                    )
+                    self._sessions[key] = session
+
+        return session
+
+    def _create_session(self, protocol, pool_size, retries, backoff_factor):
+        session = requests.Session()
+        # Shared by every lang, brand and task, a session only pools
+        # connections: cookies set by a response are never sent again
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        retry_obj = 0
+        if retries:
+            retry_obj = Retry(total=retries,
+                              read=retries,
+                              connect=retries,
+                              backoff_factor=backoff_factor)
+
+        session.mount('{}://'.format(protocol),
+                      HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=pool_size,
+                                  max_retries=retry_obj))
+
+        return session
+
+    def _check_pid(self):
+        # Sessions inherited through a fork share their sockets with the
+        # parent process, start over with fresh ones
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._sessions = {}
+                self._pid = os.getpid()
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+
+        for session in sessions.values():
+            session.close()
+
+    def __len__(self):
+        return len(self._sessions)
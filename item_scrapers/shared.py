@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from .models import Category, Product
+
+import threading
+import sqlite3
+import json
+import os
+
+
+class SharedStore:
+    # Dedupe state shared by the tasks of a distributed crawl: the products
+    # and categories claimed so far in every lang/brand combination, and the
+    # products of the base categories crawled while planning. Kept in a
+    # SQLite file, every task must have access to the same directory.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS claims (
+                kind TEXT NOT NULL,
+                combination TEXT NOT NULL,
+                id TEXT NOT NULL,
+                PRIMARY KEY (kind, combination, id)
+            ) WITHOUT ROWID
+        ''')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS base_products (
+                combination TEXT NOT NULL,
+                id TEXT NOT NULL,
+                urls TEXT NOT NULL,
+                slug TEXT
+            )
+        ''')
+
+    @staticmethod
+    def create(directory, source, run_id):
+        os.makedirs(directory, exist_ok=True)
+        return SharedStore(os.path.join(
+            directory, '{}-{}.sqlite'.format(source.name, run_id)
+        ))
+
+    def claim(self, kind, lang, brand, ids, limit=None):
+        # Returns the IDs that were not claimed yet, now claimed by the
+        # caller, in a single transaction. Given a limit, no more IDs of
+        # that kind are claimed in the combination by all tasks together.
+        combination = json.dumps([lang, brand])
+        claimed = []
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                count = 0
+                if limit:
+                    count, = self._db.execute(
+                        'SELECT COUNT(*) FROM claims \
+WHERE kind = ? AND combination = ?', (kind, combination)).fetchone()
+                for id in ids:
+                    if limit and count >= limit:
+                        break
+                    cursor = self._db.execute(
+                        'INSERT OR IGNORE INTO claims VALUES (?, ?, ?)',
+                        (kind, combination, str(id))
+                    )
+                    if cursor.rowcount:
+                        claimed.append(id)
+                        count += 1
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+
+        return claimed
+
+    def claim_category(self, lang, brand, id, limit=None):
+        return bool(self.claim('category', lang, brand, [id], limit))
+
+    def claim_products(self, lang, brand, products):
+        ids = set(self.claim(
+            'product', lang, brand, [product.id for product in products]
+        ))
+        return [product for product in products if product.id in ids]
+
+    def save_base_products(self, lang, brand, products):
+        combination = json.dumps([lang, brand])
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.executemany(
+                    'INSERT INTO base_products VALUES (?, ?, ?, ?)',
+                    ((combination, str(product.id), json.dumps(product.urls),
+                      product.slug) for product in products)
+                )
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def load_base_products(self, lang, brand):
+        with self._lock:
+            return [
+                Product(id=row[0], urls=json.loads(row[1]), slug=row[2])
+                for row in self._db.execute(
+                    'SELECT id, urls, slug FROM base_products \
+WHERE combination = ?', (json.dumps([lang, brand]),))
+            ]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def remove(self):
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.unlink(self.path + suffix)
+            except FileNotFoundError:
+                pass
+
+
+class CrawlUnit:
+    # Part of a distributed crawl: the subtree of a top-level category of a
+    # lang/brand, or its base category alone, whose products were found
+    # while planning. Products are only emitted by the first unit claiming
+    # them, and categories only crawled by one unit, up to max_categories
+    # for all units together.
+    def __init__(self, store, lang, brand, category=None,
+                 max_categories=None):
+        self.store = store
+        self.lang = lang
+        self.brand = brand
+        self.category = category
+        self.max_categories = max_categories
+        self.emitted = 0
+
+    def wrap(self, on_products):
+        def wrapped(products):
+            products = self.store.claim_products(
+                self.lang, self.brand, products
+            )
+            self.emitted += len(products)
+            if products:
+                on_products(products)
+
+        return wrapped
+
+    def claim_category(self, id):
+        return self.store.claim_category(
+            self.lang, self.brand, id, self.max_categories
+        )
+
+    def get_base_products(self):
+        return self.store.load_base_products(self.lang, self.brand)
+
+    def to_dict(self):
+        category = None
+        if self.category is not None:
+            category = {
+                'id': self.category.id,
+                'url': self.category.url,
+                'slug': self.category.slug
+            }
+
+        return {
+            'lang': self.lang,
+            'brand': self.brand,
+            'category': category,
+            'max_categories': self.max_categories
+        }
+
+    @staticmethod
+    def from_dict(store, data):
+        category = None
+        if data['category'] is not None:
+            category = Category(**data['category'])
+
+        return CrawlUnit(store, data['lang'], data['brand'], category,
+                         data.get('max_categories'))
@@ -1,38 +1,258 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from .extractor import Extractor
+from .frontier import FRONTIERS
+from .store import DEDUPE_MODES
 from .utils import urljoin
 
 from urllib.parse import urlsplit, urlunsplit
+import itertools
 import re
-import time
+
+ENGINES = ('sync', 'async')
+EXTRACTION_MODES = ('text', 'chunked')
+LANG_SELECTOR_MODES = ('baseUrlSuffix', 'baseUrlTLD')
+BRAND_SELECTOR_MODES = ('categoryQueryParam',)
+PAGINATION_MODES = ('urlPathSuffix', 'queryParam')
 
 
 class Source:
+    # The configuration of a source is validated and every setting computed
+    # once, as most are read for every fetched page. A source is never
+    # modified afterwards: a new one replaces it when its configuration
+    # changes, while crawls in progress keep the one they started with.
     def __init__(self, name, config):
         self.name = name
         self.config = config
 
+        try:
+            self._compile()
+        except (AttributeError, TypeError, ValueError, re.error) as e:
+            raise ValueError('Invalid source {}: {}'.format(name, e))
+
+    def _compile(self):
+        config = self.config
+        if not isinstance(config, dict):
+            raise ValueError('configuration is not a mapping')
+        for key in ('langs', 'baseUrl', 'categories', 'products'):
+            if not config.get(key):
+                raise ValueError('{} is required'.format(key))
+
+        self._langs = list(config.get('langs'))
+        self._brands = list(config.get('brands', [None]))
+
+        http = config.get('http', {})
+        self._pool_size = int(http.get('poolSize', 10))
+        self._retries = int(http.get('retries', 1))
+        self._backoff_factor = float(http.get('backoffFactor', 0.3))
+        self._timeout = float(http.get('timeout', 5))
+        self._parallelism = int(config.get('parallelism', 1))
+
+        frontier = config.get('frontier', {})
+        self._frontier_order = _check_choice(
+            'frontier.order', frontier.get('order', 'dfs'), FRONTIERS
+        )
+        max_depth = frontier.get('maxDepth')
+        self._frontier_max_depth = int(max_depth) \
+            if max_depth is not None else None
+        self._frontier_max_size = int(frontier.get('maxSize', 100000))
+
+        dedupe = config.get('dedupe', {})
+        self._dedupe_mode = _check_choice(
+            'dedupe.mode', dedupe.get('mode', 'fingerprint'), DEDUPE_MODES
+        )
+        self._dedupe_capacity = int(dedupe.get('capacity', 1000000))
+        self._dedupe_error_rate = float(dedupe.get('errorRate', 0.001))
+
+        self._streaming = bool(config.get('streaming', False))
+        self._engine = _check_choice(
+            'engine', config.get('engine', 'sync'), ENGINES
+        )
+        concurrency = config.get('concurrency', {})
+        self._max_concurrency = int(concurrency.get('global', 8))
+        self._max_concurrency_per_host = int(concurrency.get('perHost', 4))
+
+        extraction = config.get('extraction', {})
+        self._extraction_mode = _check_choice(
+            'extraction.mode', extraction.get('mode', 'text'),
+            EXTRACTION_MODES
+        )
+        self._extraction_chunk_size = int(
+            extraction.get('chunkSize', 65536)
+        )
+        self._extraction_overlap = int(extraction.get('overlap', 2048))
+
+        self._compile_pagination()
+        self._rate_limit = self._compute_rate_limit()
+
+        # Compiled once, these are used for every fetched page
+        categories = config.get('categories')
+        products = config.get('products')
+        for key, regex in (('categories.urlRegex', categories.get('urlRegex')),
+                           ('products.urlRegex', products.get('urlRegex'))):
+            if not regex:
+                raise ValueError('{} is required'.format(key))
+            if 'id' not in re.compile(regex).groupindex:
+                raise ValueError('{} has no id group'.format(key))
+        self._extractor = Extractor(
+            categories.get('urlRegex'),
+            products.get('urlRegex'),
+            self._pagination.get('pageCountRegex'),
+            name=self.name
+        )
+        self._trailing_slash = bool(categories.get('trailing_slash'))
+
+        self._compile_urls()
+
+    def _compile_pagination(self):
+        pagination = self.config.get('categories').get('pagination', {})
+        self._pagination = pagination
+        self._pagination_concurrency = int(pagination.get('concurrency', 4))
+        # Pages after the first one of every category
+        self._pages = range(
+            int(pagination.get('start', 2)),
+            int(pagination.get('end', 1000)),
+            int(pagination.get('step', 1))
+        )
+        mode = _check_choice('categories.pagination.mode',
+                             pagination.get('mode'), PAGINATION_MODES)
+        # Format of the URL path suffix or query param of the page number
+        self._page_key = pagination.get(
+            'format' if mode == 'urlPathSuffix' else 'key'
+        )
+        if not self._page_key:
+            raise ValueError('categories.pagination.{} is required'.format(
+                'format' if mode == 'urlPathSuffix' else 'key'
+            ))
+        self._paginate = {
+            'urlPathSuffix': self._paginate_category_path_suffix,
+            'queryParam': self._paginate_category_query_param
+        }.get(mode)
+
+    def _compile_urls(self):
+        lang_selector = self.config.get('langSelector')
+        if lang_selector:
+            _check_choice('langSelector.mode', lang_selector.get('mode'),
+                          LANG_SELECTOR_MODES)
+            _check_mapping('langSelector', lang_selector, self._langs)
+
+        # Query params added to category URLs, by brand
+        self._brand_params = {}
+        brand_selector = self.config.get('brandSelector')
+        if brand_selector:
+            _check_choice('brandSelector.mode', brand_selector.get('mode'),
+                          BRAND_SELECTOR_MODES)
+            _check_mapping('brandSelector', brand_selector, self._brands)
+            self._brand_params = {
+                brand: dict(brand_selector.get('mapping').get(brand))
+                for brand in self._brands
+            }
+
+        self._base_urls = {}
+        self._url_prefixes = {}
+        self._fingerprints = {}
+        for lang, brand in itertools.product(self._langs, self._brands):
+            base_url = self._compute_base_url(lang, brand)
+            # Extracted URLs are joined to the base URL by appending them
+            url_prefix = base_url.strip('/') + '/'
+            self._base_urls[(lang, brand)] = base_url
+            self._url_prefixes[(lang, brand)] = url_prefix
+            self._fingerprints[(lang, brand)] = '{}:{}'.format(
+                self._extractor.fingerprint, url_prefix
+            )
+
     def get_langs(self):
-        return self.config.get('langs')
+        return self._langs
 
     def get_brands(self):
-        return self.config.get('brands', [None])
+        return self._brands
+
+    def get_pool_size(self):
+        return self._pool_size
+
+    def get_retries(self):
+        return self._retries
+
+    def get_backoff_factor(self):
+        return self._backoff_factor
+
+    def get_timeout(self):
+        return self._timeout
+
+    def get_parallelism(self):
+        return self._parallelism
 
-    def _get_url_regex(self, regex):
-        return re.compile('(?P<url>{})(?:\\?|/|#)'.format(regex))
+    def get_frontier_order(self):
+        return self._frontier_order
+
+    def get_frontier_max_depth(self):
+        return self._frontier_max_depth
+
+    def get_frontier_max_size(self):
+        return self._frontier_max_size
+
+    def get_dedupe_mode(self):
+        return self._dedupe_mode
+
+    def get_dedupe_capacity(self):
+        return self._dedupe_capacity
+
+    def get_dedupe_error_rate(self):
+        return self._dedupe_error_rate
+
+    def is_streaming(self):
+        return self._streaming
+
+    def get_engine(self):
+        return self._engine
+
+    def get_max_concurrency(self):
+        return self._max_concurrency
+
+    def get_max_concurrency_per_host(self):
+        return self._max_concurrency_per_host
 
     def get_categories_regex(self):
-        return self._get_url_regex(
-            self.config.get('categories').get('urlRegex')
-        )
+        return self._extractor.categories_regex
 
     def get_products_regex(self):
-        return self._get_url_regex(
-            self.config.get('products').get('urlRegex')
-        )
+        return self._extractor.products_regex
+
+    def get_extractor(self):
+        return self._extractor
+
+    def get_extraction_mode(self):
+        return self._extraction_mode
+
+    def get_extraction_chunk_size(self):
+        return self._extraction_chunk_size
+
+    def get_extraction_overlap(self):
+        # Longest URL match expected, in characters
+        return self._extraction_overlap
+
+    def get_extraction_fingerprint(self, lang, brand):
+        fingerprint = self._fingerprints.get((lang, brand))
+        if fingerprint is None:
+            fingerprint = '{}:{}'.format(
+                self._extractor.fingerprint, self.get_url_prefix(lang, brand)
+            )
+        return fingerprint
 
     def get_base_url(self, lang, brand):
+        base_url = self._base_urls.get((lang, brand))
+        if base_url is None:
+            base_url = self._compute_base_url(lang, brand)
+        return base_url
+
+    def get_url_prefix(self, lang, brand):
+        url_prefix = self._url_prefixes.get((lang, brand))
+        if url_prefix is None:
+            url_prefix = self.get_base_url(lang, brand).strip('/') + '/'
+        return url_prefix
+
+    def _compute_base_url(self, lang, brand):
         base_url = self.config.get('baseUrl')
         selector = self.config.get('langSelector')
         if selector:
@@ -63,44 +283,64 @@ class Source:
 
     def _get_category_url(self, category, lang, brand):
         url = category.url
-        params = {}
-
-        if self.config.get('categories').get('trailing_slash') and \
-           not url.endswith('/'):
+        if self._trailing_slash and not url.endswith('/'):
             url += '/'
 
-        selector = self.config.get('brandSelector')
-        if selector and selector.get('mode') == 'categoryQueryParam':
-            params.update(selector.get('mapping').get(brand))
+        return url, dict(self._brand_params.get(brand) or {})
+
+    def has_page_count(self):
+        return self._extractor.page_count_regex is not None
 
-        return url, params
+    def get_pagination_concurrency(self):
+        # Pages fetched at once once the page count of a category is known
+        return self._pagination_concurrency
 
     def paginate_category(self, category, lang, brand):
         url, params = self._get_category_url(category, lang, brand)
-        pagination = self.config.get('categories').get('pagination')
 
         yield url, params
-        yield from {
-                'urlPathSuffix': self._paginate_category_path_suffix,
-                'queryParam': self._paginate_category_query_param
-            }.get(pagination.get('mode'))(url, params, pagination)
-
-    def _paginate_category_path_suffix(self, url, params, pagination):
-        start = int(pagination.get('start', 2))
-        end = int(pagination.get('end', 1000))
-        step = int(pagination.get('step', 1))
-        for page in range(start, end, step):
-            page_url = urljoin(url, pagination.get('format').format(page))
+        yield from self._paginate(url, params)
+
+    def _paginate_category_path_suffix(self, url, params):
+        for page in self._pages:
+            page_url = urljoin(url, self._page_key.format(page))
             yield page_url, params
 
-    def _paginate_category_query_param(self, url, params, pagination):
-        start = int(pagination.get('start', 2))
-        end = int(pagination.get('end', 1000))
-        step = int(pagination.get('step', 1))
-        for page in range(start, end, step):
-            params[pagination.get('key')] = page
+    def _paginate_category_query_param(self, url, params):
+        for page in self._pages:
+            params[self._page_key] = page
             yield url, params
 
-    def apply_delay(self):
-        if 'delay' in self.config:
-            time.sleep(int(self.config.get('delay')))
+    def get_rate_limit(self):
+        # Requests per second and burst size allowed per host, if limited
+        return self._rate_limit
+
+    def _compute_rate_limit(self):
+        rate_limit = self.config.get('rateLimit')
+        if rate_limit:
+            return (float(rate_limit.get('rate')),
+                    int(rate_limit.get('burst', 1)))
+
+        # Legacy delay, in seconds between two requests
+        delay = float(self.config.get('delay', 0))
+        if delay > 0:
+            return 1. / delay, 1
+
+        return None
+
+
+def _check_choice(key, value, choices):
+    if value not in choices:
+        raise ValueError('{} must be one of {}, not {!r}'.format(
+            key, ', '.join(choices), value
+        ))
+    return value
+
+
+def _check_mapping(key, selector, values):
+    mapping = selector.get('mapping') or {}
+    missing = [value for value in values if value not in mapping]
+    if missing:
+        raise ValueError('{}.mapping misses {}'.format(
+            key, ', '.join(str(value) for value in missing)
+        ))
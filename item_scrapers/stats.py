@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+from contextlib import contextmanager
+import threading
+import time
+
+
+class PhaseTimings:
+    # Seconds spent in each phase of the crawl of a lang/brand and counts of
+    # what was done, recorded from any thread. A phase measured within
+    # another one in the same thread is not counted in the outer one.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._seconds = defaultdict(float)
+        self._counts = defaultdict(int)
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self._seconds[phase] += seconds
+
+    def count(self, name, count=1):
+        with self._lock:
+            self._counts[name] += count
+
+    @contextmanager
+    def measure(self, phase):
+        stack = self._local.__dict__.setdefault('stack', [])
+        nested = [0.]
+        stack.append(nested)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][0] += elapsed
+            self.add(phase, elapsed - nested[0])
+
+    def get_seconds(self):
+        with self._lock:
+            return {
+                phase: round(seconds, 3)
+                for phase, seconds in sorted(self._seconds.items())
+            }
+
+    def get_counts(self):
+        with self._lock:
+            return dict(sorted(self._counts.items()))
+
+
+class ScrapeStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.combinations = []
+
+    def add_combination(self, lang, brand, categories, products, elapsed,
+                        diff=None, timings=None):
+        combination = {
+            'lang': lang,
+            'brand': brand,
+            'categories': categories,
+            'products': products,
+            'elapsed': round(elapsed, 3)
+        }
+        if timings is not None:
+            combination.update({
+                'timings': timings.get_seconds(),
+                'counts': timings.get_counts()
+            })
+        if diff is not None:
+            combination.update({
+                'added': diff.added,
+                'changed': diff.changed,
+                'removed': diff.removed,
+                'unchanged': diff.unchanged
+            })
+
+        with self._lock:
+            self.combinations.append(combination)
+
+    def to_dict(self):
+        with self._lock:
+            combinations = list(self.combinations)
+
+        result = {
+            'categories': sum(c['categories'] for c in combinations),
+            'products': sum(c['products'] for c in combinations),
+            'combinations': combinations
+        }
+        if any('added' in c for c in combinations):
+            for key in ('added', 'changed', 'removed', 'unchanged'):
+                result[key] = sum(c.get(key, 0) for c in combinations)
+        # Summed over combinations, phases of concurrent ones overlap
+        for key in ('timings', 'counts'):
+            if any(key in c for c in combinations):
+                result[key] = _sum_dicts(c.get(key, {}) for c in combinations)
+
+        return result
+
+
+def _sum_dicts(dicts):
+    total = {}
+    for values in dicts:
+        for key, value in values.items():
+            total[key] = round(total.get(key, 0) + value, 3)
+    return dict(sorted(total.items()))
+
+
+def merge_stats(results):
+    # Sums the counts, including those of timings, and concatenates the lists
+    # of several results, such as those of the tasks of a distributed scrape
+    merged = {}
+    for result in results:
+        for key, value in (result or {}).items():
+            if isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+            elif isinstance(value, dict):
+                merged[key] = _sum_dicts([merged.get(key, {}), value])
+            elif isinstance(value, (int, float)) and \
+                    not isinstance(value, bool):
+                merged[key] = merged.get(key, 0) + value
+
+    return merged
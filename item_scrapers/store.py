@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from .index import fingerprint
+from .models import Product
+
+from array import array
+import math
+
+
+class FingerprintSet:
+    # Set of product IDs stored as 64-bit fingerprints in an open addressing
+    # table, about 16 bytes per ID instead of a hundred for a set of str.
+    # Two IDs sharing a fingerprint are considered equal.
+    _EMPTY = 0
+    _MAX_LOAD = 0.5
+
+    def __init__(self, capacity=1024):
+        self._table = array('Q', bytes(8 * self._get_size(capacity)))
+        self._mask = len(self._table) - 1
+        self._count = 0
+
+    @classmethod
+    def _get_size(cls, capacity):
+        return 1 << max(4, math.ceil(math.log2(capacity / cls._MAX_LOAD)))
+
+    @staticmethod
+    def _fingerprint(id):
+        # The empty slot marker is never a valid fingerprint
+        return fingerprint(id) or 1
+
+    def _find(self, fp):
+        # Slot of the fingerprint, or of the empty slot ending its probe
+        table = self._table
+        i = fp & self._mask
+        while table[i] != self._EMPTY and table[i] != fp:
+            i = (i + 1) & self._mask
+        return i
+
+    def __contains__(self, id):
+        fp = self._fingerprint(id)
+        return self._table[self._find(fp)] == fp
+
+    def add(self, id):
+        fp = self._fingerprint(id)
+        i = self._find(fp)
+        if self._table[i] == fp:
+            return
+
+        self._table[i] = fp
+        self._count += 1
+        if self._count > self._MAX_LOAD * len(self._table):
+            self._grow()
+
+    def update(self, ids):
+        for id in ids:
+            self.add(id)
+
+    def _grow(self):
+        old = self._table
+        self._table = array('Q', bytes(16 * len(old)))
+        self._mask = len(self._table) - 1
+        for fp in old:
+            if fp != self._EMPTY:
+                self._table[self._find(fp)] = fp
+
+    def __len__(self):
+        return self._count
+
+    def get_memory_size(self):
+        return self._table.itemsize * len(self._table)
+
+
+class BloomFilter:
+    # Fixed memory set of product IDs, sized for a capacity and a false
+    # positive rate. A false positive makes a new product look already seen,
+    # so it trades a few missed products for a bounded memory.
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._bits = max(64, int(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        ))
+        self._hashes = max(1, round(self._bits / capacity * math.log(2)))
+        self._array = bytearray((self._bits + 7) // 8)
+        self._count = 0
+
+    def _get_positions(self, id):
+        # Double hashing, both hashes are taken from the 64-bit fingerprint
+        fp = fingerprint(id)
+        h1 = fp & 0xffffffff
+        h2 = (fp >> 32) | 1
+        return ((h1 + i * h2) % self._bits for i in range(self._hashes))
+
+    def __contains__(self, id):
+        return all(
+            self._array[pos >> 3] & (1 << (pos & 7))
+            for pos in self._get_positions(id)
+        )
+
+    def add(self, id):
+        added = False
+        for pos in self._get_positions(id):
+            if not self._array[pos >> 3] & (1 << (pos & 7)):
+                self._array[pos >> 3] |= 1 << (pos & 7)
+                added = True
+        self._count += added
+
+    def update(self, ids):
+        for id in ids:
+            self.add(id)
+
+    def __len__(self):
+        # Approximate, products taken for false positives are not counted
+        return self._count
+
+    def get_memory_size(self):
+        return len(self._array)
+
+
+DEDUPE_MODES = ('exact', 'fingerprint', 'bloom')
+
+
+def create_product_set(mode, capacity=None, error_rate=None):
+    if mode == 'exact':
+        return set()
+    if mode == 'fingerprint':
+        return FingerprintSet()
+    if mode == 'bloom':
+        return BloomFilter(capacity, error_rate)
+
+    raise ValueError('Unknown dedupe mode: {}'.format(mode))
+
+
+class ProductStore:
+    # Products collected by a crawl, packed into arrays. URLs are split on
+    # their last slash and the prefixes, shared by most products of a
+    # source, are interned.
+    _SEPARATOR = '\x00'
+
+    def __init__(self):
+        self._prefixes = {}
+        self._prefix_list = []
+        self._prefix_ids = array('I')
+        self._offsets = array('Q', [0])
+        self._blob = bytearray()
+
+    def _intern(self, prefix):
+        prefix_id = self._prefixes.get(prefix)
+        if prefix_id is None:
+            prefix_id = self._prefixes[prefix] = len(self._prefix_list)
+            self._prefix_list.append(prefix)
+        return prefix_id
+
+    def add(self, product):
+        # Products with several URLs keep the extra ones in the record
+        url = product.urls[0]
+        prefix, _, suffix = url.rpartition('/')
+        self._prefix_ids.append(self._intern(prefix + '/' if prefix else ''))
+        self._blob += self._SEPARATOR.join([
+            str(product.id),
+            suffix,
+            product.slug or '',
+            '\n'.join(product.urls[1:])
+        ]).encode('utf-8')
+        self._offsets.append(len(self._blob))
+
+    def extend(self, products):
+        for product in products:
+            self.add(product)
+
+    def __len__(self):
+        return len(self._prefix_ids)
+
+    def __iter__(self):
+        for i, prefix_id in enumerate(self._prefix_ids):
+            id, suffix, slug, extra_urls = bytes(
+                self._blob[self._offsets[i]:self._offsets[i + 1]]
+            ).decode('utf-8').split(self._SEPARATOR)
+            urls = [self._prefix_list[prefix_id] + suffix]
+            if extra_urls:
+                urls.extend(extra_urls.split('\n'))
+            yield Product(id=id, urls=urls, slug=slug or None)
+
+    def get_memory_size(self):
+        return (
+            self._prefix_ids.itemsize * len(self._prefix_ids) +
+            self._offsets.itemsize * len(self._offsets) +
+            len(self._blob) +
+            sum(len(prefix) for prefix in self._prefix_list)
+        )
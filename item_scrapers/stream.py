@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import queue
+
+
+class StreamClosed(Exception):
+    pass
+
+
+class StreamEnd(Exception):
+    pass
+
+
+class ItemStream:
+    # Bounded handoff between crawling threads and the consumer of the
+    # items. Producers block while the stream is full, and abort with
+    # StreamClosed once the consumer is gone.
+    _POLL_INTERVAL = 0.1
+
+    def __init__(self, maxsize):
+        self._queue = queue.Queue(maxsize)
+        self._closed = threading.Event()
+
+    def put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=self._POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+        raise StreamClosed()
+
+    def produce(self, func, *args):
+        # Runs a producer, then marks its end along with its error if any
+        error = None
+        try:
+            func(*args)
+        except StreamClosed:
+            return
+        except Exception as e:
+            error = e
+
+        try:
+            self.put(_Done(error))
+        except StreamClosed:
+            pass
+
+    def iter(self, producers):
+        while producers:
+            item = self._queue.get()
+            if isinstance(item, _Done):
+                if item.error is not None:
+                    raise item.error
+                producers -= 1
+                continue
+
+            yield item
+
+    def get_nowait(self):
+        # Next item without blocking. Raises queue.Empty when none is ready,
+        # and StreamEnd or its error once a producer is done.
+        item = self._queue.get_nowait()
+        if isinstance(item, _Done):
+            if item.error is not None:
+                raise item.error
+            raise StreamEnd()
+
+        return item
+
+    def close(self):
+        self._closed.set()
+
+
+class _Done:
+    def __init__(self, error):
+        self.error = error
@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from item_scrapers import Source, Scraper, Publisher
+from item_scrapers import (
+    SourceRegistry, Scraper, Publisher, PublisherPool, ScrapeStats, Outbox
+)
+from item_scrapers.commits import PendingCommits
+from item_scrapers.shared import SharedStore, CrawlUnit
+from item_scrapers.stats import PhaseTimings, merge_stats
+from item_scrapers.profiler import StackSampler
+from item_scrapers import metrics
 
-from flask import Flask, abort, request
-from celery import Celery
+from flask import Flask, Response, abort, request
+from celery import Celery, chord
+from celery.signals import (
+    worker_init, worker_ready, worker_process_init, worker_process_shutdown,
+    worker_shutdown, task_postrun
+)
 from celery.result import AsyncResult
+from pika.exceptions import AMQPConnectionError
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import os
-import yaml
 import logging
+import time
 
 
 def create_flask_app():
@@ -27,10 +41,21 @@ def create_flask_app():
         os.environ.get('RABBITMQ_VHOST', '')
     )
 
+    # Distributed scrapes rely on chords, which need a result backend shared
+    # by all workers such as Redis. The rpc one cannot run them.
+    backend_url = rpc_url
+    if os.environ.get('REDIS_HOST'):
+        backend_url = 'redis://{}:{}/{}'.format(
+            os.environ.get('REDIS_HOST'),
+            os.environ.get('REDIS_PORT', 6379),
+            os.environ.get('REDIS_DB', 0)
+        )
+
     app = Flask(__name__)
     app.config.update(
         CELERY_BROKER_URL=amqp_url,
-        CELERY_RESULT_BACKEND=rpc_url
+        CELERY_RESULT_BACKEND=os.environ.get(
+            'CELERY_RESULT_BACKEND', backend_url)
     )
     return app
 
@@ -53,23 +78,34 @@ def create_celery_app(app):
 
 
 def load_sources():
-    sources = {}
-    for root, _, files in os.walk(os.environ.get('SOURCES_DIRECTORY')):
-        for file in files:
-            name, ext = tuple(os.path.splitext(file))
-            if ext.lower() in ('.yml', '.yaml'):
-                path = os.path.join(root, file)
-                config = yaml.safe_load(open(path).read())
-                sources[name] = Source(name, config)
-
-    return sources
+    # Changed sources are reloaded as they are looked up, at most every
+    # SOURCES_RELOAD_INTERVAL seconds
+    reload_interval = os.environ.get('SOURCES_RELOAD_INTERVAL', 30)
+    return SourceRegistry(
+        os.environ.get('SOURCES_DIRECTORY'),
+        cache_directory=os.environ.get('SOURCES_CACHE_DIRECTORY'),
+        reload_interval=float(reload_interval) if reload_interval else None)
 
 
 def create_scraper():
-    return Scraper()
+    return Scraper(
+        rate_limit_directory=os.environ.get('RATE_LIMIT_DIRECTORY'),
+        checkpoint_directory=os.environ.get('CHECKPOINT_DIRECTORY'),
+        checkpoint_interval=int(
+            os.environ.get('CHECKPOINT_INTERVAL', 30)),
+        http_cache_directory=os.environ.get('HTTP_CACHE_DIRECTORY'),
+        http_cache_max_size=int(
+            os.environ.get('HTTP_CACHE_MAX_SIZE', 1 << 30)),
+        index_directory=os.environ.get('INDEX_DIRECTORY'))
 
 
 def create_publisher():
+    max_unconfirmed = int(os.environ.get('PUBLISHER_MAX_UNCONFIRMED', 1000))
+    # Items written to an outbox are safe on disk, its segments are left to
+    # drain_task rather than retried forever while the broker is down
+    max_reconnect_attempts = get_int_env('PUBLISHER_MAX_RECONNECT_ATTEMPTS')
+    if max_reconnect_attempts is None and os.environ.get('OUTBOX_DIRECTORY'):
+        max_reconnect_attempts = 3
     return Publisher.create(
         os.environ.get('RABBITMQ_HOST'),
         os.environ.get('RABBITMQ_PORT', 5672),
@@ -81,7 +117,135 @@ def create_publisher():
         os.environ.get('RABBITMQ_APP_ID'),
         os.environ.get('PUBLISHER_EXCHANGE_NAME'),
         os.environ.get('PUBLISHER_ROUTING_KEY_PREFIX'),
-        os.environ.get('PUBLISHER_QUEUE_NAME_PREFIX'))
+        os.environ.get('PUBLISHER_QUEUE_NAME_PREFIX'),
+        max_unconfirmed=max_unconfirmed,
+        max_retries=int(os.environ.get('PUBLISHER_MAX_RETRIES', 3)),
+        batch_size=int(os.environ.get('PUBLISHER_BATCH_SIZE', 0)),
+        batch_max_bytes=int(
+            os.environ.get('PUBLISHER_BATCH_MAX_BYTES', 65536)),
+        batch_max_delay=float(
+            os.environ.get('PUBLISHER_BATCH_MAX_DELAY', 1.0)),
+        compression=os.environ.get('PUBLISHER_COMPRESSION') or None,
+        low_watermark=int(os.environ.get(
+            'PUBLISHER_LOW_WATERMARK', max_unconfirmed // 2)),
+        max_reconnect_attempts=max_reconnect_attempts)
+
+
+def get_int_env(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def create_outbox(source):
+    if not os.environ.get('OUTBOX_DIRECTORY'):
+        return None
+
+    return Outbox.create(
+        os.environ.get('OUTBOX_DIRECTORY'),
+        source,
+        segment_size=int(os.environ.get('OUTBOX_SEGMENT_SIZE', 16 << 20)),
+        sync_interval=float(os.environ.get('OUTBOX_SYNC_INTERVAL', 1.0)),
+        segment_max_age=float(os.environ.get('OUTBOX_SEGMENT_MAX_AGE', 5.0)))
+
+
+def drain_outbox(outbox, source, written=None):
+    # Segments left unpublished are drained by the next task of the source.
+    # Given the event set once items are written, segments are drained as
+    # they are sealed until then.
+    try:
+        if written is None:
+            return outbox.drain(publishers.get(), source)
+        return outbox.drain_until(
+            publishers.get(), source, written,
+            float(os.environ.get('OUTBOX_DRAIN_INTERVAL', 1.0)))
+    except AMQPConnectionError as e:
+        logging.error('Outbox of %s not drained: %s', source.name, e)
+        return {'pending_segments': outbox.get_pending()}
+
+
+def write_outbox(outbox, items, written, timings):
+    try:
+        with timings.measure('scrape_write'):
+            return outbox.write(items)
+    finally:
+        written.set()
+
+
+def publish_items(source, items, timings=None, pending=None):
+    # Items are scraped as they are written or published. Pending commits
+    # of the scrape are committed once its items are delivered, safe on
+    # disk or all confirmed, and discarded otherwise.
+    if timings is None:
+        timings = PhaseTimings()
+    if pending is None:
+        pending = PendingCommits()
+    try:
+        outbox = create_outbox(source)
+        if outbox is not None:
+            # Items are safe on disk before being published. They are
+            # written from another thread while this one, which owns a
+            # publisher, drains sealed segments meanwhile.
+            written = threading.Event()
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(
+                    write_outbox, outbox, items, written, timings)
+                with timings.measure('drain'):
+                    stats = drain_outbox(outbox, source, written)
+                future.result()
+            pending.commit()
+            return stats
+
+        with timings.measure('scrape_publish'):
+            stats = publishers.publish(source, items)
+        if not stats['failed']:
+            pending.commit()
+        return stats
+    finally:
+        pending.discard()
+
+
+def start_profiler(profile):
+    if not profile:
+        return None
+
+    sampler = StackSampler(float(os.environ.get('PROFILE_INTERVAL', 0.01)))
+    sampler.start()
+    return sampler
+
+
+def save_profile(sampler, task_id):
+    # Folded stacks, to be rendered as a flame graph
+    path = os.path.join(
+        os.environ.get('PROFILE_DIRECTORY', 'profiles'),
+        '{}.folded'.format(task_id)
+    )
+    sampler.save(path)
+    return {'path': path, 'samples': sampler.samples}
+
+
+def get_metrics_interval():
+    return float(os.environ.get('METRICS_INTERVAL', 15))
+
+
+def collect_metrics():
+    # Snapshots of worker processes are merged when written to a directory
+    # shared with this one, those not refreshed for a while are stale
+    return metrics.collect(
+        os.environ.get('METRICS_DIRECTORY'),
+        max_age=3 * get_metrics_interval())
+
+
+def supports_chords():
+    try:
+        celery.backend.ensure_chords_allowed()
+    except NotImplementedError:
+        return False
+    return True
+
+
+def create_shared_store(source, run_id):
+    return SharedStore.create(
+        os.environ.get('SHARED_STORE_DIRECTORY'), source, run_id)
 
 
 ###############################################################################
@@ -93,21 +257,182 @@ if os.environ.get('debug', False):
 
 sources = load_sources()
 scraper = create_scraper()
-publisher = create_publisher()
+publishers = PublisherPool(create_publisher)
+metrics_writer = None
 
 app = application = create_flask_app()
 celery = create_celery_app(app)
 
 
+@celery.task(bind=True)
+def scrape_task(self, source_name, max_categories, max_products_per_category,
+                resume=False, incremental=False, tombstones=False,
+                profile=False):
+    source = sources.get(source_name)
+    stats = ScrapeStats()
+    timings = PhaseTimings()
+    sampler = start_profiler(profile)
+    pending = PendingCommits()
+    try:
+        with timings.measure('total'):
+            items = scraper.scrape(
+                source,
+                max_categories=max_categories,
+                max_products_per_category=max_products_per_category,
+                stats=stats,
+                resume=resume,
+                incremental=incremental,
+                tombstones=tombstones,
+                pending=pending
+            )
+            publisher_stats = publish_items(source, items, timings, pending)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+
+    result = {
+        'scrape': stats.to_dict(),
+        'publisher': publisher_stats,
+        'extraction': source.get_extractor().get_stats(),
+        'http_cache': scraper.get_http_cache_stats(source),
+        # Phases of the crawls of every lang/brand are in those of scrape
+        'timings': timings.get_seconds()
+    }
+    if sampler is not None:
+        result['profile'] = save_profile(sampler, self.request.id)
+
+    return result
+
+
+@celery.task(bind=True)
+def distributed_scrape_task(self, source_name, max_categories,
+                            max_products_per_category):
+    # The crawl is split into units scraped by as many tasks, this task is
+    # replaced by the chord aggregating their results. Units share a SQLite
+    # store, so every worker must run on the same host.
+    if not supports_chords():
+        raise ValueError('Distributed scrapes require a result backend \
+supporting chords, such as Redis')
+
+    source = sources.get(source_name)
+    run_id = self.request.id
+    store = create_shared_store(source, run_id)
+    try:
+        units = scraper.plan(source, store, max_categories,
+                             max_products_per_category)
+    except BaseException:
+        store.remove()
+        raise
+    store.close()
+
+    # The aggregate never runs when a unit fails, the store is removed then
+    aggregate = aggregate_task.s(source_name, run_id, time.time())
+    aggregate.link_error(remove_shared_store_task.si(source_name, run_id))
+    raise self.replace(chord(
+        [
+            unit_task.s(source_name, run_id, unit.to_dict(), max_categories,
+                        max_products_per_category)
+            for unit in units
+        ],
+        aggregate
+    ))
+
+
 @celery.task()
-def scrape_task(source_name, max_categories, max_products_per_category):
+def unit_task(source_name, run_id, unit, max_categories,
+              max_products_per_category):
     source = sources.get(source_name)
-    items = scraper.scrape(
-        source,
-        max_categories=max_categories,
-        max_products_per_category=max_products_per_category
-    )
-    publisher.publish(source, items)
+    store = create_shared_store(source, run_id)
+    stats = ScrapeStats()
+    try:
+        items = scraper.scrape(
+            source,
+            max_categories=max_categories,
+            max_products_per_category=max_products_per_category,
+            stats=stats,
+            unit=CrawlUnit.from_dict(store, unit)
+        )
+        publisher_stats = publish_items(source, items)
+    finally:
+        store.close()
+
+    return {
+        'scrape': stats.to_dict(),
+        'publisher': publisher_stats
+    }
+
+
+@celery.task()
+def aggregate_task(results, source_name, run_id, started):
+    create_shared_store(sources.get(source_name), run_id).remove()
+
+    return {
+        'units': len(results),
+        'elapsed': round(time.time() - started, 3),
+        'scrape': merge_stats(result['scrape'] for result in results),
+        'publisher': merge_stats(result['publisher'] for result in results)
+    }
+
+
+@celery.task()
+def remove_shared_store_task(source_name, run_id):
+    create_shared_store(sources.get(source_name), run_id).remove()
+
+
+@celery.task()
+def drain_task(source_name):
+    source = sources.get(source_name)
+    outbox = create_outbox(source)
+    if outbox is None:
+        raise ValueError('Draining requires an outbox directory')
+
+    return {'publisher': drain_outbox(outbox, source)}
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_publishers(**kwargs):
+    publishers.close()
+
+
+@worker_init.connect
+def clear_metrics(**kwargs):
+    if os.environ.get('METRICS_DIRECTORY'):
+        metrics.clear_snapshots(os.environ.get('METRICS_DIRECTORY'))
+
+
+@worker_ready.connect
+def start_metrics_exporter(**kwargs):
+    # Serves the metrics of the worker processes, written by each of them
+    if os.environ.get('METRICS_PORT'):
+        metrics.Exporter(
+            int(os.environ.get('METRICS_PORT')), collect_metrics
+        ).start()
+
+
+@worker_process_init.connect
+def start_metrics_writer(**kwargs):
+    global metrics_writer
+    if os.environ.get('METRICS_DIRECTORY'):
+        metrics_writer = metrics.SnapshotWriter(
+            os.environ.get('METRICS_DIRECTORY'), get_metrics_interval())
+        metrics_writer.start()
+
+
+@task_postrun.connect
+def write_metrics(**kwargs):
+    if metrics_writer is not None:
+        metrics_writer.write()
+
+
+@worker_process_shutdown.connect
+def stop_metrics_writer(**kwargs):
+    if metrics_writer is not None:
+        metrics_writer.stop()
+
+
+def get_bool_arg(name):
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
 
 
 @app.route('/sources/<source>/scrape', methods=['POST'])
@@ -134,11 +459,30 @@ def scrape(source):
                 'max_products_per_category parameter must be an integer'
             )
 
-    result = scrape_task.delay(
-        source,
-        max_categories,
-        max_products_per_category
-    )
+    if get_bool_arg('distributed'):
+        # Units are aggregated by a chord and share a SQLite store: this
+        # needs a result backend such as Redis, and workers on one host
+        if get_bool_arg('resume') or get_bool_arg('incremental'):
+            abort(400, 'Distributed scrapes cannot be resumed or incremental')
+        if not supports_chords():
+            abort(400, 'Distributed scrapes require a result backend \
+supporting chords, such as Redis')
+
+        result = distributed_scrape_task.delay(
+            source,
+            max_categories,
+            max_products_per_category
+        )
+    else:
+        result = scrape_task.delay(
+            source,
+            max_categories,
+            max_products_per_category,
+            get_bool_arg('resume'),
+            get_bool_arg('incremental'),
+            get_bool_arg('tombstones'),
+            get_bool_arg('profile')
+        )
 
     return {
         'task': {
@@ -149,6 +493,27 @@ def scrape(source):
     }
 
 
+@app.route('/sources/<source>/drain', methods=['POST'])
+def drain(source):
+    if source not in sources:
+        abort(400, 'Unknown source')
+
+    result = drain_task.delay(source)
+
+    return {
+        'task': {
+            'id': result.id,
+            'state': result.state,
+            'source': source
+        }
+    }
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(collect_metrics(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/tasks/<task_id>', methods=['GET'])
 def get_task(task_id):
     result = AsyncResult(task_id, app=celery)
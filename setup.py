@@ -26,6 +26,9 @@ setup(
         "requests>=2.21.0",
         "pika>=1.1.0"
     ],
+    extras_require={
+        'lz4': ['lz4>=3.0.2']
+    },
     tests_require=[
         'pytest>=5.4.1',
         'mock>=4.0.2',
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from item_scrapers import Source
+
+
+PAGES = {
+    'https://www.example.com/': '<a href="/cat/1/"></a><a href="/cat/2/"></a>',
+    'https://www.example.com/cat/1/': '<a href="/cat/3/"></a>\
+<a href="/p/chair-1/"></a><a href="/p/table-2/"></a>',
+    'https://www.example.com/cat/2/': '<a href="/p/table-2/"></a>\
+<a href="/p/lamp-3/"></a>',
+    'https://www.example.com/cat/3/': '<a href="/cat/1/"></a>\
+<a href="/p/sofa-4/"></a>'
+}
+
+PRODUCT_URLS = [
+    'https://www.example.com/p/chair-1',
+    'https://www.example.com/p/lamp-3',
+    'https://www.example.com/p/sofa-4',
+    'https://www.example.com/p/table-2'
+]
+
+
+def make_source(**config):
+    source_config = {
+        'langs': ['en'],
+        'baseUrl': 'https://www.example.com',
+        'categories': {
+            'urlRegex': '/cat/(?P<id>[0-9]+)',
+            'trailing_slash': True,
+            'pagination': {'mode': 'queryParam', 'key': 'page', 'end': 3}
+        },
+        'products': {
+            'urlRegex': '/p/(?P<slug>[a-z]+)-(?P<id>[0-9]+)'
+        }
+    }
+    source_config.update(config)
+    return Source('example', source_config)
+
+
+def mock_pages(m):
+    for url, html in PAGES.items():
+        m.get(url, text=html)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import requests_mock
+from pytest import fixture
+from item_scrapers import Scraper
+from .catalog import PRODUCT_URLS, make_source, mock_pages
+
+
+@fixture
+def scraper():
+    return Scraper()
+
+
+def get_urls(scraper, source):
+    return sorted(
+        url for item in scraper.scrape(source) for url in item.urls
+    )
+
+
+def test_async_engine_same_items(scraper):
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        sync_urls = get_urls(scraper, make_source(engine='sync'))
+        async_urls = get_urls(scraper, make_source(engine='async'))
+
+    assert sync_urls == async_urls == PRODUCT_URLS
+
+
+def test_async_engine_max_categories(scraper):
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        categories, _ = scraper._get_all(
+            make_source(engine='async'), 'en', None, 1, None
+        )
+
+    assert len(categories) == 1
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import requests_mock
+import time
+from pytest import fixture, mark, raises
+from item_scrapers import Scraper
+from item_scrapers.checkpoint import CheckpointStore
+from item_scrapers.commits import PendingCommits
+from .catalog import PAGES, PRODUCT_URLS, make_source, mock_pages
+
+
+@fixture
+def scraper(tmp_path):
+    return Scraper(checkpoint_directory=str(tmp_path), checkpoint_interval=0)
+
+
+def fail(request, context):
+    raise RuntimeError('worker lost')
+
+
+def get_urls(items):
+    return sorted(url for item in items for url in item.urls)
+
+
+@mark.parametrize('engine', ['sync', 'async'])
+def test_resume_after_failure(scraper, engine):
+    source = make_source(engine=engine, frontier={'order': 'bfs'})
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        m.get('https://www.example.com/cat/3/', text=fail)
+        with raises(RuntimeError):
+            list(scraper.scrape(source))
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        items = list(scraper.scrape(source, resume=True))
+        fetched = {request.url.split('?')[0] for request in m.request_history}
+
+    assert get_urls(items) == PRODUCT_URLS
+    assert 'https://www.example.com/cat/3/' in fetched
+    if engine == 'sync':
+        assert fetched == {'https://www.example.com/cat/3/'}
+    else:
+        # Categories still in flight when the crawl failed are saved back
+        # to the frontier and fetched again
+        assert fetched <= {'https://www.example.com/cat/2/',
+                           'https://www.example.com/cat/3/'}
+
+
+def test_no_resume_starts_over(scraper):
+    source = make_source()
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        m.get('https://www.example.com/cat/3/', text=fail)
+        with raises(RuntimeError):
+            list(scraper.scrape(source))
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        items = list(scraper.scrape(source))
+        fetched = {request.url.split('?')[0] for request in m.request_history}
+
+    assert get_urls(items) == PRODUCT_URLS
+    assert fetched == set(PAGES)
+
+
+def slow_fail(request, context):
+    time.sleep(0.2)
+    raise RuntimeError('worker lost')
+
+
+def test_resume_unfinished_category(scraper):
+    # Products of a category still in flight are not saved, its next pages
+    # are fetched again on resume
+    source = make_source(engine='async', frontier={'order': 'bfs'})
+    next_page = 'https://www.example.com/cat/2/?page=2'
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        m.get(next_page, text=slow_fail)
+        with raises(RuntimeError):
+            list(scraper.scrape(source))
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        m.get(next_page, text='<a href="/p/desk-5/"></a>')
+        items = list(scraper.scrape(source, resume=True))
+
+    assert get_urls(items) == sorted(
+        PRODUCT_URLS + ['https://www.example.com/p/desk-5']
+    )
+
+
+@mark.parametrize('streaming', [False, True])
+def test_resume_emits_undelivered(scraper, streaming):
+    # A crawl whose items were not delivered emits them again on resume,
+    # without fetching anything
+    source = make_source(streaming=streaming)
+
+    pending = PendingCommits()
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        assert get_urls(scraper.scrape(source, pending=pending)) == \
+            PRODUCT_URLS
+    pending.discard()
+
+    with requests_mock.mock() as m:
+        pending = PendingCommits()
+        items = list(scraper.scrape(source, resume=True, pending=pending))
+        assert m.request_history == []
+    pending.commit()
+    assert get_urls(items) == PRODUCT_URLS
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        list(scraper.scrape(source, resume=True))
+        fetched = {request.url.split('?')[0] for request in m.request_history}
+    # Delivered, the checkpoint was removed
+    assert fetched == set(PAGES)
+
+
+def test_checkpoint_held(tmp_path):
+    source = make_source()
+    store = CheckpointStore.create(str(tmp_path), source)
+    assert CheckpointStore.create(str(tmp_path), source) is None
+
+    store.close()
+    store = CheckpointStore.create(str(tmp_path), source)
+    assert store is not None
+    store.close()
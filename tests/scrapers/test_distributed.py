@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import requests_mock
+from concurrent.futures import ThreadPoolExecutor
+from pytest import mark
+from item_scrapers import Scraper, ScrapeStats
+from item_scrapers.models import Product
+from item_scrapers.shared import SharedStore, CrawlUnit
+from item_scrapers.stats import merge_stats
+from .catalog import PRODUCT_URLS, make_source, mock_pages
+
+
+def scrape_unit(path, source, data, **kwargs):
+    # Each unit runs as a separate task, with its own store connection
+    store = SharedStore(path)
+    stats = ScrapeStats()
+    try:
+        unit = CrawlUnit.from_dict(store, data)
+        items = list(Scraper().scrape(
+            source, stats=stats, unit=unit, **kwargs
+        ))
+    finally:
+        store.close()
+    return items, stats.to_dict()
+
+
+def get_fetched(m, url):
+    return [r for r in m.request_history if r.url.split('?')[0] == url]
+
+
+@mark.parametrize('config', [
+    {},
+    {'engine': 'async'},
+    {'streaming': True}
+])
+def test_distributed_crawl(tmp_path, config):
+    source = make_source(**config)
+    path = str(tmp_path / 'shared.sqlite')
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        store = SharedStore(path)
+        units = [unit.to_dict() for unit in Scraper().plan(source, store)]
+        store.close()
+
+        assert [unit['category'] and unit['category']['url']
+                for unit in units] == [
+            None,
+            'https://www.example.com/cat/1',
+            'https://www.example.com/cat/2'
+        ]
+
+        with ThreadPoolExecutor(max_workers=len(units)) as executor:
+            results = list(executor.map(
+                lambda unit: scrape_unit(path, source, unit), units
+            ))
+
+        # Pages of the base category are only fetched while planning
+        assert len(get_fetched(m, 'https://www.example.com/')) == 2
+
+    urls = [url for items, _ in results for item in items for url in item.urls]
+    assert sorted(urls) == PRODUCT_URLS
+    assert sum(stats['products'] for _, stats in results) == len(urls)
+    assert sum(stats['categories'] for _, stats in results) == 3
+
+
+def test_distributed_max_categories(tmp_path):
+    # The limit applies to all units together, as to a single crawl
+    source = make_source(frontier={'order': 'bfs'})
+    path = str(tmp_path / 'shared.sqlite')
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        store = SharedStore(path)
+        units = [unit.to_dict() for unit in Scraper().plan(
+            source, store, max_categories=1
+        )]
+        store.close()
+        results = [
+            scrape_unit(path, source, unit, max_categories=1)
+            for unit in units
+        ]
+
+    assert [unit['category'] and unit['category']['url']
+            for unit in units] == [None, 'https://www.example.com/cat/1']
+    assert sum(stats['categories'] for _, stats in results) == 1
+
+
+def test_claims(tmp_path):
+    first = SharedStore(str(tmp_path / 'shared.sqlite'))
+    second = SharedStore(first.path)
+
+    assert first.claim('product', 'en', None, ['1', '2']) == ['1', '2']
+    assert second.claim('product', 'en', None, ['2', '3']) == ['3']
+    assert second.claim('product', 'fr', None, ['2']) == ['2']
+    assert first.claim_category('en', None, 3)
+    assert not second.claim_category('en', None, '3')
+    assert first.claim('category', 'en', None, [4, 5, 6], limit=3) == [4, 5]
+    assert not second.claim_category('en', None, 7, limit=3)
+
+    products = [Product(id='1', urls=['https://www.example.com/p/1'])]
+    first.save_base_products('en', None, products)
+    assert second.load_base_products('en', None) == products
+    assert second.load_base_products('fr', None) == []
+
+    second.close()
+    first.remove()
+    assert not tmp_path.joinpath('shared.sqlite').exists()
+
+
+def test_merge_stats():
+    assert merge_stats([
+        {'products': 2, 'elapsed': 1.5, 'combinations': [{'lang': 'en'}],
+         'timings': {'fetch': 1.}},
+        None,
+        {'products': 3, 'elapsed': 0.5, 'combinations': [{'lang': 'fr'}],
+         'timings': {'fetch': 0.5, 'extract': 0.25}}
+    ]) == {
+        'products': 5,
+        'elapsed': 2.0,
+        'combinations': [{'lang': 'en'}, {'lang': 'fr'}],
+        'timings': {'extract': 0.25, 'fetch': 1.5}
+    }
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+import requests_mock
+from item_scrapers import Scraper, ScrapeStats
+from .catalog import PRODUCT_URLS, make_source, mock_pages
+
+
+def test_scrape_combinations_in_parallel():
+    source = make_source(
+        langs=['en', 'fr'],
+        brands=['brand-a', 'brand-b'],
+        parallelism=3
+    )
+    stats = ScrapeStats()
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        items = list(Scraper().scrape(source, stats=stats))
+
+    assert len(items) == 4 * len(PRODUCT_URLS)
+    assert {(item.brand, tuple(item.urls)) for item in items} == {
+        (brand, (url,))
+        for brand in ('brand-a', 'brand-b') for url in PRODUCT_URLS
+    }
+
+    result = stats.to_dict()
+    assert result['products'] == len(items)
+    assert len(result['combinations']) == 4
+    assert all(c['categories'] == 3 for c in result['combinations'])
+
+
+def test_scrape_streaming():
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        items = list(Scraper().scrape(make_source(streaming=True)))
+
+    assert sorted(url for item in items for url in item.urls) == PRODUCT_URLS
+
+
+@pytest.mark.parametrize('engine', ['sync', 'async'])
+def test_scrape_timings(engine):
+    stats = ScrapeStats()
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        items = list(Scraper().scrape(
+            make_source(engine=engine, streaming=True), stats=stats
+        ))
+
+    result = stats.to_dict()
+    combination, = result['combinations']
+    assert {'fetch', 'extract', 'dedupe', 'emit'} <= set(
+        combination['timings']
+    )
+    assert combination['counts']['pages'] == m.call_count
+    assert combination['counts']['bytes'] > 0
+    assert result['counts'] == combination['counts']
+    assert len(items) == len(PRODUCT_URLS)
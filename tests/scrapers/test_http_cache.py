@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import requests_mock
+import os
+from pytest import fixture, mark
+from item_scrapers import Scraper
+from item_scrapers.http_cache import HttpCache, CacheEntry
+from item_scrapers.models import Category
+from .catalog import PAGES, PRODUCT_URLS, make_source
+
+
+@fixture
+def scraper(tmp_path):
+    return Scraper(http_cache_directory=str(tmp_path))
+
+
+def mock_conditional_pages(m):
+    def respond(html):
+        def callback(request, context):
+            etag = '"{}"'.format(hash(html))
+            context.headers['ETag'] = etag
+            if request.headers.get('If-None-Match') == etag:
+                context.status_code = 304
+                return ''
+            return html
+        return callback
+
+    for url, html in PAGES.items():
+        m.get(url, text=respond(html))
+
+
+def get_urls(items):
+    return sorted(url for item in items for url in item.urls)
+
+
+@mark.parametrize('mode', ['text', 'chunked'])
+def test_revalidate_pages(scraper, mode):
+    source = make_source(extraction={'mode': mode})
+
+    with requests_mock.mock() as m:
+        mock_conditional_pages(m)
+        first = get_urls(scraper.scrape(source))
+        second = get_urls(scraper.scrape(source))
+
+    assert first == second == PRODUCT_URLS
+
+    stats = scraper.get_http_cache_stats(source)
+    assert stats['hits'] == stats['misses'] > 0
+    assert stats['bytes_saved'] > 0
+
+
+def test_evict_least_recently_used(tmp_path):
+    def entry(key):
+        return CacheEntry(
+            key * 40, '"etag"', None, 'fp',
+            ({Category(id=key, url='/' + key)}, set()), 'x' * 100, 100
+        )
+
+    cache = HttpCache(str(tmp_path), max_size=1 << 20)
+    cache.put(entry('a'))
+    size = os.path.getsize(cache._get_path('a' * 40))
+
+    # Room for two entries only
+    cache.max_size = 2 * size + size // 2
+    for key in ('b', 'c'):
+        cache.get('a' * 40)
+        cache.put(entry(key))
+
+    assert cache.get('a' * 40) is not None
+    assert cache.get('b' * 40) is None
+
+
+def test_running_total(tmp_path):
+    def entry(key, body):
+        return CacheEntry(key * 40, '"etag"', None, 'fp', (set(), set()),
+                          body, len(body))
+
+    cache = HttpCache(str(tmp_path), max_size=1 << 20)
+    cache.put(entry('a', 'x' * 100))
+    cache.put(entry('b', 'y' * 100))
+    cache.put(entry('a', 'z' * 1000))
+    size = sum(
+        os.path.getsize(cache._get_path(key * 40)) for key in ('a', 'b')
+    )
+    assert cache.get_size() == size
+
+    # Loaded once when opened
+    assert HttpCache(str(tmp_path), max_size=1 << 20).get_size() == size
+
+    # A single row whichever cache opened the directory first
+    reopened = HttpCache(str(tmp_path), max_size=1 << 20)
+    reopened.put(entry('c', 'w' * 100))
+    assert reopened._db.execute('SELECT COUNT(*) FROM totals').fetchone() \
+        == (1,)
+    assert cache.get_size() == reopened.get_size()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import requests_mock
+import os
+from pytest import fixture, mark, raises
+from item_scrapers import Scraper, ScrapeStats, Tombstone
+from item_scrapers.commits import PendingCommits
+from .catalog import PAGES, PRODUCT_URLS, make_source, mock_pages
+
+
+@fixture
+def scraper(tmp_path):
+    return Scraper(index_directory=str(tmp_path))
+
+
+def scrape(scraper, source, pages, **kwargs):
+    stats = ScrapeStats()
+    with requests_mock.mock() as m:
+        for url, html in pages.items():
+            m.get(url, text=html)
+        items = list(scraper.scrape(
+            source, stats=stats, incremental=True, **kwargs
+        ))
+    return items, stats.to_dict()
+
+
+def test_incremental(scraper):
+    source = make_source(streaming=True)
+
+    items, stats = scrape(scraper, source, PAGES)
+    assert sorted(url for i in items for url in i.urls) == PRODUCT_URLS
+    assert stats['added'] == 4
+
+    items, stats = scrape(scraper, source, PAGES)
+    assert items == []
+    assert (stats['added'], stats['removed'], stats['unchanged']) == \
+        (0, 0, 4)
+
+    pages = dict(PAGES, **{
+        'https://www.example.com/cat/2/': '<a href="/p/table-2/"></a>\
+<a href="/p/stool-5/"></a>'
+    })
+    items, stats = scrape(scraper, source, pages, tombstones=True)
+    assert [i.urls for i in items if not isinstance(i, Tombstone)] == \
+        [['https://www.example.com/p/stool-5']]
+    assert [i.item.urls for i in items if isinstance(i, Tombstone)] == \
+        [['https://www.example.com/p/lamp-3']]
+    assert (stats['added'], stats['removed'], stats['unchanged']) == \
+        (1, 1, 3)
+
+
+def test_incremental_requires_index_directory():
+    with raises(ValueError):
+        with requests_mock.mock() as m:
+            mock_pages(m)
+            list(Scraper().scrape(make_source(), incremental=True))
+
+
+def test_index_replaced_once_delivered(scraper, tmp_path):
+    source = make_source()
+
+    pending = PendingCommits()
+    items, stats = scrape(scraper, source, PAGES, pending=pending)
+    assert len(items) == 4
+    pending.discard()
+    assert os.listdir(str(tmp_path / source.name)) == []
+
+    pending = PendingCommits()
+    items, stats = scrape(scraper, source, PAGES, pending=pending)
+    assert len(items) == 4
+    pending.commit()
+
+    items, stats = scrape(scraper, source, PAGES)
+    assert items == []
+
+
+@mark.parametrize('config, failed', [
+    ({}, 'https://www.example.com/cat/1/'),
+    ({'frontier': {'maxDepth': 1}}, None),
+    ({'dedupe': {'mode': 'bloom'}}, None)
+])
+def test_partial_crawl_keeps_index(scraper, config, failed):
+    # Products missed by a partial crawl are not removed
+    items, stats = scrape(scraper, make_source(), PAGES)
+    assert len(items) == 4
+
+    source = make_source(**config)
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        if failed:
+            m.get(failed, status_code=503)
+        items = list(scraper.scrape(
+            source, incremental=True, tombstones=True
+        ))
+    assert items == []
+
+    items, stats = scrape(scraper, make_source(), PAGES)
+    assert items == []
+    assert stats['removed'] == 0
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import requests_mock
+from pytest import fixture, mark
+from item_scrapers import Scraper
+from item_scrapers.models import CategoryState, Category, Product
+from .catalog import make_source
+
+PAGE_COUNT = 4
+
+
+@fixture
+def scraper():
+    return Scraper()
+
+
+def make_paginated_source(**config):
+    return make_source(categories={
+        'urlRegex': '/cat/(?P<id>[0-9]+)',
+        'trailing_slash': True,
+        'pagination': dict({
+            'mode': 'queryParam', 'key': 'page', 'end': 1000
+        }, **config.pop('pagination', {}))
+    }, **config)
+
+
+def mock_paginated_pages(m, overflow='empty'):
+    # Base category with PAGE_COUNT pages of two products each, what comes
+    # after the last one depends on overflow
+    def callback(request, context):
+        page = int(request.qs.get('page', ['1'])[0])
+        if page > PAGE_COUNT:
+            if overflow == 'empty':
+                return '<html></html>'
+            page = PAGE_COUNT
+
+        html = '<span class="pages">{}</span>'.format(PAGE_COUNT)
+        return html + ''.join(
+            '<a href="/p/chair-{}/"></a>'.format(page * 10 + i)
+            for i in range(2)
+        )
+
+    m.get('https://www.example.com/', text=callback)
+
+
+def get_urls(scraper, source):
+    return sorted(
+        url for item in scraper.scrape(source) for url in item.urls
+    )
+
+
+@mark.parametrize('engine', ['sync', 'async'])
+@mark.parametrize('mode', ['text', 'chunked'])
+def test_page_count_fetches_known_pages(scraper, engine, mode):
+    source = make_paginated_source(
+        engine=engine,
+        extraction={'mode': mode, 'chunkSize': 8, 'overlap': 64},
+        pagination={'pageCountRegex': 'class="pages">([0-9]+)<'}
+    )
+    with requests_mock.mock() as m:
+        mock_paginated_pages(m)
+        urls = get_urls(scraper, source)
+        assert m.call_count == PAGE_COUNT
+
+    assert len(urls) == PAGE_COUNT * 2
+
+
+@mark.parametrize('engine', ['sync', 'async'])
+@mark.parametrize('overflow', ['empty', 'repeated'])
+def test_probe_stops_after_last_page(scraper, engine, overflow):
+    source = make_paginated_source(engine=engine)
+    with requests_mock.mock() as m:
+        mock_paginated_pages(m, overflow)
+        urls = get_urls(scraper, source)
+        assert m.call_count == PAGE_COUNT + 1
+
+    assert len(urls) == PAGE_COUNT * 2
+
+
+def test_page_count_keeps_pages_without_new_products(scraper):
+    # Pages only bringing products seen elsewhere do not end the category
+    source = make_paginated_source(
+        pagination={'pageCountRegex': 'class="pages">([0-9]+)<'}
+    )
+    with requests_mock.mock() as m:
+        m.get('https://www.example.com/', text=lambda request, context: (
+            '<span class="pages">3</span><a href="/p/chair-{}/"></a>'.format(
+                3 if request.qs.get('page') == ['3'] else 1)
+        ))
+        urls = get_urls(scraper, source)
+
+    assert urls == [
+        'https://www.example.com/p/chair-1',
+        'https://www.example.com/p/chair-3'
+    ]
+
+
+def test_page_count_highest_match():
+    source = make_paginated_source(
+        pagination={'pageCountRegex': r'\?page=(?P<count>[0-9]+)'}
+    )
+    extractor = source.get_extractor()
+
+    assert extractor.extract_page_count(
+        '<a href="?page=2">2</a><a href="?page=12">12</a>'
+    ) == 12
+    assert extractor.extract_page_count('<a href="/">1</a>') is None
+
+
+def test_category_state_repeated_page():
+    state = CategoryState(set(), None)
+    categories = {Category(id=1, url='/cat/1')}
+    products = {Product(id=1, urls=['/p/chair-1'])}
+
+    assert state.update(categories, products)
+    assert not state.update(set(categories), set(products))
+    assert not CategoryState(set(), None).update(set(), set())
+    assert CategoryState(set(), None).update(set(), set(), probe=False)
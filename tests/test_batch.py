@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from pytest import raises
+from item_scrapers import batch
+
+
+def test_round_trip():
+    records = [
+        batch.encode_record(b'first'),
+        batch.encode_record(b'', 'tombstone'),
+        batch.encode_record(b'third' * 100)
+    ]
+    for compression in [None] + sorted(batch.CODECS):
+        body = batch.encode_batch(records, compression)
+        assert list(batch.decode_batch(body, compression)) == [
+            (None, b'first'), ('tombstone', b''), (None, b'third' * 100)
+        ]
+
+
+def test_truncated():
+    body = batch.encode_batch([batch.encode_record(b'item')])
+    with raises(ValueError):
+        list(batch.decode_batch(body[:-1]))
+
+
+def test_unsupported_compression():
+    with raises(ValueError):
+        batch.check_compression('brotli')
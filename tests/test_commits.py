@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from item_scrapers.commits import PendingCommits
+from pytest import raises
+
+
+def test_commit():
+    calls = []
+    pending = PendingCommits()
+    pending.add(lambda: calls.append('close'), lambda: calls.append('no'))
+    pending.add(lambda: calls.append('clear'))
+    assert len(pending) == 2
+
+    pending.commit()
+    pending.discard()
+    assert calls == ['clear', 'close']
+    assert len(pending) == 0
+
+
+def test_discard():
+    calls = []
+    pending = PendingCommits()
+    pending.add(lambda: calls.append('no'), lambda: calls.append('first'))
+    pending.add(lambda: calls.append('no'))
+    pending.discard()
+    assert calls == ['first']
+
+    # Settled, those added afterwards are discarded at once
+    pending.add(lambda: calls.append('no'), lambda: calls.append('late'))
+    assert calls == ['first', 'late']
+
+
+def test_failed_commit():
+    calls = []
+
+    def fail():
+        raise OSError('disk full')
+
+    pending = PendingCommits()
+    pending.add(lambda: calls.append('close'))
+    pending.add(fail)
+    with raises(OSError):
+        pending.commit()
+    assert calls == ['close']
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from mock import Mock
+from pytest import fixture
+from pika import frame, spec
+from item_scrapers import Publisher, Tombstone
+from item_scrapers.stream import ItemStream
+from item_scrapers.batch import CONTENT_TYPE, decode_batch
+from item_scrapers.metrics import (
+    CONFIRM_SECONDS, UNCONFIRMED, CONNECTION_BLOCKS, CONNECTION_BLOCKED_SECONDS
+)
+
+
+class Item:
+    def __init__(self, id):
+        self.id = id
+
+    def SerializeToString(self):
+        return self.id.encode()
+
+
+def ack(tag, multiple=False):
+    return frame.Method(1, spec.Basic.Ack(tag, multiple))
+
+
+def nack(tag, multiple=False):
+    return frame.Method(1, spec.Basic.Nack(tag, multiple))
+
+
+@fixture
+def publisher():
+    publisher = Publisher(
+        'amqp://localhost', 'app', 'exchange', 'items', 'queue',
+        max_unconfirmed=3, max_retries=2
+    )
+    publisher._reset()
+    publisher._connection = Mock()
+    publisher._channel = Mock(is_open=True)
+    publisher._queue_name = 'queue-source'
+    publisher._routing_key = 'items.source'
+    return publisher
+
+
+def make_stream(items):
+    stream = ItemStream(100)
+    stream.produce(Publisher._feed, items, stream)
+    return stream
+
+
+def start(publisher, count):
+    publisher._stream = make_stream([Item(str(i)) for i in range(count)])
+    publisher._on_started()
+
+
+def get_bodies(publisher):
+    return [
+        call[1]['body'].decode()
+        for call in publisher._channel.basic_publish.call_args_list
+    ]
+
+
+def test_window(publisher):
+    start(publisher, 5)
+
+    assert get_bodies(publisher) == ['0', '1', '2']
+    assert list(publisher._deliveries) == [1, 2, 3]
+
+    # Publishing resumes at the low watermark
+    publisher._on_delivery_confirmation(ack(2))
+    publisher._publish_next()
+    assert get_bodies(publisher) == ['0', '1', '2']
+
+    publisher._on_delivery_confirmation(ack(1))
+    publisher._publish_next()
+    assert get_bodies(publisher) == ['0', '1', '2', '3', '4']
+    assert list(publisher._deliveries) == [3, 4, 5]
+
+
+def test_multiple(publisher):
+    start(publisher, 3)
+    publisher._on_delivery_confirmation(ack(2, multiple=True))
+
+    assert list(publisher._deliveries) == [3]
+    assert publisher.get_stats()['acked'] == 2
+
+    publisher._on_delivery_confirmation(ack(0, multiple=True))
+
+    assert not publisher._deliveries
+    assert publisher.get_stats()['acked'] == 3
+
+
+def test_confirm_metrics(publisher):
+    unconfirmed = UNCONFIRMED.labels().get()
+    counts, _ = CONFIRM_SECONDS.labels().get()
+    start(publisher, 3)
+
+    assert UNCONFIRMED.labels().get() - unconfirmed == 3
+
+    publisher._on_delivery_confirmation(ack(2, multiple=True))
+
+    assert UNCONFIRMED.labels().get() - unconfirmed == 1
+    assert sum(CONFIRM_SECONDS.labels().get()[0]) - sum(counts) == 2
+
+
+def test_finish_after_confirms(publisher):
+    start(publisher, 2)
+    publisher._publish_next()
+    assert not publisher._done
+
+    publisher._on_delivery_confirmation(ack(2, multiple=True))
+    publisher._publish_next()
+    assert publisher._done
+    assert not publisher._stopping
+    publisher._connection.close.assert_not_called()
+
+
+def test_nack_retry(publisher):
+    start(publisher, 2)
+    publisher._on_delivery_confirmation(nack(1))
+    publisher._on_delivery_confirmation(ack(2))
+    publisher._publish_next()
+
+    assert get_bodies(publisher) == ['0', '1', '0']
+
+    publisher._on_delivery_confirmation(nack(3))
+    publisher._publish_next()
+
+    assert publisher._done
+    stats = publisher.get_stats()
+    assert stats.pop('paused_seconds') == 0
+    assert stats.pop('confirm_wait_seconds') >= 0
+    assert stats == {
+        'published': 3,
+        'messages': 3,
+        'bytes': 3,
+        'acked': 1,
+        'nacked': 2,
+        'retried': 1,
+        'failed': 1,
+        'blocks': 0,
+        'blocked_seconds': 0
+    }
+
+
+def test_republish_on_new_channel(publisher):
+    start(publisher, 3)
+    publisher._on_delivery_confirmation(ack(1))
+
+    publisher._on_channel_open(Mock(is_open=True))
+    publisher._on_exchange_declareok(None)
+    publisher._on_bindok(None)
+
+    assert get_bodies(publisher) == ['1', '2']
+    assert list(publisher._deliveries) == [1, 2]
+
+
+def test_tombstone(publisher):
+    publisher._stream = make_stream([Tombstone(Item('0'))])
+    publisher._on_started()
+
+    properties = publisher._channel.basic_publish.call_args[1]['properties']
+    assert properties.type == 'tombstone'
+    assert isinstance(publisher._deliveries[1][0][0], Tombstone)
+
+
+def test_error(publisher):
+    def items():
+        yield Item('0')
+        raise ValueError()
+
+    publisher._stream = make_stream(items())
+    publisher._on_started()
+
+    assert publisher._done
+    assert isinstance(publisher._error, ValueError)
+
+
+def test_wait_for_items(publisher):
+    publisher._stream = ItemStream(100)
+    publisher._on_started()
+
+    assert not publisher._done
+    publisher._connection.ioloop.call_later.assert_called_once_with(
+        0.05, publisher._publish_next)
+
+    publisher._stream.put(Item('0'))
+    publisher._publish_next()
+    assert get_bodies(publisher) == ['0']
+
+
+def test_batch(publisher):
+    publisher._batch_size = 2
+    publisher._compression = 'zlib'
+    publisher._stream = make_stream([
+        Item('0'), Tombstone(Item('1')), Item('2')
+    ])
+    publisher._on_started()
+
+    calls = publisher._channel.basic_publish.call_args_list
+    assert len(calls) == 2
+
+    properties = calls[0][1]['properties']
+    assert properties.content_type == CONTENT_TYPE
+    assert properties.content_encoding == 'zlib'
+    assert list(decode_batch(calls[0][1]['body'], 'zlib')) == \
+        [(None, b'0'), ('tombstone', b'1')]
+    assert list(decode_batch(calls[1][1]['body'], 'zlib')) == [(None, b'2')]
+
+    publisher._on_delivery_confirmation(nack(1))
+    publisher._on_delivery_confirmation(ack(2))
+    publisher._publish_next()
+    publisher._on_delivery_confirmation(ack(3))
+    publisher._publish_next()
+
+    assert publisher._done
+    stats = publisher.get_stats()
+    assert stats['published'] == 5
+    assert stats['messages'] == 3
+    assert stats['acked'] == 3
+    assert stats['retried'] == 2
+
+
+def test_batch_max_delay(publisher, monkeypatch):
+    publisher._batch_size = 10
+    publisher._batch_max_delay = 1.0
+    publisher._stream = ItemStream(100)
+    publisher._stream.put(Item('0'))
+
+    now = [100.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+    publisher._on_started()
+    publisher._publish_next()
+    assert not publisher._channel.basic_publish.called
+
+    now[0] += 1.0
+    publisher._publish_next()
+    assert get_bodies(publisher) == ['\x00\x00\x00\x00\x010']
+
+
+def test_connection_blocked(publisher, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+    blocked = frame.Method(0, spec.Connection.Blocked('memory alarm'))
+    unblocked = frame.Method(0, spec.Connection.Unblocked())
+    blocks = CONNECTION_BLOCKS.labels().get()
+    blocked_seconds = CONNECTION_BLOCKED_SECONDS.labels().get()
+
+    publisher._on_connection_blocked(None, blocked)
+    start(publisher, 2)
+    assert not publisher._channel.basic_publish.called
+
+    now[0] += 2.5
+    assert publisher.get_stats()['blocked_seconds'] == 2.5
+    publisher._on_connection_unblocked(None, unblocked)
+    publisher._publish_next()
+    assert get_bodies(publisher) == ['0', '1']
+
+    now[0] += 1
+    stats = publisher.get_stats()
+    assert stats['blocks'] == 1
+    assert stats['blocked_seconds'] == 2.5
+    assert CONNECTION_BLOCKS.labels().get() - blocks == 1
+    assert CONNECTION_BLOCKED_SECONDS.labels().get() - blocked_seconds == 2.5
+
+
+def test_paused_and_confirm_wait(publisher, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+    start(publisher, 4)
+
+    now[0] += 2
+    publisher._on_delivery_confirmation(ack(1))
+    publisher._publish_next()
+    assert publisher.get_stats()['paused_seconds'] == 2
+
+    now[0] += 1
+    publisher._on_delivery_confirmation(ack(2))
+    publisher._publish_next()
+    assert get_bodies(publisher) == ['0', '1', '2', '3']
+
+    now[0] += 1.5
+    assert publisher.get_stats()['confirm_wait_seconds'] == 1.5
+    publisher._on_delivery_confirmation(ack(4, multiple=True))
+    publisher._publish_next()
+
+    now[0] += 1
+    stats = publisher.get_stats()
+    assert publisher._done
+    assert stats['paused_seconds'] == 3
+    assert stats['confirm_wait_seconds'] == 1.5
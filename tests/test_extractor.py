@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from pytest import fixture
+from item_scrapers.extractor import Extractor
+
+
+HTML = '''
+<a href="/cat/chairs-10/">Chairs</a>
+<a href="/p/oak-chair-123/?color=red">Oak chair</a>
+<a href="/cat/tables-11#top">Tables</a>
+<a href="/p/big-table-456/">Big table</a>
+<a href="/p/big-table-456/">Big table again</a>
+<a href="/other/1/">Other</a>
+'''
+
+
+@fixture
+def extractor():
+    return Extractor(
+        '/cat/(?P<slug>[a-z-]+)-(?P<id>[0-9]+)',
+        '/p/(?P<slug>[a-z-]+)-(?P<id>[0-9]+)'
+    )
+
+
+def test_extract(extractor):
+    categories, products = extractor.extract(
+        HTML, 'https://www.example.com/en/'
+    )
+
+    assert sorted((c.id, c.url, c.slug) for c in categories) == [
+        ('10', 'https://www.example.com/en/cat/chairs-10', 'chairs'),
+        ('11', 'https://www.example.com/en/cat/tables-11', 'tables')
+    ]
+    assert sorted((p.id, p.urls[0], p.slug) for p in products) == [
+        ('123', 'https://www.example.com/en/p/oak-chair-123', 'oak-chair'),
+        ('456', 'https://www.example.com/en/p/big-table-456', 'big-table')
+    ]
+
+
+def test_extract_url_matching_both():
+    extractor = Extractor('/shop/(?P<id>[a-z]+)', '/shop/(?P<id>[a-z]+)')
+    categories, products = extractor.extract('<a href="/shop/sofas/">', '/')
+
+    assert [c.id for c in categories] == ['sofas']
+    assert [p.id for p in products] == ['sofas']
+
+
+def test_stats(extractor):
+    extractor.extract(HTML, '/')
+    extractor.extract(HTML, '/')
+
+    stats = extractor.get_stats()
+    assert stats['pages'] == 2
+    assert stats['scanned'] == 2 * len(HTML)
+
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_extract_chunks_same_as_extract(extractor):
+    html = HTML * 20
+    expected = extractor.extract(html, '/')
+
+    for size in (1, 7, 64, 1000, len(html)):
+        categories, products = extractor.extract_chunks(
+            split(html, size), '/', overlap=64
+        )
+        assert {c.url for c in categories} == {c.url for c in expected[0]}
+        assert {p.urls[0] for p in products} == \
+            {p.urls[0] for p in expected[1]}
+
+
+def test_iter_extract_yields_as_chunks_arrive(extractor):
+    chunks = split(HTML, 16) + ['x' * 100]
+    found = list(extractor.iter_extract(iter(chunks), '/', overlap=64))
+
+    # Everything is known before the last chunk is processed
+    categories = set().union(*(c for c, _ in found[:-1]))
+    assert {c.id for c in categories} == {'10', '11'}
+
+
+def test_extract_chunks_empty(extractor):
+    assert extractor.extract_chunks([], '/', overlap=64) == (set(), set())
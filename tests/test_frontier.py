@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from pytest import raises
+from item_scrapers.frontier import Frontier, create_frontier
+from item_scrapers.models import Category
+
+
+def category(id):
+    return Category(id=id, url='https://www.example.com/{}'.format(id))
+
+
+def drain(frontier):
+    ids = []
+    while frontier:
+        cat, _ = frontier.pop()
+        ids.append(cat.id)
+    return ids
+
+
+def test_orders():
+    for order, expected in (('dfs', ['c', 'b', 'a']),
+                            ('bfs', ['a', 'b', 'c']),
+                            ('priority', ['b', 'c', 'a'])):
+        frontier = create_frontier(order)
+        frontier.push(category('a'), score=1)
+        frontier.push(category('b'), score=5)
+        frontier.push(category('c'), score=2)
+        assert drain(frontier) == expected
+
+
+def test_push_once():
+    frontier = create_frontier('bfs')
+    assert frontier.push(category('a'))
+    assert not frontier.push(category('a'))
+    assert category('a') in frontier
+    assert len(frontier) == 1
+
+
+def test_max_categories():
+    frontier = create_frontier('bfs', max_categories=2)
+    assert frontier.push(category('root'), root=True)
+    assert frontier.push(category('a'))
+    assert frontier.push(category('b'))
+    assert not frontier.push(category('c'))
+    assert frontier.admitted == 2
+
+
+def test_max_depth_and_size():
+    frontier = create_frontier('dfs', max_depth=1, max_size=2)
+    assert not frontier.push(category('deep'), depth=2)
+    assert frontier.push(category('a'), depth=1)
+    assert frontier.push(category('b'), depth=1)
+    assert not frontier.push(category('c'), depth=1)
+    assert frontier.dropped == 1
+    assert category('c') not in frontier
+
+
+def test_claim():
+    claimed = {'b'}
+    frontier = create_frontier('bfs', max_categories=2)
+    frontier.claim = lambda id: id not in claimed and not claimed.add(id)
+
+    frontier.push(category('root'), root=True)
+    for id in ('a', 'b', 'c', 'd'):
+        frontier.push(category(id), 1)
+
+    assert drain(frontier) == ['root', 'a', 'c']
+    assert claimed == {'a', 'b', 'c'}
+
+
+def test_unknown_order():
+    with raises(ValueError):
+        create_frontier('random')
+
+
+def test_incomplete_frontier():
+    class QueueFrontier(Frontier):
+        def _put(self, category, depth, score):
+            pass
+
+    with raises(TypeError):
+        QueueFrontier()
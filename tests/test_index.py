@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from item_scrapers.index import ProductIndex, IndexDiff, fingerprint, \
+    sort_fingerprints
+from item_scrapers.models import Product
+from array import array
+
+
+def product(id):
+    return Product(id=id, urls=['https://www.example.com/p/{}'.format(id)])
+
+
+def crawl(path, ids):
+    diff = IndexDiff(path)
+    added = [id for id in ids if diff.add(product(id))]
+    removed = list(diff.iter_removed())
+    diff.save()
+    return diff, added, removed
+
+
+def test_index_lookup(tmp_path):
+    path = str(tmp_path / 'index.idx')
+    ids = [str(i) for i in range(100)]
+    fingerprints = [fingerprint(id) for id in ids]
+    ProductIndex.write(
+        path, fingerprints, lambda i: product(ids[i]).urls[0]
+    )
+
+    index = ProductIndex(path)
+    assert len(index) == 100
+    assert list(index.fingerprints) == sorted(fingerprints)
+    assert all(fp in index for fp in fingerprints)
+    assert fingerprint('unknown') not in index
+
+    i = list(index.fingerprints).index(fingerprint('42'))
+    assert index.get_url(i) == 'https://www.example.com/p/42'
+    index.close()
+
+
+def test_missing_index(tmp_path):
+    index = ProductIndex(str(tmp_path / 'missing.idx'))
+    assert len(index) == 0
+    assert fingerprint('1') not in index
+
+
+def test_diff(tmp_path):
+    path = str(tmp_path / 'source' / 'en_None.idx')
+
+    diff, added, removed = crawl(path, ['1', '2', '3'])
+    assert added == ['1', '2', '3']
+    assert removed == []
+
+    diff, added, removed = crawl(path, ['2', '3', '4'])
+    assert added == ['4']
+    assert removed == ['https://www.example.com/p/1']
+    assert (diff.added, diff.removed, diff.unchanged) == (1, 1, 2)
+
+
+def test_diff_changed_url(tmp_path):
+    path = str(tmp_path / 'source' / 'en_None.idx')
+    crawl(path, ['1', '2'])
+
+    diff = IndexDiff(path)
+    assert not diff.add(product('1'))
+    assert diff.add(Product(id='2', urls=['https://www.example.com/q/2']))
+    assert list(diff.iter_removed()) == []
+    diff.save()
+    assert (diff.added, diff.changed, diff.unchanged) == (0, 1, 1)
+
+    index = ProductIndex(path)
+    assert index.get_url(index.find(fingerprint('2'))) == \
+        'https://www.example.com/q/2'
+    index.close()
+
+
+def test_sort_fingerprints(monkeypatch):
+    monkeypatch.setattr('item_scrapers.index.SORT_RUN_SIZE', 7)
+    fingerprints = array('Q', (fingerprint(str(i)) for i in range(100)))
+    order = sort_fingerprints(fingerprints)
+    assert isinstance(order, array)
+    assert [fingerprints[i] for i in order] == sorted(fingerprints)
+    assert len(sort_fingerprints(array('Q'))) == 0
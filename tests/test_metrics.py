@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import requests
+import requests_mock
+from pytest import fixture
+from item_scrapers import Scraper, metrics
+from item_scrapers.stats import PhaseTimings
+from .scrapers.catalog import make_source, mock_pages
+
+
+@fixture
+def registry():
+    return metrics.Registry()
+
+
+def test_render(registry):
+    counter = metrics.Counter('pages_total', 'Pages', ['source'],
+                              registry=registry)
+    histogram = metrics.Histogram('fetch_seconds', 'Fetches',
+                                  buckets=(0.1, 1.), registry=registry)
+    counter.labels('a"b').inc()
+    counter.labels('a"b').inc(2)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert metrics.render(metrics.merge_snapshots([registry.snapshot()])) \
+        == '''# HELP pages_total Pages
+# TYPE pages_total counter
+pages_total{source="a\\"b"} 3
+# HELP fetch_seconds Fetches
+# TYPE fetch_seconds histogram
+fetch_seconds_bucket{le="0.1"} 1
+fetch_seconds_bucket{le="1"} 2
+fetch_seconds_bucket{le="+Inf"} 3
+fetch_seconds_sum 5.55
+fetch_seconds_count 3
+'''
+
+
+def test_merge_snapshots(registry):
+    counter = metrics.Counter('items_total', 'Items', ['source'],
+                              registry=registry)
+    histogram = metrics.Histogram('seconds', 'Seconds', buckets=(1.,),
+                                  registry=registry)
+    counter.labels('a').inc(2)
+    histogram.observe(0.5)
+    snapshot = registry.snapshot()
+    counter.labels('b').inc()
+
+    merged = {
+        metric['name']: {
+            tuple(labels): value for labels, value in metric['samples']
+        }
+        for metric in metrics.merge_snapshots([snapshot, registry.snapshot()])
+    }
+
+    assert merged['items_total'] == {('a',): 4, ('b',): 1}
+    assert merged['seconds'] == {(): [[2, 0], 1.]}
+    # Snapshots are left untouched
+    assert snapshot[1]['samples'] == [[[], [[1, 0], 0.5]]]
+
+
+def test_stale_gauges_dropped(registry, tmp_path):
+    metrics.Counter('items_total', 'Items', registry=registry).inc()
+    metrics.Gauge('unconfirmed', 'Unconfirmed', registry=registry).set(5)
+    writer = metrics.SnapshotWriter(str(tmp_path), registry=registry)
+    writer.write()
+    path = os.path.join(str(tmp_path), 'other-1.json')
+    os.rename(writer.path, path)
+
+    assert 'unconfirmed 5' in metrics.collect(
+        str(tmp_path), max_age=60, registry=metrics.Registry())
+
+    os.utime(path, (0, 0))
+    text = metrics.collect(str(tmp_path), max_age=60,
+                           registry=metrics.Registry())
+    assert 'items_total 1' in text
+    assert 'unconfirmed' not in text
+
+
+def test_own_snapshot_not_counted_twice(registry, tmp_path):
+    metrics.Counter('items_total', 'Items', registry=registry).inc()
+    metrics.SnapshotWriter(str(tmp_path), registry=registry).write()
+
+    assert 'items_total 1\n' in metrics.collect(str(tmp_path),
+                                                registry=registry)
+
+
+def test_exporter(registry):
+    metrics.Counter('items_total', 'Items', registry=registry).inc()
+    exporter = metrics.Exporter(
+        0, lambda: metrics.collect(registry=registry), host='127.0.0.1'
+    )
+    exporter.start()
+    try:
+        url = 'http://127.0.0.1:{}'.format(exporter.port)
+        res = requests.get(url + '/metrics')
+        missing = requests.get(url + '/other')
+    finally:
+        exporter.stop()
+
+    assert res.headers['Content-Type'] == metrics.CONTENT_TYPE
+    assert 'items_total 1' in res.text
+    assert missing.status_code == 404
+
+
+def get_value(metric, *labels):
+    return metric.labels(*labels).get()
+
+
+def test_scraper_instrumented():
+    source = make_source()
+    responses = get_value(metrics.RESPONSES, source.name, 200)
+    items = get_value(metrics.ITEMS, source.name)
+    downloaded = get_value(metrics.DOWNLOADED_BYTES, source.name)
+
+    with requests_mock.mock() as m:
+        mock_pages(m)
+        count = sum(1 for _ in Scraper().scrape(source))
+
+    assert get_value(metrics.ITEMS, source.name) - items == count
+    assert get_value(metrics.RESPONSES, source.name, 200) > responses
+    assert get_value(metrics.DOWNLOADED_BYTES, source.name) > downloaded
+    counts, _ = get_value(metrics.FETCH_SECONDS, source.name,
+                          'www.example.com')
+    assert sum(counts)
+
+
+def test_downloaded_bytes_not_characters():
+    source = make_source(extraction={'mode': 'chunked', 'chunkSize': 7})
+    body = '<a href="/p/café-1/"></a><a href="/p/chair-2/"></a>é'.encode()
+    downloaded = get_value(metrics.DOWNLOADED_BYTES, source.name)
+    timings = PhaseTimings()
+
+    with requests_mock.mock() as m:
+        m.get('https://www.example.com/cat/1/', content=body,
+              headers={'Content-Type': 'text/html; charset=utf-8'})
+        _, products, _ = Scraper()._scrape_page(
+            'https://www.example.com/cat/1/', {}, source, 'en', None,
+            timings=timings
+        )
+
+    assert [p.urls for p in products] == [
+        ['https://www.example.com/p/chair-2']
+    ]
+    assert get_value(metrics.DOWNLOADED_BYTES, source.name) - downloaded == \
+        len(body)
+    assert timings.get_counts()['bytes'] == len(body)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from mock import Mock
+from pytest import raises
+from item_scrapers import Outbox, Tombstone
+from item_scrapers.outbox import RawItem, SegmentWriter
+import threading
+import time
+import os
+
+
+class Publisher:
+    def __init__(self, failed=0):
+        self.published = []
+        self.failed = failed
+
+    def publish(self, source, items):
+        items = list(items)
+        self.published.append([
+            (isinstance(item, Tombstone),
+             (item.item if isinstance(item, Tombstone) else item)
+             .SerializeToString())
+            for item in items
+        ])
+        return {'published': len(items), 'failed': self.failed}
+
+
+def make_items(count):
+    return [RawItem('item-{}'.format(i).encode()) for i in range(count)]
+
+
+def test_write_and_drain(tmp_path):
+    source = Mock()
+    source.name = 'source'
+    outbox = Outbox.create(str(tmp_path), source, segment_size=50)
+    assert outbox.directory == str(tmp_path / 'source')
+    items = make_items(10) + [Tombstone(RawItem(b'removed'))]
+    assert outbox.write(items) == 11
+    assert outbox.get_pending() == 3
+
+    publisher = Publisher()
+    stats = outbox.drain(publisher, Mock())
+
+    assert [len(segment) for segment in publisher.published] == [4, 4, 3]
+    assert publisher.published[-1][-1] == (True, b'removed')
+    assert stats == {'published': 11, 'failed': 0, 'pending_segments': 0}
+
+
+def test_failed_segment_kept(tmp_path):
+    outbox = Outbox(str(tmp_path), segment_size=50)
+    outbox.write(make_items(6))
+
+    stats = outbox.drain(Publisher(failed=1), Mock())
+    assert stats['pending_segments'] == 2
+
+    publisher = Publisher()
+    outbox.drain(publisher, Mock())
+    assert len(publisher.published) == 2
+
+
+def test_sealed_on_error(tmp_path):
+    def items():
+        yield from make_items(2)
+        raise ValueError()
+
+    outbox = Outbox(str(tmp_path))
+    with raises(ValueError):
+        outbox.write(items())
+    assert outbox.get_pending() == 1
+
+
+def test_recover(tmp_path):
+    # Segment of a crashed writer, with a torn record at the end
+    path = str(tmp_path / '00000000000000000001-1.log')
+    segment = SegmentWriter(path, sync_interval=0)
+    for item in make_items(3):
+        segment.append(item)
+    os.close(segment._fd)
+    with open(path, 'ab') as f:
+        f.write(b'\x00\x00\x00\x00\x10')
+
+    # Segment of a live writer
+    live = SegmentWriter(str(tmp_path / '00000000000000000002-1.log'), 0)
+    live.append(RawItem(b'live'))
+
+    outbox = Outbox(str(tmp_path))
+    assert outbox.get_pending() == 1
+    assert os.path.exists(live.path)
+
+    publisher = Publisher()
+    outbox.drain(publisher, Mock())
+    assert publisher.published == [
+        [(False, 'item-{}'.format(i).encode()) for i in range(3)]
+    ]
+
+
+def test_drain_while_writing(tmp_path):
+    # Segments sealed by age are drained before the items run out
+    outbox = Outbox(str(tmp_path), segment_max_age=0)
+    publisher = Publisher()
+    written = threading.Event()
+    drained = []
+
+    def items():
+        for item in make_items(3):
+            yield item
+            while outbox.get_pending():
+                time.sleep(0.01)
+            drained.append(len(publisher.published))
+        written.set()
+
+    writer = threading.Thread(target=outbox.write, args=(items(),))
+    writer.start()
+    stats = outbox.drain_until(publisher, Mock(), written, interval=0.01)
+    writer.join()
+
+    assert drained == [1, 2, 3]
+    assert stats == {'published': 3, 'failed': 0, 'pending_segments': 0}
+
+
+def test_drain_while_waiting_for_items(tmp_path):
+    # The last segment of a stalled writer is sealed by the drainer
+    outbox = Outbox(str(tmp_path), segment_max_age=0.1)
+    publisher = Publisher()
+    written = threading.Event()
+
+    def items():
+        yield from make_items(1)
+        deadline = time.monotonic() + 5
+        while not publisher.published and time.monotonic() < deadline:
+            time.sleep(0.01)
+        written.set()
+
+    writer = threading.Thread(target=outbox.write, args=(items(),))
+    writer.start()
+    stats = outbox.drain_until(publisher, Mock(), written, interval=0.01)
+    writer.join()
+
+    assert stats == {'published': 1, 'failed': 0, 'pending_segments': 0}
+
+
+def test_drain_until_failed(tmp_path):
+    outbox = Outbox(str(tmp_path), segment_size=50)
+    outbox.write(make_items(6))
+
+    stats = outbox.drain_until(Publisher(failed=1), Mock(), threading.Event())
+    assert stats['pending_segments'] == 2
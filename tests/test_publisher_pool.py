@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from mock import Mock
+from item_scrapers import Publisher, PublisherPool
+from item_scrapers.stream import ItemStream
+import threading
+import os
+
+
+def create_publisher():
+    return Publisher(
+        'amqp://localhost', 'app', 'exchange', 'items', 'queue'
+    )
+
+
+def test_pool_per_thread():
+    pool = PublisherPool(create_publisher)
+    publisher = pool.get()
+    assert pool.get() is publisher
+
+    publishers = []
+    thread = threading.Thread(target=lambda: publishers.append(pool.get()))
+    thread.start()
+    thread.join()
+
+    assert publishers[0] is not publisher
+    assert len(pool) == 2
+
+
+def test_pool_fork(monkeypatch):
+    pool = PublisherPool(create_publisher)
+    publisher = pool.get()
+
+    pid = os.getpid()
+    monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+    assert pool.get() is not publisher
+    assert len(pool) == 1
+
+
+def test_topology_cached():
+    publisher = create_publisher()
+    publisher._reset()
+    publisher._connection = Mock()
+
+    def publish(name, callbacks):
+        publisher._queue_name = 'queue-{}'.format(name)
+        publisher._routing_key = 'items.{}'.format(name)
+        publisher._stream = ItemStream(1)
+        publisher._stream.produce(lambda: None)
+        publisher._done = False
+        for callback in callbacks:
+            callback()
+        assert publisher._done
+
+    publish('a', [
+        lambda: publisher._on_channel_open(Mock(is_open=True)),
+        lambda: publisher._on_exchange_declareok(None),
+        lambda: publisher._on_bindok(None)
+    ])
+    publish('b', [publisher._resume, lambda: publisher._on_bindok(None)])
+    publish('a', [publisher._resume])
+
+    channel = publisher._channel
+    assert channel.exchange_declare.call_count == 1
+    assert channel.queue_declare.call_count == 2
+    assert channel.confirm_delivery.call_count == 1
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+from pytest import approx
+from item_scrapers.ratelimit import TokenBucket, FileTokenBucket, RateLimiter
+
+
+def test_token_bucket_burst():
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == approx(0.5, abs=0.01)
+    assert bucket.reserve() == approx(1, abs=0.01)
+
+
+def test_file_token_bucket_is_shared(tmp_path):
+    path = str(tmp_path / 'host.bucket')
+    first = FileTokenBucket(path, rate=0.5, burst=1)
+    second = FileTokenBucket(path, rate=0.5, burst=1)
+
+    assert first.reserve() == 0
+    assert second.reserve() == approx(2, abs=0.01)
+    assert first.reserve() == approx(4, abs=0.01)
+
+
+def test_file_token_bucket_from_the_future(tmp_path):
+    path = str(tmp_path / 'host.bucket')
+    with open(path, 'wb') as f:
+        f.write(FileTokenBucket._STATE.pack(-1., time.monotonic() + 3600))
+    bucket = FileTokenBucket(path, rate=1, burst=1)
+
+    assert bucket.reserve() == 0
+
+
+def test_token_bucket_clock_behind():
+    bucket = TokenBucket(rate=1, burst=1)
+    state, delay = bucket._take(1., time.monotonic() + 3600)
+    assert delay == 0
+    assert state[0] == 0
+
+
+def test_rate_limiter_per_host(tmp_path):
+    limiter = RateLimiter(str(tmp_path))
+    assert limiter.reserve('https://www.example.com/a', 1) == 0
+    assert limiter.reserve('https://www.example.com/b', 1) > 0
+    assert limiter.reserve('https://www.example.org/a', 1) == 0
+    assert limiter.get_bucket('https://www.example.com/', 1) is \
+        limiter.get_bucket('https://www.example.com/c', 1)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import yaml
+from pytest import fixture, raises
+from item_scrapers import Source, SourceRegistry
+
+CONFIG = {
+    'langs': ['en'],
+    'baseUrl': 'https://www.example.com',
+    'categories': {
+        'urlRegex': '/cat/(?P<id>[0-9]+)',
+        'pagination': {'mode': 'queryParam', 'key': 'page', 'end': 3}
+    },
+    'products': {'urlRegex': '/p/(?P<id>[0-9]+)'}
+}
+
+
+def write_source(directory, name, config=None, mtime=None):
+    path = directory.joinpath('{}.yml'.format(name))
+    path.write_text(yaml.safe_dump(config or CONFIG))
+    if mtime is not None:
+        os.utime(str(path), ns=(mtime, mtime))
+    return path
+
+
+@fixture
+def directory(tmp_path):
+    directory = tmp_path / 'sources'
+    directory.mkdir()
+    write_source(directory, 'example', mtime=10 ** 18)
+    return directory
+
+
+def test_load(directory):
+    directory.joinpath('nested').mkdir()
+    write_source(directory / 'nested', 'other')
+    directory.joinpath('notes.txt').write_text('not a source')
+    registry = SourceRegistry(str(directory))
+
+    assert registry.get_names() == ['example', 'other']
+    assert 'example' in registry
+    assert registry.get('unknown') is None
+    assert registry.get('example').get_base_url('en', None) == \
+        'https://www.example.com'
+
+
+def test_reload(directory):
+    registry = SourceRegistry(str(directory), reload_interval=0)
+    source = registry.get('example')
+
+    # Touched only
+    write_source(directory, 'example', mtime=10 ** 18 + 1)
+    assert registry.reload() == []
+    assert registry.get('example') is source
+
+    write_source(directory, 'example', dict(CONFIG, engine='async'),
+                 mtime=10 ** 18 + 2)
+    write_source(directory, 'other')
+    assert registry.get('example').get_engine() == 'async'
+    assert registry.get_names() == ['example', 'other']
+    # The previous source is left as it was for crawls still using it
+    assert source.get_engine() == 'sync'
+
+    directory.joinpath('other.yml').unlink()
+    assert registry.reload() == ['other']
+    assert 'other' not in registry
+
+
+def test_reload_interval(directory):
+    registry = SourceRegistry(str(directory), reload_interval=3600)
+    write_source(directory, 'other')
+
+    assert 'other' not in registry
+    assert registry.reload() == ['other']
+
+
+def test_invalid_source_kept(directory):
+    registry = SourceRegistry(str(directory))
+    source = registry.get('example')
+    write_source(directory, 'example', dict(CONFIG, engine='threads'),
+                 mtime=10 ** 18 + 1)
+    write_source(directory, 'broken', {'langs': ['en']})
+
+    assert registry.reload() == []
+    assert registry.get('example') is source
+    assert 'broken' not in registry
+    assert registry.get_stats()['failed'] == 2
+
+
+def test_cache(directory, tmp_path, monkeypatch):
+    cache = str(tmp_path / 'cache')
+    SourceRegistry(str(directory), cache_directory=cache)
+
+    # Files of the same mtime and size are not read again
+    write_source(directory, 'example', dict(CONFIG, langs=['fr']),
+                 mtime=10 ** 18)
+    registry = SourceRegistry(str(directory), cache_directory=cache)
+    assert registry.get_stats() == {'loaded': 1, 'cached': 1, 'failed': 0}
+    assert registry.get('example').get_langs() == ['en']
+
+    # Nor parsed again when only touched
+    def safe_load(data):
+        raise AssertionError('parsed')
+
+    write_source(directory, 'example', mtime=10 ** 18 + 1)
+    monkeypatch.setattr('yaml.safe_load', safe_load)
+    registry = SourceRegistry(str(directory), cache_directory=cache)
+    assert registry.get('example').get_langs() == ['en']
+    monkeypatch.undo()
+
+    write_source(directory, 'example', dict(CONFIG, langs=['fr']),
+                 mtime=10 ** 18 + 2)
+    registry = SourceRegistry(str(directory), cache_directory=cache)
+    assert registry.get_stats()['cached'] == 0
+    assert registry.get('example').get_langs() == ['fr']
+
+
+def test_source_compiled():
+    source = Source('example', dict(
+        CONFIG,
+        langs=['en', 'fr'],
+        brands=['a', 'b'],
+        langSelector={'mode': 'baseUrlSuffix',
+                      'mapping': {'en': 'en-gb', 'fr': 'fr-fr'}},
+        brandSelector={'mode': 'categoryQueryParam',
+                       'mapping': {'a': {'brand': 1}, 'b': {'brand': 2}}},
+        rateLimit={'rate': 2}
+    ))
+
+    assert source.get_url_prefix('fr', 'a') == \
+        'https://www.example.com/fr-fr/'
+    assert source.get_rate_limit() == (2., 1)
+    category = type('Category', (), {'url': 'https://www.example.com/cat/1'})
+    assert [
+        (url, dict(params))
+        for url, params in source.paginate_category(category, 'en', 'b')
+    ] == [
+        ('https://www.example.com/cat/1', {'brand': 2}),
+        ('https://www.example.com/cat/1', {'brand': 2, 'page': 2})
+    ]
+
+
+@fixture(params=[
+    ({'langs': None}, 'langs is required'),
+    ({'engine': 'threads'}, 'engine must be one of sync, async'),
+    ({'products': {'urlRegex': '/p/[0-9]+'}}, 'products.urlRegex has no id'),
+    ({'products': {'urlRegex': '/p/(?P<id>[0-9]+'}}, 'missing \\)'),
+    ({'categories': {'urlRegex': '/cat/(?P<id>[0-9]+)',
+                     'pagination': {'mode': 'queryParam'}}},
+     'categories.pagination.key is required'),
+    ({'langSelector': {'mode': 'baseUrlTLD', 'mapping': {}}},
+     'langSelector.mapping misses en'),
+    ({'http': {'timeout': 'soon'}}, 'could not convert')
+])
+def invalid(request):
+    return request.param
+
+
+def test_invalid_source(invalid):
+    config, message = invalid
+    with raises(ValueError, match='Invalid source example: .*' + message):
+        Source('example', dict(CONFIG, **config))
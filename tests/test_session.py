@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from requests.cookies import MockRequest, MockResponse
+from http.client import HTTPMessage
+import requests_mock
+import requests
+from pytest import fixture
+from item_scrapers.session import SessionPool
+
+
+@fixture
+def pool():
+    return SessionPool()
+
+
+def test_get_reuses_session_per_host(pool):
+    session = pool.get('https://www.example.com/page/1')
+    assert pool.get('https://www.example.com/page/2?p=1') is session
+    assert pool.get('http://www.example.com/page/1') is not session
+    assert pool.get('https://www.example.org/page/1') is not session
+    assert len(pool) == 3
+
+
+def test_get_configures_adapter(pool):
+    session = pool.get('https://www.example.com/', pool_size=4, retries=3)
+    adapter = session.get_adapter('https://www.example.com/')
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 3
+
+
+def test_get_per_configuration(pool):
+    session = pool.get('https://www.example.com/', pool_size=4)
+    assert pool.get('https://www.example.com/', pool_size=4) is session
+    assert pool.get('https://www.example.com/', pool_size=8) is not session
+    assert pool.get('https://www.example.com/', pool_size=4,
+                    retries=0) is not session
+    assert pool.get('https://www.example.com/', pool_size=4,
+                    backoff_factor=1.) is not session
+
+
+def test_get_after_fork(pool, monkeypatch):
+    session = pool.get('https://www.example.com/')
+    monkeypatch.setattr(pool, '_pid', -1)
+    assert pool.get('https://www.example.com/') is not session
+
+
+def test_close(pool):
+    pool.get('https://www.example.com/')
+    pool.close()
+    assert len(pool) == 0
+
+
+def test_cookies_not_carried_over(pool):
+    session = pool.get('https://www.example.com/')
+    # Stores the cookies of a response the way the session does
+    headers = HTTPMessage()
+    headers['Set-Cookie'] = 'lang=en; Path=/'
+    request = requests.Request('GET', 'https://www.example.com/en/')
+    session.cookies.extract_cookies(
+        MockResponse(headers), MockRequest(request.prepare())
+    )
+    assert len(session.cookies) == 0
+
+    with requests_mock.mock() as m:
+        m.get('https://www.example.com/fr/')
+        session.get('https://www.example.com/fr/')
+    assert 'Cookie' not in m.request_history[-1].headers
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+from item_scrapers import ScrapeStats
+from item_scrapers.profiler import StackSampler
+from item_scrapers.stats import PhaseTimings
+
+
+def test_nested_phases_not_counted_twice(monkeypatch):
+    now = [0.]
+    monkeypatch.setattr('time.perf_counter', lambda: now[0])
+    timings = PhaseTimings()
+
+    with timings.measure('dedupe'):
+        now[0] += 1
+        with timings.measure('emit'):
+            now[0] += 2
+        now[0] += 0.5
+    timings.add('rate_limit', 0.25)
+
+    assert timings.get_seconds() == {
+        'dedupe': 1.5, 'emit': 2, 'rate_limit': 0.25
+    }
+
+
+def test_timings_summed_over_combinations():
+    stats = ScrapeStats()
+    for pages in (2, 3):
+        timings = PhaseTimings()
+        timings.add('fetch', 0.5)
+        timings.count('pages', pages)
+        stats.add_combination('en', None, 1, 1, 1., timings=timings)
+
+    result = stats.to_dict()
+    assert result['timings'] == {'fetch': 1.}
+    assert result['counts'] == {'pages': 5}
+    assert result['combinations'][0]['counts'] == {'pages': 2}
+
+
+def test_no_timings():
+    stats = ScrapeStats()
+    stats.add_combination('en', None, 1, 1, 1.)
+
+    assert 'timings' not in stats.to_dict()
+
+
+def test_profiler(tmp_path):
+    def busy():
+        end = time.monotonic() + 0.2
+        while time.monotonic() < end:
+            pass
+
+    sampler = StackSampler(interval=0.005)
+    sampler.start()
+    busy()
+    sampler.stop()
+
+    path = str(tmp_path / 'profile.folded')
+    sampler.save(path)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert sampler.samples > 0
+    assert any(';busy (test_stats.py:' in line for line in lines)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
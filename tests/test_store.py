@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from pytest import raises
+from item_scrapers.models import Product, Category
+from item_scrapers.store import (
+    FingerprintSet, BloomFilter, ProductStore, create_product_set
+)
+
+
+def test_equality():
+    assert Product(id='1', urls=['/a']) == Product(id='1', urls=['/b'])
+    assert Product(id='1', urls=['/a']) != Product(id='2', urls=['/a'])
+    assert Category(id='1', url='/a') != Category(id='2', url='/a')
+    assert len({Product(id=str(i % 3), urls=[]) for i in range(9)}) == 3
+
+
+def test_fingerprint_set():
+    ids = FingerprintSet(capacity=4)
+    ids.update(str(i) for i in range(1000))
+    ids.add('10')
+
+    assert len(ids) == 1000
+    assert all(str(i) in ids for i in range(1000))
+    assert '1000' not in ids
+
+
+def test_bloom_filter():
+    ids = BloomFilter(capacity=1000, error_rate=0.01)
+    ids.update(str(i) for i in range(1000))
+
+    assert all(str(i) in ids for i in range(1000))
+    false_positives = sum(str(i) in ids for i in range(1000, 11000))
+    assert false_positives < 300
+    assert ids.get_memory_size() < 2000
+
+
+def test_product_store():
+    products = [
+        Product(id='1', urls=['https://www.example.com/p/chair-1'],
+                slug='chair'),
+        Product(id='2', urls=['https://www.example.com/p/table-2',
+                              'https://www.example.com/p/table-2-bis']),
+        Product(id='3', urls=['lamp-3'])
+    ]
+    store = ProductStore()
+    store.extend(products)
+
+    assert len(store) == 3
+    assert [(p.id, p.urls, p.slug) for p in store] == \
+        [(p.id, p.urls, p.slug) for p in products]
+
+
+def test_unknown_mode():
+    with raises(ValueError):
+        create_product_set('random')
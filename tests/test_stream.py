@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from pytest import raises
+from item_scrapers.stream import ItemStream, StreamClosed, StreamEnd
+import queue
+
+
+def produce(stream, items):
+    for item in items:
+        stream.put(item)
+
+
+def fail(stream):
+    stream.put(1)
+    raise ValueError('boom')
+
+
+def test_iter_merges_producers():
+    stream = ItemStream(2)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        executor.submit(stream.produce, produce, stream, range(10))
+        executor.submit(stream.produce, produce, stream, range(10, 20))
+        assert sorted(stream.iter(2)) == list(range(20))
+
+
+def test_iter_raises_producer_error():
+    stream = ItemStream(2)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(stream.produce, fail, stream)
+        with raises(ValueError):
+            list(stream.iter(1))
+
+
+def test_put_after_close():
+    stream = ItemStream(1)
+    stream.put(1)
+    stream.close()
+    with raises(StreamClosed):
+        stream.put(2)
+
+
+def test_get_nowait():
+    stream = ItemStream(2)
+    with raises(queue.Empty):
+        stream.get_nowait()
+
+    stream.produce(produce, stream, [1])
+    assert stream.get_nowait() == 1
+    with raises(StreamEnd):
+        stream.get_nowait()
+
+    stream.produce(fail, stream)
+    assert stream.get_nowait() == 1
+    with raises(ValueError):
+        stream.get_nowait()